@@ -1,4 +1,5 @@
 import os
+from multiprocessing import current_process
 
 from flask import Flask
 from config import Config
@@ -20,6 +21,8 @@ def create_app(config_class=Config):
     _load_env()
     app = Flask(__name__)
     app.config.from_object(config_class)
+    # worker processes build their app from the same class (see app.jobs)
+    app.config["CONFIG_CLASS"] = config_class
     app.config["USE_GEMINI"] = os.getenv("USE_GEMINI", "false").lower() == "true"
     app.config["GOOGLE_AI_API_KEY"] = os.getenv("GOOGLE_AI_API_KEY", "")
 
@@ -35,5 +38,25 @@ def create_app(config_class=Config):
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
+    # Spawned workers (rasterizer pool, job workers) re-import the launching script, which
+    # may call create_app: only the main process migrates, preloads and runs the queue
+    if current_process().name != "MainProcess":
+        return app
+
+    # Tables, added columns and the search index exist before the first request, with or
+    # without the job queue
+    from app.models import upgrade_schema
+    with app.app_context():
+        upgrade_schema()
+
+    # The OCR stack loads in a background thread; requests are served meanwhile
+    if app.config.get("OCR_WARMUP"):
+        from app.preload import start_preload
+        start_preload()
+
+    if app.config.get("OCR_JOB_QUEUE"):
+        from app.jobs import start_job_queue
+        start_job_queue(app)
+
     return app
 
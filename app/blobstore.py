@@ -0,0 +1,138 @@
+"""Content-addressed blob storage on the local filesystem.
+
+PDFs and page images live under BLOB_STORE_PATH as files named by the
+SHA-256 of their bytes (ab/cd/abcd...), and database rows only keep that hash
+and the size. Writing the same bytes twice stores them once, so identical
+pages are deduplicated for free. Reads go straight to the file: MuPDF and
+PIL open the path, and responses stream it, so nothing is loaded whole into
+memory on the way through SQLite.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from flask import current_app
+
+CHUNK_SIZE = 1024 * 1024
+# Seconds a blob stored again is kept from release, while the row that will refer to it commits
+REUSE_GRACE = 300
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._tmp = os.path.join(self.root, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+        # put() and release() of one digest don't interleave; _reused: digest -> when last stored again
+        self._lock = threading.Lock()
+        self._reused = {}
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def _reuse(self, digest):
+        # with the lock held: True if the blob is there already, and then it's marked as reused
+        if not self.exists(digest):
+            return False
+        self._reused[digest] = time.monotonic()
+        return True
+
+    def _commit(self, tmp_path, digest):
+        # An atomic rename, so readers never see a half-written blob; if the blob is
+        # already there (same bytes stored before) the new copy is just dropped
+        with self._lock:
+            if self._reuse(digest):
+                os.remove(tmp_path)
+                return
+            target = self.path(digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+
+    def put(self, data):
+        """Store bytes; returns (sha256 hex digest, size)."""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            stored = self._reuse(digest)
+        if not stored:
+            fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            self._commit(tmp_path, digest)
+        return digest, len(data)
+
+    def put_stream(self, stream):
+        """Store a binary file object, copying and hashing it in chunks; returns (digest, size)."""
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        digest = hasher.hexdigest()
+        self._commit(tmp_path, digest)
+        return digest, size
+
+    def open(self, digest):
+        return open(self.path(digest), "rb")
+
+    def read(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+    def delete(self, digest):
+        # Callers check that no row refers to digest any more (see release)
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # on Windows a blob still open elsewhere (a rasterizer worker's PDF) can't be removed
+            print(f"[WARN] Could not remove blob {digest}: {e}")
+
+    def release(self, digests, in_use):
+        """Delete the blobs of digests that in_use(digest) says no row refers to.
+
+        The check and the removal are made under the store's lock, so a put() of
+        the same bytes can't land between them. A blob stored again in the last
+        REUSE_GRACE seconds is kept: the row that will refer to it may not be
+        committed yet.
+        """
+        with self._lock:
+            cutoff = time.monotonic() - REUSE_GRACE
+            self._reused = {d: t for d, t in self._reused.items() if t >= cutoff}
+            for digest in digests:
+                if digest is None or digest in self._reused or in_use(digest):
+                    continue
+                self.delete(digest)
+
+    def clear_tmp(self, older_than=3600):
+        # leftovers of writes interrupted by a crash; recent files may still be being written
+        cutoff = time.time() - older_than
+        for name in os.listdir(self._tmp):
+            path = os.path.join(self._tmp, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+_stores = {}
+
+
+def get_blob_store():
+    root = current_app.config["BLOB_STORE_PATH"]
+    if root not in _stores:
+        _stores[root] = BlobStore(root)
+    return _stores[root]
@@ -0,0 +1,176 @@
+"""Bulk export of transcriptions and page images as streams.
+
+A file, several files or a search result set is read from the database a
+batch of pages at a time and written out as it goes, so an export of
+thousands of pages needs no more memory than one batch and the first bytes
+are ready at once:
+
+    txt     every transcription under a "file - page" heading
+    jsonl   one JSON record per page
+    zip     page PNGs from the blob store plus a .txt transcript for each
+
+Each writer is a generator of bytes, used as-is by the export routes
+(chunked responses) and by export.py on the command line.
+"""
+import json
+import re
+import time
+import zipfile
+
+from app import db
+from app.blobstore import get_blob_store
+from app.search import build_fts_query
+
+# format -> response mimetype
+FORMATS = {
+    "txt": "text/plain; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+    "zip": "application/zip",
+}
+# Rows fetched from SQLite at a time; pages are never all loaded together
+FETCH_SIZE = 200
+COPY_CHUNK = 256 * 1024
+
+_PAGE_COLUMNS = (
+    "p.id, p.file_id, f.name, p.page_number, p.transcription, p.image_hash, "
+    "p.line_count, p.engine_version, p.ocr_at"
+)
+_PAGE_FROM = "FROM file_page p JOIN uploaded_file f ON f.id = p.file_id"
+
+
+def _fetch(sql, params):
+    # One batch, read whole; closing the session ends the read transaction, so job and upload
+    # commits aren't locked out while the client downloads what was read
+    rows = db.session.execute(db.text(sql), params).all()
+    db.session.close()
+    return rows
+
+
+def file_pages(file_ids=None):
+    """Pages of file_ids (every file when None), in file then page order."""
+    where, params = "", {"limit": FETCH_SIZE}
+    if file_ids is not None:
+        names = [f"id{i}" for i in range(len(file_ids))]
+        where = f"p.file_id IN ({', '.join(':' + n for n in names)}) AND "
+        params.update(zip(names, file_ids))
+    sql = (f"SELECT {_PAGE_COLUMNS} {_PAGE_FROM} WHERE {where}"
+           "(p.file_id > :file_id OR (p.file_id = :file_id AND p.page_number > :page_number)) "
+           "ORDER BY p.file_id, p.page_number LIMIT :limit")
+
+    def rows():
+        # keyset pagination: each batch starts after the last page of the one before
+        last = {"file_id": 0, "page_number": 0}
+        while True:
+            batch = _fetch(sql, {**params, **last})
+            yield from batch
+            if len(batch) < FETCH_SIZE:
+                return
+            last = {"file_id": batch[-1].file_id, "page_number": batch[-1].page_number}
+
+    return rows()
+
+
+def search_result_pages(text):
+    """Every page matching a search, best match first like the search page."""
+    match = build_fts_query(text)
+    if not match:
+        return iter(())
+
+    def rows():
+        # the ids of the matches in rank order first, then their pages a batch at a time
+        page_ids = [row.rowid for row in _fetch(
+            "SELECT rowid FROM file_page_fts WHERE file_page_fts MATCH :match ORDER BY bm25(file_page_fts)",
+            {"match": match},
+        )]
+        for start in range(0, len(page_ids), FETCH_SIZE):
+            ids = page_ids[start:start + FETCH_SIZE]
+            names = [f"id{i}" for i in range(len(ids))]
+            batch = _fetch(
+                f"SELECT {_PAGE_COLUMNS} {_PAGE_FROM} WHERE p.id IN ({', '.join(':' + n for n in names)})",
+                dict(zip(names, ids)),
+            )
+            by_id = {row.id: row for row in batch}
+            yield from (by_id[page_id] for page_id in ids if page_id in by_id)
+
+    return rows()
+
+
+def page_record(row):
+    return {
+        "file_id": row.file_id,
+        "file_name": row.name,
+        "page_number": row.page_number,
+        "transcription": row.transcription or "",
+        "line_count": row.line_count,
+        "engine_version": row.engine_version,
+        "ocr_at": str(row.ocr_at) if row.ocr_at else None,
+        "image_sha256": row.image_hash,
+    }
+
+
+def iter_txt(rows):
+    for row in rows:
+        yield f"==== {row.name} - page {row.page_number} ====\n{row.transcription or ''}\n\n".encode("utf-8")
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield (json.dumps(page_record(row), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class _ChunkSink:
+    # Write-only target for ZipFile: no seek or tell, so zipfile streams entries
+    # with data descriptors, and whatever it wrote is collected between pages
+    def __init__(self):
+        self._chunks = []
+        self.buffered = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.buffered += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.buffered = 0
+        return data
+
+
+def _folder(row):
+    stem = re.sub(r"[^\w.-]+", "_", row.name).strip("._") or "file"
+    return f"{row.file_id:05d}-{stem}"
+
+
+def iter_zip(rows):
+    store = get_blob_store()
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w") as archive:
+        for row in rows:
+            base = f"{_folder(row)}/page_{row.page_number:04d}"
+            date_time = time.localtime()[:6]
+            info = zipfile.ZipInfo(base + ".txt", date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            archive.writestr(info, (row.transcription or "").encode("utf-8"))
+            # PNGs are compressed already; the image is copied from its blob in chunks
+            info = zipfile.ZipInfo(base + ".png", date_time)
+            info.compress_type = zipfile.ZIP_STORED
+            with store.open(row.image_hash) as src, archive.open(info, "w") as dst:
+                for chunk in iter(lambda: src.read(COPY_CHUNK), b""):
+                    dst.write(chunk)
+                    if sink.buffered >= COPY_CHUNK:
+                        yield sink.drain()
+            yield sink.drain()
+    # the central directory, written on close
+    yield sink.drain()
+
+
+WRITERS = {"txt": iter_txt, "jsonl": iter_jsonl, "zip": iter_zip}
+
+
+def export(rows, fmt):
+    """Bytes chunks of rows (from file_pages or search_result_pages) in fmt."""
+    return WRITERS[fmt](rows)
@@ -0,0 +1,455 @@
+"""Background OCR job queue.
+
+Uploads only store the PDF and enqueue an OcrJob row. A dispatcher thread in
+the web process claims pending jobs and runs them, page by page, either in
+threads of the web process that share one model through the inference
+scheduler (OCR_SHARED_MODEL, the default) or in a pool of worker processes
+with a model each. Pages already stored in
+FilePage are skipped, so a retried or resumed job carries on where it stopped;
+failed jobs are retried after OCR_JOB_RETRY_SECONDS, doubled per attempt.
+Re-OCR jobs go through the same queue but redo chosen pages from their
+stored images (see app.reocr).
+"""
+import os
+import json
+import importlib
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+from config import Config
+from app import db, metrics
+from app.models import UploadedFile, FilePage, OcrJob, release_blobs
+from app.utils.ocr_engine import timing
+
+
+class WorkerConfig:
+    # Put in front of the app's config class: worker processes build their own app
+    # and must not start another queue, nor preload a model before they have a job for it
+    OCR_JOB_QUEUE = False
+    OCR_WARMUP = False
+
+
+class FileDeleted(Exception):
+    # the job's file was deleted while the job ran
+    pass
+
+
+def config_path(config_class):
+    """"module:QualName" of a config class, for worker processes to import it again."""
+    path = f"{config_class.__module__}:{config_class.__qualname__}"
+    try:
+        found = load_config(path)
+    except (ImportError, AttributeError):
+        found = None
+    if found is not config_class:
+        raise ValueError(f"Config class {path} can't be imported by worker processes; define it at module level")
+    return path
+
+
+def load_config(path):
+    module, _, name = path.partition(":")
+    value = importlib.import_module(module)
+    for part in name.split("."):
+        value = getattr(value, part)
+    return value
+
+
+_queue = None
+
+
+def enqueue_file(file_id, total_pages=None):
+    job = OcrJob(file_id=file_id, total_pages=total_pages)
+    db.session.add(job)
+    db.session.commit()
+    if _queue is not None:
+        _queue.wake()
+    return job
+
+
+def enqueue_reocr(file_id, page_numbers):
+    job = OcrJob(file_id=file_id, kind="reocr", page_numbers=json.dumps(list(page_numbers)),
+                 total_pages=len(page_numbers))
+    db.session.add(job)
+    db.session.commit()
+    if _queue is not None:
+        _queue.wake()
+    return job
+
+
+def start_job_queue(app):
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(app)
+        _queue.start()
+    return _queue
+
+
+class JobQueue:
+    def __init__(self, app):
+        self.app = app
+        self.max_jobs = max(1, app.config["OCR_MAX_CONCURRENT_JOBS"])
+        self.max_attempts = app.config["OCR_JOB_MAX_ATTEMPTS"]
+        self.retry_seconds = app.config["OCR_JOB_RETRY_SECONDS"]
+        self.poll_seconds = app.config["OCR_JOB_POLL_SECONDS"]
+        self.shared_model = app.config.get("OCR_SHARED_MODEL", False)
+        # worker processes need the app's own config: its database and blob store
+        self.config_path = None if self.shared_model else config_path(app.config.get("CONFIG_CLASS", Config))
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._running = {}
+        self._pool = None
+        # Workers send their metric samples back here, see _collect_metrics
+        self._metrics_queue = get_context("spawn").Queue()
+
+    def start(self):
+        # create_app has already brought the schema up to date
+        with self.app.app_context():
+            # Anything still marked running was cut off by a restart
+            resumed = OcrJob.query.filter_by(status="running").update({"status": "pending"})
+            db.session.commit()
+        if resumed:
+            print(f"[JOBS] Resuming {resumed} unfinished job(s)")
+        if self.shared_model:
+            _use_shared_model(self.app)
+        threading.Thread(target=self._dispatch_loop, name="ocr-dispatcher", daemon=True).start()
+        threading.Thread(target=self._collect_metrics, name="ocr-metrics", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _new_pool(self):
+        if self.shared_model:
+            return ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="ocr-job")
+        return ProcessPoolExecutor(
+            max_workers=self.max_jobs,
+            mp_context=get_context("spawn"),
+            initializer=_worker_init,
+            initargs=(self.max_jobs, self._metrics_queue, self.config_path),
+        )
+
+    def _collect_metrics(self):
+        while True:
+            name, value, labels = self._metrics_queue.get()
+            try:
+                metrics.observe(name, value, **labels)
+            except Exception:
+                print("[JOBS] Bad metric sample:", traceback.format_exc())
+
+    def _dispatch_loop(self):
+        while True:
+            try:
+                self._claim_and_submit()
+            except Exception:
+                print("[JOBS] Dispatcher error:", traceback.format_exc())
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def _retry_due(self, job, now):
+        # a job put back after an error waits retry_seconds, doubled for each attempt, first
+        if job.error is None or not job.attempts:
+            return True
+        return job.updated_at + timedelta(seconds=self.retry_seconds * 2 ** (job.attempts - 1)) <= now
+
+    def _claim_and_submit(self):
+        with self._lock:
+            free = self.max_jobs - len(self._running)
+        if free <= 0:
+            return
+        with self.app.app_context():
+            now = datetime.utcnow()
+            candidates = [
+                job for job in OcrJob.query.filter_by(status="pending").order_by(OcrJob.created_at)
+                if self._retry_due(job, now)
+            ][:free]
+            claimed = []
+            for job in candidates:
+                # Conditional update so two dispatchers never take the same job
+                updated = OcrJob.query.filter_by(id=job.id, status="pending").update(
+                    {"status": "running", "attempts": OcrJob.attempts + 1}
+                )
+                db.session.commit()
+                if updated:
+                    claimed.append(job.id)
+
+        for job_id in claimed:
+            if self._pool is None:
+                self._pool = self._new_pool()
+            future = self._pool.submit(run_job, job_id)
+            with self._lock:
+                self._running[job_id] = future
+            future.add_done_callback(lambda f, job_id=job_id: self._job_finished(job_id, f))
+
+    def _job_finished(self, job_id, future):
+        with self._lock:
+            self._running.pop(job_id, None)
+        error = future.exception()
+        if error is not None:
+            # The worker died before it could record the failure itself
+            if isinstance(error, BrokenProcessPool):
+                self._pool = None
+            with self.app.app_context():
+                job = db.session.get(OcrJob, job_id)
+                if job is not None:
+                    job.status = "failed" if job.attempts >= self.max_attempts else "pending"
+                    job.error = repr(error)
+                    db.session.commit()
+                    if job.status == "failed":
+                        metrics.observe("ocr_jobs_finished_total", status="failed")
+        self.wake()
+
+
+# --- worker process side ---
+
+_worker_app = None
+
+
+def _worker_init(num_workers, metrics_queue=None, config="config:Config"):
+    global _worker_app
+    import torch
+    from app import create_app
+
+    # Split the cores between workers instead of every worker using all of them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_workers))
+    config_class = load_config(config)
+    _worker_app = create_app(type("WorkerConfig", (WorkerConfig, config_class), {}))
+    if metrics_queue is not None:
+        metrics.forward_to(metrics_queue)
+
+
+def _use_shared_model(app):
+    # Jobs run as threads of this process: they use its app and hand their line
+    # crops to one scheduler, which batches them across documents
+    global _worker_app
+    from app.utils.ocr_engine.scheduler import start_scheduler
+
+    _worker_app = app
+    scheduler = start_scheduler()
+    print(f"[JOBS] Jobs share one model, batches of up to {scheduler.max_batch} lines")
+
+
+def _stamp(db_page, signature):
+    # which engine produced this transcription, to find stale pages later
+    db_page.engine_version, db_page.engine_params = signature
+    db_page.ocr_at = datetime.utcnow()
+
+
+def _record_skip(db_page, page):
+    # what the blank filter left out, for reviewers to see and override
+    db_page.skip_reason = page.skipped
+    db_page.skipped_lines = page.skipped_lines or None
+
+
+def _page_done(job, page_number, total_pages, page_seconds, line_count, counts=None):
+    counts = counts or {}
+    metrics.observe("ocr_pages_processed_total")
+    metrics.observe("ocr_page_seconds", page_seconds)
+    if line_count is not None:
+        metrics.observe("ocr_lines_per_page", line_count)
+    if counts.get("skipped_pages"):
+        metrics.observe("ocr_pages_skipped_total", counts["skipped_pages"])
+    if counts.get("skipped_lines"):
+        metrics.observe("ocr_lines_skipped_total", counts["skipped_lines"])
+    if counts.get("saved_ms"):
+        metrics.observe("ocr_inference_seconds_saved_total", counts["saved_ms"] / 1000)
+    skipped = " (blank, not OCR'd)" if counts.get("skipped_pages") else ""
+    print(f"[JOBS] File {job.file_id}: page {page_number}/{total_pages} processed "
+          f"in {page_seconds:.2f}s{skipped}")
+
+
+class _CommitGroup:
+    """Finished pages waiting for their rows to be written, every OCR_COMMIT_PAGES pages
+    or OCR_COMMIT_SECONDS. Progress moves in these steps instead of a commit per page."""
+
+    def __init__(self, job, total_pages, write):
+        self.job = job
+        self.total_pages = total_pages
+        # write(page) adds or updates the page's rows and returns its FilePage
+        self.write = write
+        self.max_pages = max(1, _worker_app.config["OCR_COMMIT_PAGES"])
+        self.max_seconds = _worker_app.config["OCR_COMMIT_SECONDS"]
+        self.pages = []
+        self.started = time.perf_counter()
+
+    def add(self, page):
+        self.pages.append(page)
+        if len(self.pages) >= self.max_pages or time.perf_counter() - self.started >= self.max_seconds:
+            self.commit()
+
+    def commit(self):
+        # Rows are only touched here, so SQLite's write lock is held for one short
+        # transaction per group and never while a page is still being OCR'd
+        if db.session.query(UploadedFile.id).filter_by(id=self.job.file_id).first() is None:
+            raise FileDeleted(self.job.file_id)
+        with timing.timed("db_write"):
+            for page in self.pages:
+                db_page = self.write(page)
+                # seconds of work on the page across stages, which overlap with other pages
+                db_page.ocr_seconds = page.timings.total()
+                db_page.stage_timings = json.dumps({k: round(v, 4) for k, v in page.timings.stages.items()})
+                # Progress lives on the job row, readable from any process
+                self.job.processed_pages += 1
+            db.session.commit()
+        for page in self.pages:
+            _page_done(self.job, page.number, self.total_pages, page.timings.total(), page.line_count,
+                       page.timings.counts)
+        self.pages = []
+        self.started = time.perf_counter()
+
+
+def _ocr_document(job, uploaded_file):
+    from app.main.utils import iter_pdf_pages, count_pdf_pages, add_page_variants
+    from app.pipeline import ocr_pages
+    from app.utils.ocr_engine import engine_signature
+
+    signature = engine_signature()
+    pdf_path = uploaded_file.content_path
+    total_pages = count_pdf_pages(pdf_path)
+    job.total_pages = total_pages
+    db.session.commit()
+
+    done = {
+        number for (number,) in
+        db.session.query(FilePage.page_number).filter_by(file_id=job.file_id)
+    }
+    missing = [n for n in range(1, total_pages + 1) if n not in done]
+    job.processed_pages = len(done)
+    db.session.commit()
+
+    def write(page):
+        db_page = FilePage(
+            file_id=job.file_id,
+            page_number=page.number,
+            image_hash=page.image_hash,
+            image_size=page.image_size,
+            transcription=page.transcription,
+            line_count=page.line_count,
+        )
+        _record_skip(db_page, page)
+        _stamp(db_page, signature)
+        db.session.add(db_page)
+        db.session.flush()
+        add_page_variants(db_page, page.variants)
+        return db_page
+
+    # Only the pages still missing are rendered, and only a few ahead: the pipeline's
+    # queues do the buffering. Images are stored by the pipeline, rows written here.
+    uploaded_file_id = job.file_id
+    group = _CommitGroup(job, total_pages, write)
+    # pages not written because the file was deleted meanwhile; their images are stored already
+    unwritten = []
+
+    def source():
+        for item in iter_pdf_pages(pdf_path, missing, window=1):
+            if unwritten:
+                return
+            yield item
+
+    for page in ocr_pages(source()):
+        if unwritten:
+            # the pages that were already in the pipeline when the file went
+            unwritten.append(page)
+            continue
+        try:
+            group.add(page)
+        except FileDeleted:
+            unwritten.extend(group.pages)
+    if not unwritten:
+        try:
+            group.commit()
+        except FileDeleted:
+            unwritten.extend(group.pages)
+    if unwritten:
+        db.session.rollback()
+        release_blobs({h for page in unwritten
+                       for h in [page.image_hash, *(v["data_hash"] for v in (page.variants or {}).values())]})
+        raise FileDeleted(uploaded_file_id)
+
+
+def _reocr_pages(job):
+    from PIL import Image
+    from app.pipeline import ocr_pages
+    from app.reocr import job_pages, is_stale
+    from app.utils.ocr_engine import engine_signature
+
+    signature = engine_signature()
+    page_numbers = job_pages(job)
+    job.total_pages = len(page_numbers)
+    job.processed_pages = 0
+    todo = []
+    # pages reviewers want OCR'd in full though the blank filter skipped them
+    overrides = set()
+    for page_number in page_numbers:
+        db_page = FilePage.query.filter_by(file_id=job.file_id, page_number=page_number).first()
+        # a resumed job skips what it already redid before it was cut off
+        if db_page is None or (db_page.ocr_at and db_page.ocr_at >= job.created_at
+                               and not db_page.flagged and not is_stale(db_page, signature)):
+            job.processed_pages += 1
+        else:
+            todo.append((page_number, db_page.image_path))
+            if db_page.skip_override:
+                overrides.add(page_number)
+    db.session.commit()
+
+    def stored_images():
+        # The stored page images, not the PDF: nothing is rasterized again
+        for page_number, image_path in todo:
+            with Image.open(image_path) as img:
+                yield page_number, img.convert("RGB")
+
+    def write(page):
+        db_page = FilePage.query.filter_by(file_id=job.file_id, page_number=page.number).first()
+        db_page.transcription = page.transcription
+        db_page.line_count = page.line_count
+        db_page.flagged = False
+        _record_skip(db_page, page)
+        _stamp(db_page, signature)
+        return db_page
+
+    group = _CommitGroup(job, len(page_numbers), write)
+    for page in ocr_pages(stored_images(), source_stage="load_image", store_images=False, override_pages=overrides):
+        group.add(page)
+    group.commit()
+
+
+def run_job(job_id):
+    with _worker_app.app_context():
+        job = db.session.get(OcrJob, job_id)
+        if job is None:
+            return
+        try:
+            uploaded_file = db.session.get(UploadedFile, job.file_id)
+            if uploaded_file is None:
+                job.status = "failed"
+                job.error = "File no longer exists"
+                db.session.commit()
+                return
+
+            if job.kind == "reocr":
+                _reocr_pages(job)
+            else:
+                _ocr_document(job, uploaded_file)
+
+            job.status = "done"
+            job.error = None
+            db.session.commit()
+            metrics.observe("ocr_jobs_finished_total", status="done")
+        except FileDeleted as e:
+            # deleting the file took its jobs with it; there is nothing left to retry
+            db.session.rollback()
+            print(f"[JOBS] File {e} was deleted, job {job_id} stopped")
+        except Exception as e:
+            db.session.rollback()
+            print(f"[JOBS] Job {job_id} failed:", traceback.format_exc())
+            job = db.session.get(OcrJob, job_id)
+            if job is not None:
+                max_attempts = _worker_app.config["OCR_JOB_MAX_ATTEMPTS"]
+                job.status = "failed" if job.attempts >= max_attempts else "pending"
+                job.error = str(e)
+                db.session.commit()
+                if job.status == "failed":
+                    metrics.observe("ocr_jobs_finished_total", status="failed")
@@ -1,18 +1,24 @@
 import os
-from flask import render_template, request, redirect, flash, url_for, abort, session, jsonify
+from flask import render_template, request, redirect, flash, url_for, abort, jsonify, send_file, current_app, Response, stream_with_context
 from werkzeug.utils import secure_filename
 from app.main import bp
 from app import db
 from app.models import UploadedFile
 from config import Config
-from .utils import pdf_to_images_base64
-from app.utils.ocr_engine import run_ocr_engine
-import base64
-from app.models import UploadedFile, FilePage
-import uuid
-
-# Dictionary to store upload progress (in production, use Redis or similar)
-upload_progress = {}
+from .utils import count_pdf_pages, save_page_variants
+import json
+import time
+import threading
+from contextlib import contextmanager
+from PIL import Image
+from app.models import UploadedFile, FilePage, OcrJob, PageImageVariant, release_blobs
+from app.jobs import enqueue_file, enqueue_reocr
+from app.reocr import last_page, parse_page_range, select_pages, page_status
+from app.search import search_pages
+from app.export import FORMATS, export, file_pages, search_result_pages
+from app import metrics
+from app.preload import readiness
+from app.blobstore import get_blob_store
 
 def allowed_file(filename):
     return (
@@ -26,22 +32,41 @@ def startpage():
 
 @bp.route("/list", methods=["GET"])
 def file_list():
-    # Display the main page with a list of uploaded files
-    files = UploadedFile.query.all()
-    return render_template("FileList.html", files=files)
+    # Display the main page with a list of uploaded files, one page of cards at a time
+    page = request.args.get('page', 1, type=int)
+    pagination = UploadedFile.query.order_by(UploadedFile.id.desc()).paginate(
+        page=page, per_page=Config.FILES_PER_PAGE, error_out=False
+    )
+    return render_template("FileList.html", files=pagination.items, pagination=pagination)
 
 @bp.route("/delete/<int:file_id>", methods=["POST"])
 def delete_file(file_id):
     uploaded_file = UploadedFile.query.get(file_id)
     if not uploaded_file:
         abort(404)
-    # Delete all pages first
+    # Delete queued jobs, cached images and all pages first
+    OcrJob.query.filter_by(file_id=file_id).delete()
+    page_ids = db.session.query(FilePage.id).filter_by(file_id=file_id)
+    variants = PageImageVariant.query.filter(PageImageVariant.page_id.in_(page_ids))
+    blob_hashes = {uploaded_file.content_hash}
+    blob_hashes.update(h for (h,) in variants.with_entities(PageImageVariant.data_hash))
+    blob_hashes.update(h for (h,) in page_ids.with_entities(FilePage.image_hash))
+    variants.delete(synchronize_session=False)
     FilePage.query.filter_by(file_id=file_id).delete()
     db.session.delete(uploaded_file)
     db.session.commit()
+    release_blobs(blob_hashes)
     flash("File deleted successfully.")
     return redirect(url_for("main.file_list"))
 
+@contextmanager
+def _upload_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe("upload_stage_seconds", time.perf_counter() - start, stage=stage)
+
 @bp.route("/upload", methods=["GET","POST"])
 def file_upload():
     if request.method == "GET":
@@ -54,54 +79,33 @@ def file_upload():
         flash("No file selected.")
         return redirect(url_for("main.file_list"))
     if file and allowed_file(file.filename):
+        content_hash = db_file = None
         try:
             file_name = secure_filename(file.filename)
-            file_content = file.read()
-            images = pdf_to_images_base64(file_content)
+            # Streamed to the blob store in chunks, never held in memory whole
+            with _upload_stage("store"):
+                content_hash, size_bytes = get_blob_store().put_stream(file.stream)
+            with _upload_stage("count_pages"):
+                total_pages = count_pdf_pages(get_blob_store().path(content_hash))
             custom_name = request.form.get("name") or file_name
             description = request.form.get("description", "")
-            upload_id = request.form.get("upload_id", str(uuid.uuid4()))
-
-            # Store total page count for this upload
-            total_pages = len(images)
-            upload_progress[upload_id] = {
-                'total': total_pages,
-                'processed': 0,
-                'file_id': None
-            }
 
             # Save the file record first
-            db_file = UploadedFile(
-                name=custom_name,
-                content=file_content,
-                description=description
-            )
-            db.session.add(db_file)
-            db.session.commit() 
-            
-            upload_progress[upload_id]['file_id'] = db_file.id
-
-            # For each image, run OCR and save as FilePage
-            print(f"Number of images: {total_pages}")
-            for idx, img_base64 in enumerate(images):
-                transcription = run_ocr_engine(img_base64)
-                img_bytes = base64.b64decode(img_base64)
-                db_page = FilePage(
-                    file_id=db_file.id,
-                    page_number=idx + 1,
-                    image=img_bytes,
-                    transcription=transcription
+            with _upload_stage("db_save"):
+                db_file = UploadedFile(
+                    name=custom_name,
+                    content_hash=content_hash,
+                    description=description,
+                    page_count=total_pages,
+                    size_bytes=size_bytes
                 )
-                db.session.add(db_page)
-                db.session.commit()  # Commit each page for real-time updates
-                
-                # Update progress
-                upload_progress[upload_id]['processed'] = idx + 1
-                print(f"Page {idx + 1}/{total_pages} processed")
+                db.session.add(db_file)
+                db.session.commit()
 
-            # Clean up progress tracking after completion
-            if upload_id in upload_progress:
-                del upload_progress[upload_id]
+            # OCR runs in the background job queue, the viewer shows progress
+            with _upload_stage("enqueue"):
+                enqueue_file(db_file.id, total_pages)
+            print(f"Queued file {db_file.id} ({total_pages} pages) for OCR")
 
             return jsonify({
                 'success': True,
@@ -111,50 +115,99 @@ def file_upload():
         except Exception as e:
             import traceback
             print("Upload error:", traceback.format_exc())
+            # Don't leave a file without a job, or a stored PDF no file refers to
+            db.session.rollback()
+            if db_file is not None and db_file.id is not None:
+                OcrJob.query.filter_by(file_id=db_file.id).delete()
+                db.session.delete(db_file)
+                db.session.commit()
+            if content_hash is not None:
+                release_blobs([content_hash])
             return jsonify({'success': False, 'error': str(e)}), 500
     else:
         return jsonify({'success': False, 'error': 'Invalid file type'}), 400
 
-# Endpoint to check upload progress
-@bp.route("/upload_progress/<upload_id>", methods=["GET"])
-def upload_progress_status(upload_id):
-    if upload_id in upload_progress:
-        progress = upload_progress[upload_id]
-        return jsonify({
-            'total': progress['total'],
-            'processed': progress['processed'],
-            'file_id': progress['file_id']
-        })
+def _file_progress(file_id):
+    # One read of the shared job row in SQLite; works from any worker process
+    uploaded_file = UploadedFile.query.get(file_id)
+    if not uploaded_file:
+        return None
+    job = OcrJob.query.filter_by(file_id=file_id).order_by(OcrJob.id.desc()).first()
+    if job is not None:
+        processed_pages = job.processed_pages
     else:
-        return jsonify({'error': 'Upload not found'}), 404
+        # Files uploaded before the job queue existed
+        processed_pages = FilePage.query.filter_by(file_id=file_id).count()
+    total_pages = uploaded_file.page_count or (job.total_pages if job is not None else None) or processed_pages or 1
+    if job is not None and job.kind == 'reocr':
+        # progress through the pages being redone, not the whole document
+        total_pages = job.total_pages or 0
+    return {
+        'total': total_pages,
+        'processed': processed_pages,
+        'file_id': file_id,
+        'kind': job.kind if job is not None else 'ocr',
+        'status': job.status if job is not None else 'done',
+        'error': job.error if job is not None and job.status == 'failed' else None
+    }
 
 # Endpoint to check processing status
 @bp.route("/file_processing_status/<int:file_id>", methods=["GET"])
 def file_processing_status(file_id):
-    uploaded_file = UploadedFile.query.get(file_id)
-    if not uploaded_file:
+    progress = _file_progress(file_id)
+    if progress is None:
         return jsonify({'error': 'File not found'}), 404
-    
-    # Count how many pages have been processed
-    processed_pages = FilePage.query.filter_by(file_id=file_id).count()
-    # Try to get the total from upload_progress if available
-    for progress in upload_progress.values():
-        if progress.get('file_id') == file_id:
-            total_pages = progress['total']
-            break
-    else:
-        # Fallback: parse PDF
-        from .utils import pdf_to_images_base64
+    return jsonify(progress)
+
+_streams_lock = threading.Lock()
+_open_streams = 0
+
+# Server-Sent Events stream of per-page progress, so the viewer doesn't poll
+@bp.route("/file_processing_events/<int:file_id>", methods=["GET"])
+def file_processing_events(file_id):
+    if _file_progress(file_id) is None:
+        return jsonify({'error': 'File not found'}), 404
+    db.session.close()
+
+    def stream():
+        global _open_streams
+        # Every open stream holds a server thread: past PROGRESS_MAX_STREAMS the viewer
+        # is told to poll /file_processing_status instead
+        with _streams_lock:
+            admitted = _open_streams < Config.PROGRESS_MAX_STREAMS
+            if admitted:
+                _open_streams += 1
+        if not admitted:
+            yield "event: poll\ndata: {}\n\n"
+            return
         try:
-            images = pdf_to_images_base64(uploaded_file.content)
-            total_pages = len(images)
-        except:
-            total_pages = processed_pages if processed_pages > 0 else 1
-    return jsonify({
-        'total': total_pages,
-        'processed': processed_pages,
-        'file_id': file_id
-    })
+            # The stream is closed after a while to free the server thread; EventSource reconnects
+            deadline = time.monotonic() + Config.PROGRESS_STREAM_SECONDS
+            last = None
+            yield "retry: 1000\n\n"
+            while True:
+                progress = _file_progress(file_id)
+                db.session.close()  # end the read transaction so workers can keep committing
+                if progress is None:
+                    return
+                if progress != last:
+                    yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+                    last = progress
+                else:
+                    # a comment line: writing is how a closed tab is noticed and its thread freed
+                    yield ":\n\n"
+                if progress['status'] in ('done', 'failed') or time.monotonic() > deadline:
+                    return
+                time.sleep(Config.PROGRESS_EVENT_INTERVAL)
+        finally:
+            with _streams_lock:
+                _open_streams -= 1
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @bp.route("/view/<int:file_id>", methods=["GET"])
@@ -163,28 +216,35 @@ def file_view(file_id):
     if not uploaded_file:
         abort(404)
 
-    # Get all pages for this file, ordered by page_number
-    pages = FilePage.query.filter_by(file_id=uploaded_file.id).order_by(FilePage.page_number).all()
-    total_pages = len(pages)
-    page = int(request.args.get('page', 1))
-    if total_pages == 0:
-        # No pages processed yet
+    # Pages are stored out of order while the job runs, so navigation goes by the document's
+    # page numbers and progress by the job's processed counter (see _file_progress)
+    total_pages = uploaded_file.page_count or db.session.query(
+        db.func.max(FilePage.page_number)).filter_by(file_id=uploaded_file.id).scalar() or 0
+    page = request.args.get('page', 1, type=int)
+    if page < 1 or page > total_pages:
+        page = 1
+    # Load only the page being shown (its image is served separately)
+    current_page = FilePage.query.filter_by(file_id=uploaded_file.id, page_number=page).first()
+    if current_page is None:
+        progress = _file_progress(file_id)
+        if not (progress['kind'] == 'ocr' and progress['status'] in ('pending', 'running')):
+            # a page the finished job never stored: show the first one there is
+            current_page = FilePage.query.filter_by(file_id=uploaded_file.id).order_by(FilePage.page_number).first()
+    if current_page is None:
+        # This page isn't processed yet
         return render_template(
             "FileView.html",
             file_id=uploaded_file.id,
             name=uploaded_file.name,
             description=uploaded_file.description or "No description available.",
-            image=None,
+            image_url=None,
+            full_image_url=None,
             transcription=None,
             page=1,
             total_pages=0,
             processing=True
         )
-    if page < 1 or page > total_pages:
-        page = 1
-
-    current_page = pages[page - 1]
-    image_base64 = base64.b64encode(current_page.image).decode("utf-8")
+    page = current_page.page_number
     transcription = current_page.transcription or "No transcription available."
 
     return render_template(
@@ -192,13 +252,141 @@ def file_view(file_id):
         file_id=uploaded_file.id,
         name=uploaded_file.name,
         description=uploaded_file.description or "No description available.",
-        image=image_base64,
+        image_url=url_for("main.page_image", file_id=file_id, page_number=current_page.page_number, variant="screen"),
+        full_image_url=url_for("main.page_image", file_id=file_id, page_number=current_page.page_number, variant="full"),
         transcription=transcription,
         page=page,
         total_pages=total_pages,
         processing=False
     )
 
+def _send_image(path, mime_type, etag, last_modified):
+    # streamed from the blob store file
+    response = send_file(
+        path,
+        mimetype=mime_type,
+        etag=etag,
+        last_modified=last_modified,
+        max_age=current_app.config["IMAGE_CACHE_MAX_AGE"],
+        conditional=True
+    )
+    response.cache_control.public = True
+    return response
+
+# Page images served as cacheable responses: variant is "thumb", "screen" or "full".
+# Pages of a file still being processed are asked for before they exist, so a missing
+# image is a bare 404 rather than an error page
+@bp.route("/page_image/<int:file_id>/<int:page_number>/<variant>", methods=["GET"])
+def page_image(file_id, page_number, variant):
+    page = FilePage.query.filter_by(file_id=file_id, page_number=page_number).first()
+    if not page:
+        return "", 404
+    if variant == "full":
+        # the blob hash is already a content hash, so it doubles as the ETag
+        return _send_image(page.image_path, "image/png", page.image_hash, None)
+    if variant not in current_app.config["IMAGE_VARIANT_WIDTHS"]:
+        return "", 404
+
+    cached = PageImageVariant.query.filter_by(page_id=page.id, variant=variant).first()
+    if cached is None:
+        # Pages stored before variants existed get theirs made on first request
+        with Image.open(page.image_path) as img:
+            cached = save_page_variants(page, img)[variant]
+        db.session.commit()
+    return _send_image(cached.data_path, cached.mime_type, cached.etag, cached.created_at)
+
+def _truthy(value):
+    # JSON booleans or form strings
+    return str(value).lower() in ('true', '1', 'yes', 'on')
+
+# Engine version, staleness and review flag of every page of a file
+@bp.route("/page_status/<int:file_id>", methods=["GET"])
+def file_page_status(file_id):
+    if not UploadedFile.query.get(file_id):
+        return jsonify({'error': 'File not found'}), 404
+    return jsonify({'file_id': file_id, 'pages': page_status(file_id)})
+
+# Reviewers flag a page (flagged=false clears it) so a later re-OCR picks it up
+@bp.route("/page_flag/<int:file_id>/<int:page_number>", methods=["POST"])
+def flag_page(file_id, page_number):
+    page = FilePage.query.filter_by(file_id=file_id, page_number=page_number).first()
+    if not page:
+        return jsonify({'error': 'Page not found'}), 404
+    data = request.get_json(silent=True) or request.form
+    page.flagged = _truthy(data.get('flagged', True))
+    page.flag_note = data.get('note') if page.flagged else None
+    db.session.commit()
+    return jsonify({'success': True, 'page_number': page_number, 'flagged': page.flagged})
+
+# Reviewers override the blank filter for a page (override=false restores it). The page is
+# flagged too, so the next flagged re-OCR transcribes it in full.
+@bp.route("/page_skip_override/<int:file_id>/<int:page_number>", methods=["POST"])
+def override_page_skip(file_id, page_number):
+    page = FilePage.query.filter_by(file_id=file_id, page_number=page_number).first()
+    if not page:
+        return jsonify({'error': 'Page not found'}), 404
+    data = request.get_json(silent=True) or request.form
+    page.skip_override = _truthy(data.get('override', True))
+    if page.skip_override:
+        page.flagged = True
+        page.flag_note = data.get('note') or 'Blank filter overridden'
+    db.session.commit()
+    return jsonify({'success': True, 'page_number': page_number, 'skip_override': page.skip_override,
+                    'flagged': page.flagged})
+
+# Queue OCR again for some pages of a file, from their stored images.
+# pages="1-5,8" limits the range; stale/flagged/skipped keep only pages that are stale, flagged
+# or were skipped by the blank filter.
+@bp.route("/reocr/<int:file_id>", methods=["POST"])
+def reocr_file(file_id):
+    uploaded_file = UploadedFile.query.get(file_id)
+    if not uploaded_file:
+        return jsonify({'error': 'File not found'}), 404
+    data = request.get_json(silent=True) or request.form
+    try:
+        pages = parse_page_range(data['pages'], last_page(uploaded_file)) if data.get('pages') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    active = OcrJob.query.filter(OcrJob.file_id == file_id, OcrJob.status.in_(('pending', 'running'))).first()
+    if active is not None:
+        return jsonify({'success': False, 'error': 'File already has a job in progress', 'job_id': active.id}), 409
+
+    page_numbers = select_pages(file_id, pages, stale=_truthy(data.get('stale')), flagged=_truthy(data.get('flagged')),
+                                skipped=_truthy(data.get('skipped')))
+    if not page_numbers:
+        return jsonify({'success': True, 'job_id': None, 'pages': []})
+    job = enqueue_reocr(file_id, page_numbers)
+    print(f"Queued re-OCR of {len(page_numbers)} page(s) of file {file_id}")
+    return jsonify({'success': True, 'job_id': job.id, 'pages': page_numbers}), 202
+
+def _export_response(rows, fmt, filename):
+    # Chunked response: pages are read and written out one at a time as the client downloads
+    if fmt not in FORMATS:
+        return jsonify({'error': f'Unknown format, use one of {sorted(FORMATS)}'}), 400
+    return Response(
+        stream_with_context(export(rows, fmt)),
+        mimetype=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"', "X-Accel-Buffering": "no"}
+    )
+
+# Whole file as txt, jsonl (one record per page) or zip (page images + transcripts)
+@bp.route("/export/<int:file_id>", methods=["GET"])
+def export_file(file_id):
+    uploaded_file = UploadedFile.query.get(file_id)
+    if not uploaded_file:
+        return jsonify({'error': 'File not found'}), 404
+    filename = secure_filename(os.path.splitext(uploaded_file.name)[0]) or f"file-{file_id}"
+    return _export_response(file_pages([file_id]), request.args.get("format", "txt"), filename)
+
+# Every page matching a search, in the same order as the search results
+@bp.route("/export/search", methods=["GET"])
+def export_search():
+    query = request.args.get("searchbar", "").strip()
+    if not query:
+        return jsonify({'error': 'No search term'}), 400
+    filename = "search-" + (secure_filename(query) or "results")
+    return _export_response(search_result_pages(query), request.args.get("format", "txt"), filename)
+
 @bp.route("/search", methods=["GET"])
 def search_files():
     query = request.args.get("searchbar", "").strip()
@@ -207,20 +395,70 @@ def search_files():
         flash("Please enter a search term.")
         return redirect(url_for("main.file_list"))
 
-    # Search UploadedFile name/description or any FilePage transcription
-    search_results = (
-        UploadedFile.query
-        .outerjoin(FilePage, UploadedFile.id == FilePage.file_id)
-        .filter(
-            (UploadedFile.name.ilike(f"%{query}%")) |
-            (UploadedFile.description.ilike(f"%{query}%")) |
-            (FilePage.transcription.ilike(f"%{query}%"))
+    page = request.args.get("page", 1, type=int)
+    per_page = Config.SEARCH_RESULTS_PER_PAGE
+
+    # Files whose name or description match are listed above the first page of hits
+    search_results = []
+    if page == 1:
+        search_results = (
+            UploadedFile.query
+            .filter(
+                (UploadedFile.name.ilike(f"%{query}%")) |
+                (UploadedFile.description.ilike(f"%{query}%"))
+            )
+            .all()
         )
-        .distinct()
-        .all()
-    )
+    # BM25-ranked page-level hits in the transcriptions
+    page_hits, total_hits = search_pages(query, page=page, per_page=per_page)
+    total_result_pages = max(1, -(-total_hits // per_page))
 
-    if not search_results:
+    if not search_results and not page_hits:
         flash("No files matched your search.")
 
-    return render_template("SearchResults.html", files=search_results, query=query)
+    return render_template(
+        "SearchResults.html",
+        files=search_results,
+        page_hits=page_hits,
+        total_hits=total_hits,
+        page=page,
+        total_result_pages=total_result_pages,
+        query=query
+    )
+
+# Loaded OCR models with their load time and memory footprint, and OCR cache counters
+@bp.route("/engine_status", methods=["GET"])
+def engine_status():
+    # imports the OCR stack if nothing has yet; /engine_ready never does
+    from app.utils.ocr_engine.ocr_model import registry as model_registry
+    from app.utils.ocr_engine.cache import result_cache
+    from app.utils.ocr_engine import remote as remote_engine
+    from app.utils.ocr_engine import scheduler as inference_scheduler
+    from app.utils.ocr_engine import blank as blank_filter
+
+    status = model_registry.report()
+    status["ocr_cache"] = result_cache.stats()
+    if remote_engine.enabled():
+        status["remote"] = remote_engine.get_engine().stats()
+    if inference_scheduler.get_scheduler() is not None:
+        status["scheduler"] = inference_scheduler.get_scheduler().stats()
+    status["blank_filter"] = blank_filter.skip_counter.stats()
+    return jsonify(status)
+
+@bp.route("/engine_ready", methods=["GET"])
+def engine_ready():
+    # Whether the OCR engine is loaded, for health checks and the UI; 503 until it is
+    status = readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    # Queue depth is read from the job table at scrape time, the rest is kept in memory
+    by_status = dict(db.session.query(OcrJob.status, db.func.count(OcrJob.id)).group_by(OcrJob.status).all())
+    for status in ("pending", "running", "done", "failed"):
+        metrics.QUEUE_DEPTH.set(by_status.get(status, 0), status=status)
+    queued = db.session.query(
+        db.func.coalesce(db.func.sum(OcrJob.total_pages - OcrJob.processed_pages), 0)
+    ).filter(OcrJob.status.in_(("pending", "running"))).scalar()
+    metrics.PAGES_QUEUED.set(queued)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
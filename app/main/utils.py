@@ -1,25 +1,138 @@
-import fitz
 import os
 import io
-from flask import flash, redirect, url_for, render_template
+import queue
+import hashlib
+import threading
+from flask import flash, redirect, url_for, render_template, current_app
 from base64 import b64encode
+from PIL import features
+from app import db
+from app.models import PageImageVariant
+from app.blobstore import get_blob_store
+
+# How many rendered pages may wait for the consumer at once
+PAGE_WINDOW = int(os.getenv("PDF_PAGE_WINDOW", "2"))
+
+def _iter_pages(pdf_bytes, page_numbers, zoom, ahead=0):
+    from app.rasterize import iter_rendered
+
+    if page_numbers is None:
+        page_numbers = range(1, count_pdf_pages(pdf_bytes) + 1)
+    yield from iter_rendered(pdf_bytes, page_numbers, zoom, ahead=ahead)
+
+def iter_pdf_pages(pdf_bytes, page_numbers=None, zoom=None, window=PAGE_WINDOW):
+    """Yield (page_number, PIL image) one page at a time, in page order.
+
+    pdf_bytes may also be a path, which MuPDF reads from disk as it goes.
+    page_numbers (1-based) limits rendering to those pages. Each page gets its
+    own zoom from its size (see app.rasterize) unless zoom is given. Pages are
+    rendered by the rasterizer worker pool when there is one, otherwise with
+    window > 1 in a background thread; either way only a few pages are
+    rendered ahead of the caller, whatever the document length.
+    """
+    # MuPDF is only imported once a PDF is opened
+    from app.rasterize import PDF_RASTER_WORKERS
+
+    if window <= 1 or PDF_RASTER_WORKERS > 1:
+        # the worker pool renders ahead by itself, a thread on top would only add a copy
+        yield from _iter_pages(pdf_bytes, page_numbers, zoom, ahead=max(0, window - 1))
+        return
+
+    pages = queue.Queue(maxsize=window - 1)
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for item in _iter_pages(pdf_bytes, page_numbers, zoom):
+                while not stop.is_set():
+                    try:
+                        pages.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            pages.put(done)
+        except Exception as e:
+            pages.put(e)
+
+    producer = threading.Thread(target=produce, name="pdf-rasterizer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # consumer stopped early (or finished): let the producer exit
+        stop.set()
+
+def image_to_png_bytes(img):
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
 
 def pdf_to_images_base64(pdf_bytes):
-    # read pdf_bytes from database
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    images_base64 = []
+    # Kept for callers that still want every page as base64 PNG up front
+    return [
+        b64encode(image_to_png_bytes(img)).decode("utf-8")
+        for _, img in iter_pdf_pages(pdf_bytes)
+    ]
+
+
+def count_pdf_pages(pdf_bytes):
+    # opening the document is cheap, nothing gets rendered; bytes or a path
+    from app.rasterize import open_pdf
+
+    with open_pdf(pdf_bytes) as doc:
+        return doc.page_count
+
 
-    for pg in range(doc.page_count):
-        page = doc.load_page(pg)
-        zoom = 2 #The larger the zoom factor, the clearer the image will be.
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
+def make_image_variants(img, widths, fmt="WEBP"):
+    # Downscale a page image to each named max width, keeping the aspect ratio
+    if fmt == "WEBP" and not features.check("webp"):
+        fmt = "JPEG"
+    mime_type = "image/webp" if fmt == "WEBP" else "image/jpeg"
+    variants = {}
+    for name, width in widths.items():
+        copy = img.convert("RGB")
+        copy.thumbnail((width, copy.height))
+        buf = io.BytesIO()
+        copy.save(buf, format=fmt, quality=80)
+        variants[name] = (mime_type, buf.getvalue())
+    return variants
 
-        # convert pdf into png
-        img_bytes = pix.tobytes(output="png")
+def store_page_variants(img, widths, fmt, store=None):
+    # Encode the variants into the blob store; no database work, so any thread can do it
+    # given the store
+    store = store or get_blob_store()
+    stored = {}
+    for name, (mime_type, data) in make_image_variants(img, widths, fmt).items():
+        data_hash, size = store.put(data)
+        stored[name] = {
+            "mime_type": mime_type,
+            "data_hash": data_hash,
+            "size_bytes": size,
+            "etag": hashlib.sha1(data).hexdigest(),
+        }
+    return stored
 
-        # use base64 code to store
-        img_base64 = b64encode(img_bytes).decode("utf-8")
-        images_base64.append(img_base64)
+def add_page_variants(page, stored):
+    # page must already have an id (flushed); caller commits
+    rows = {}
+    for name, fields in stored.items():
+        rows[name] = PageImageVariant(page_id=page.id, variant=name, **fields)
+        db.session.add(rows[name])
+    return rows
 
-    return images_base64
\ No newline at end of file
+def save_page_variants(page, img):
+    stored = store_page_variants(
+        img,
+        current_app.config["IMAGE_VARIANT_WIDTHS"],
+        current_app.config["IMAGE_VARIANT_FORMAT"],
+    )
+    return add_page_variants(page, stored)
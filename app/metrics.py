@@ -0,0 +1,157 @@
+"""Process metrics in the Prometheus text exposition format, served at /metrics.
+
+Counters, gauges and histograms are kept in memory in the web process. OCR
+runs in job worker processes, so their measurements are forwarded to the web
+process over a multiprocessing queue (see forward_to and JobQueue) and
+recorded there; observe() does the right thing on either side.
+"""
+import threading
+
+from app.utils.ocr_engine import timing
+
+_metrics = {}
+_forward = None
+
+# latency buckets in seconds, from a cache lookup up to a long page
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PAGE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+LOAD_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+LINE_BUCKETS = (0, 5, 10, 20, 30, 40, 60, 80, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _metrics[name] = self
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def observe(self, value=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._values[key] = self._values.get(key, 0) + value
+
+    inc = observe
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def observe(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    set = observe
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        with self._lock:
+            key = self._key(labels)
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total) in self._values.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {counts[-1]}")
+        return lines
+
+
+PAGES_PROCESSED = Counter("ocr_pages_processed_total", "Pages OCRed and stored.")
+PAGE_SECONDS = Histogram("ocr_page_seconds", "Wall time to rasterize, OCR and store one page.",
+                         buckets=PAGE_BUCKETS)
+LINES_PER_PAGE = Histogram("ocr_lines_per_page", "Line crops recognized per page.", buckets=LINE_BUCKETS)
+STAGE_SECONDS = Histogram("ocr_stage_seconds", "Time spent in each OCR pipeline stage.", ("stage",))
+MODEL_LOAD_SECONDS = Histogram("ocr_model_load_seconds", "Time to load a recognizer model.",
+                               buckets=LOAD_BUCKETS)
+UPLOAD_STAGE_SECONDS = Histogram("upload_stage_seconds", "Time spent in each step of an upload request.",
+                                 ("stage",))
+PAGES_SKIPPED = Counter("ocr_pages_skipped_total", "Pages the blank filter kept from inference.")
+LINES_SKIPPED = Counter("ocr_lines_skipped_total", "Empty line crops the blank filter kept from inference.")
+SECONDS_SAVED = Counter("ocr_inference_seconds_saved_total",
+                        "Estimated inference time the blank filter saved, at the mean cost of a recognized page or line.")
+JOBS_FINISHED = Counter("ocr_jobs_finished_total", "OCR jobs that ended, by final status.", ("status",))
+QUEUE_DEPTH = Gauge("ocr_job_queue_depth", "OCR jobs by status.", ("status",))
+PAGES_QUEUED = Gauge("ocr_pages_queued", "Pages of pending and running jobs not processed yet.")
+
+
+def observe(name, value=1, **labels):
+    # Record a sample here, or hand it to the web process when running in a job worker
+    if _forward is not None:
+        _forward.put((name, value, labels))
+        return
+    _metrics[name].observe(value, **labels)
+
+
+def forward_to(queue):
+    global _forward
+    _forward = queue
+
+
+def _on_stage(stage, seconds):
+    if stage == "model_load":
+        observe(MODEL_LOAD_SECONDS.name, seconds)
+    else:
+        observe(STAGE_SECONDS.name, seconds, stage=stage)
+
+
+timing.add_hook(_on_stage)
+
+
+def render():
+    lines = []
+    for metric in _metrics.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
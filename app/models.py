@@ -1,10 +1,19 @@
+from datetime import datetime
 from app import db
+from app.blobstore import get_blob_store
 
 class UploadedFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(128), nullable=False)
-    content = db.Column(db.LargeBinary, nullable=False)
+    # The PDF itself is in the blob store under this SHA-256
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
     description = db.Column(db.Text, nullable=True)
+    page_count = db.Column(db.Integer, nullable=True)
+    size_bytes = db.Column(db.Integer, nullable=True)
+
+    @property
+    def content_path(self):
+        return get_blob_store().path(self.content_hash)
 
     def __repr__(self):
         return f'<UploadedFile {self.name}>'
@@ -13,8 +22,190 @@ class FilePage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'), nullable=False)
     page_number = db.Column(db.Integer, nullable=False)
-    image = db.Column(db.LargeBinary, nullable=False)  
+    # Full-resolution PNG in the blob store; identical pages share one blob
+    image_hash = db.Column(db.String(64), nullable=False, index=True)
+    image_size = db.Column(db.Integer, nullable=True)
     transcription = db.Column(db.Text, nullable=True)
+    # How the page went through OCR: line crops, wall time and seconds per stage (JSON)
+    line_count = db.Column(db.Integer, nullable=True)
+    ocr_seconds = db.Column(db.Float, nullable=True)
+    stage_timings = db.Column(db.Text, nullable=True)
+    # Engine that produced the transcription: ENGINE_VERSION and engine_params() as JSON
+    engine_version = db.Column(db.String(16), nullable=True)
+    engine_params = db.Column(db.Text, nullable=True)
+    ocr_at = db.Column(db.DateTime, nullable=True)
+    # Set by reviewers for pages that should go through OCR again
+    flagged = db.Column(db.Boolean, nullable=False, default=False)
+    flag_note = db.Column(db.Text, nullable=True)
+    # Inference skipped by the blank filter: the reason ("blank_page") and empty line crops dropped.
+    # Reviewers set skip_override to have the page OCR'd in full next time
+    skip_reason = db.Column(db.String(32), nullable=True)
+    skipped_lines = db.Column(db.Integer, nullable=True)
+    skip_override = db.Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (db.Index('ix_file_page_file_id_page_number', 'file_id', 'page_number'),)
+
+    @property
+    def image_path(self):
+        return get_blob_store().path(self.image_hash)
+
+    def __repr__(self):
+        return f'<FilePage FileID={self.file_id} Page={self.page_number}>'
+
+class OcrJob(db.Model):
+    # One row per uploaded document waiting for, or going through, OCR
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('uploaded_file.id'), nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, default='pending', index=True)  # pending, running, done, failed
+    # "ocr" rasterizes and OCRs the whole document, "reocr" redoes page_numbers from the stored images
+    kind = db.Column(db.String(16), nullable=False, default='ocr')
+    page_numbers = db.Column(db.Text, nullable=True)  # JSON list, reocr jobs only
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    total_pages = db.Column(db.Integer, nullable=True)
+    processed_pages = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
-        return f'<FilePage FileID={self.file_id} Page={self.page_number}>'
\ No newline at end of file
+        return f'<OcrJob {self.id} FileID={self.file_id} {self.status}>'
+
+class PageImageVariant(db.Model):
+    # Downscaled copies of a FilePage image (thumbnail, screen size), made once at ingest
+    id = db.Column(db.Integer, primary_key=True)
+    page_id = db.Column(db.Integer, db.ForeignKey('file_page.id'), nullable=False)
+    variant = db.Column(db.String(16), nullable=False)
+    mime_type = db.Column(db.String(32), nullable=False)
+    data_hash = db.Column(db.String(64), nullable=False, index=True)
+    size_bytes = db.Column(db.Integer, nullable=True)
+    etag = db.Column(db.String(40), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('page_id', 'variant'),)
+
+    @property
+    def data_path(self):
+        return get_blob_store().path(self.data_hash)
+
+    def __repr__(self):
+        return f'<PageImageVariant PageID={self.page_id} {self.variant}>'
+
+
+def release_blobs(blob_hashes):
+    """Drop the blobs of blob_hashes that no file, page or image variant refers to any more.
+
+    Blobs are shared between identical files and pages, so each is checked first.
+    """
+    def in_use(blob_hash):
+        return bool(
+            db.session.query(UploadedFile.id).filter_by(content_hash=blob_hash).first()
+            or db.session.query(FilePage.id).filter_by(image_hash=blob_hash).first()
+            or db.session.query(PageImageVariant.id).filter_by(data_hash=blob_hash).first()
+        )
+
+    get_blob_store().release(blob_hashes, in_use)
+
+
+# Columns added after the first release; create_all() won't add them to existing tables
+_ADDED_COLUMNS = [
+    ('uploaded_file', 'page_count', 'INTEGER'),
+    ('uploaded_file', 'size_bytes', 'INTEGER'),
+    ('ocr_job', 'processed_pages', 'INTEGER NOT NULL DEFAULT 0'),
+    ('file_page', 'line_count', 'INTEGER'),
+    ('file_page', 'ocr_seconds', 'FLOAT'),
+    ('file_page', 'stage_timings', 'TEXT'),
+    ('uploaded_file', 'content_hash', 'VARCHAR(64)'),
+    ('file_page', 'image_hash', 'VARCHAR(64)'),
+    ('file_page', 'image_size', 'INTEGER'),
+    ('page_image_variant', 'data_hash', 'VARCHAR(64)'),
+    ('page_image_variant', 'size_bytes', 'INTEGER'),
+    ('file_page', 'engine_version', 'VARCHAR(16)'),
+    ('file_page', 'engine_params', 'TEXT'),
+    ('file_page', 'ocr_at', 'DATETIME'),
+    ('file_page', 'flagged', 'BOOLEAN NOT NULL DEFAULT 0'),
+    ('file_page', 'flag_note', 'TEXT'),
+    ('file_page', 'skip_reason', 'VARCHAR(32)'),
+    ('file_page', 'skipped_lines', 'INTEGER'),
+    ('file_page', 'skip_override', 'BOOLEAN NOT NULL DEFAULT 0'),
+    ('ocr_job', 'kind', "VARCHAR(16) NOT NULL DEFAULT 'ocr'"),
+    ('ocr_job', 'page_numbers', 'TEXT'),
+]
+
+_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_file_page_file_id_page_number ON file_page (file_id, page_number)',
+    'CREATE INDEX IF NOT EXISTS ix_uploaded_file_content_hash ON uploaded_file (content_hash)',
+    'CREATE INDEX IF NOT EXISTS ix_file_page_image_hash ON file_page (image_hash)',
+    'CREATE INDEX IF NOT EXISTS ix_page_image_variant_data_hash ON page_image_variant (data_hash)',
+]
+
+# Blob columns of the old layout: (table, blob column, hash column, size column)
+_BLOB_COLUMNS = [
+    ('uploaded_file', 'content', 'content_hash', 'size_bytes'),
+    ('file_page', 'image', 'image_hash', 'image_size'),
+    ('page_image_variant', 'data', 'data_hash', 'size_bytes'),
+]
+
+def _migrate_blobs():
+    """Move LargeBinary columns of an old database into the blob store.
+
+    Rows are copied one at a time and committed in small groups, so an
+    interrupted migration picks up where it stopped. Once a table is done its
+    blob column is dropped, and the file is vacuumed to give the space back.
+    """
+    store = get_blob_store()
+    migrated = False
+    for table, blob_column, hash_column, size_column in _BLOB_COLUMNS:
+        columns = {c['name'] for c in db.inspect(db.engine).get_columns(table)}
+        if blob_column not in columns:
+            continue
+        ids = [row[0] for row in db.session.execute(db.text(
+            f'SELECT id FROM {table} WHERE {hash_column} IS NULL'
+        ))]
+        if ids:
+            print(f"[INFO] Moving {len(ids)} {table}.{blob_column} blobs to {store.root}")
+        for count, row_id in enumerate(ids, start=1):
+            data = db.session.execute(
+                db.text(f'SELECT {blob_column} FROM {table} WHERE id = :id'), {'id': row_id}
+            ).scalar()
+            digest, size = store.put(data or b'')
+            db.session.execute(
+                db.text(f'UPDATE {table} SET {hash_column} = :digest, {size_column} = :size WHERE id = :id'),
+                {'digest': digest, 'size': size, 'id': row_id},
+            )
+            if count % 50 == 0:
+                db.session.commit()
+        db.session.commit()
+        with db.engine.begin() as conn:
+            conn.execute(db.text(f'ALTER TABLE {table} DROP COLUMN {blob_column}'))
+        migrated = True
+
+    if migrated:
+        print("[INFO] Blob migration done, compacting the database...")
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(db.text('VACUUM'))
+
+def upgrade_schema():
+    """Create missing tables, columns and indexes, move blobs out of the
+    database and backfill file metadata."""
+    from app.main.utils import count_pdf_pages
+    from app.search import ensure_fts_index
+
+    db.create_all()
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table, column, column_type in _ADDED_COLUMNS:
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+        for statement in _INDEXES:
+            conn.execute(db.text(statement))
+    _migrate_blobs()
+    get_blob_store().clear_tmp()
+    ensure_fts_index()
+
+    for uploaded_file in UploadedFile.query.filter(UploadedFile.page_count.is_(None)):
+        try:
+            uploaded_file.page_count = count_pdf_pages(uploaded_file.content_path)
+        except Exception:
+            uploaded_file.page_count = FilePage.query.filter_by(file_id=uploaded_file.id).count()
+        db.session.commit()
@@ -0,0 +1,235 @@
+"""Staged page processing: rasterize -> preprocess+slice -> recognize -> store -> commit.
+
+Each stage runs in its own threads and hands pages on through a bounded
+queue, so while one page is in the model the next is being sliced (numpy and
+OpenCV release the GIL) and the one after that rendered by the rasterizer
+pool. Nothing waits on a page it doesn't need.
+
+At most OCR_PIPELINE_QUEUE pages wait between two stages, so a job holds a
+handful of page images in memory however long its document is. The last
+stage is the caller's loop: pages come out as they finish, not necessarily in
+page order, with their images already in the blob store, and the caller
+writes their rows in grouped commits (see app.jobs).
+"""
+import os
+import queue
+import threading
+import time
+
+from app.utils.ocr_engine import timing
+
+# Threads slicing pages into line crops
+SLICE_WORKERS = int(os.getenv("OCR_SLICE_WORKERS", "1"))
+# Threads recognizing pages; 0 picks one per page the engine can take at once
+RECOGNIZE_WORKERS = int(os.getenv("OCR_RECOGNIZE_WORKERS", "0"))
+# Threads encoding page PNGs and image variants into the blob store
+STORE_WORKERS = int(os.getenv("OCR_STORE_WORKERS", "1"))
+# Pages waiting between two stages
+PIPELINE_QUEUE = int(os.getenv("OCR_PIPELINE_QUEUE", "1"))
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+
+
+def run_stages(source, stages, queue_size=PIPELINE_QUEUE):
+    """Yield each item of source after it has gone through every stage's fn.
+
+    Items leave in the order they finish. An exception in the source or any
+    stage stops the rest and is raised here; closing the generator early
+    stops every thread as well.
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in range(len(stages) + 1)]
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def fail(error):
+        errors.append(error)
+        stop.set()
+
+    def feed():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+            put(queues[0], _DONE)
+        except Exception as e:
+            fail(e)
+        finally:
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    def work(stage, inbox, outbox, running):
+        try:
+            while True:
+                item = get(inbox)
+                if item is _DONE:
+                    # leave it for this stage's other workers
+                    put(inbox, _DONE)
+                    break
+                if not put(outbox, stage.fn(item)):
+                    return
+        except Exception as e:
+            fail(e)
+            return
+        with running["lock"]:
+            running["count"] -= 1
+            last = running["count"] == 0
+        if last:
+            put(outbox, _DONE)
+
+    threads = [threading.Thread(target=feed, name="pipeline-source", daemon=True)]
+    for i, stage in enumerate(stages):
+        running = {"lock": threading.Lock(), "count": stage.workers}
+        for n in range(stage.workers):
+            threads.append(threading.Thread(target=work, args=(stage, queues[i], queues[i + 1], running),
+                                            name=f"pipeline-{stage.name}-{n}", daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is _DONE:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+
+
+class PipelinePage:
+    """One page on its way through the pipeline, with what each stage measured."""
+
+    def __init__(self, number, image):
+        self.number = number
+        self.image = image
+        self.timings = timing.StageTimings()
+        self.work = None
+        self.transcription = None
+        self.image_hash = None
+        self.image_size = None
+        self.variants = None
+        # what the blank filter skipped, see app.utils.ocr_engine.blank
+        self.skipped = None
+        self.skipped_lines = 0
+
+    @property
+    def line_count(self):
+        return self.timings.counts.get("lines")
+
+
+def _timed_source(pages, stage):
+    # The time spent waiting for each page (rendering or loading it) is its first stage
+    pages = iter(pages)
+    try:
+        while True:
+            start = time.perf_counter()
+            item = next(pages, None)
+            if item is None:
+                return
+            page = PipelinePage(*item)
+            page.timings.stages[stage] = time.perf_counter() - start
+            yield page
+    finally:
+        close = getattr(pages, "close", None)
+        if close is not None:
+            close()
+
+
+def _in_stage(fn):
+    # run fn(page) and fold what it records on this thread into the page's timings
+    def run(page):
+        with timing.collect() as timings:
+            fn(page)
+        page.timings.add(timings)
+        return page
+    return run
+
+
+def recognize_workers():
+    from app.utils.ocr_engine import remote, scheduler
+
+    if RECOGNIZE_WORKERS > 0:
+        return RECOGNIZE_WORKERS
+    if remote.enabled():
+        # requests overlap, and the engine batches pages queued together
+        return remote.get_engine().window
+    if scheduler.get_scheduler() is not None:
+        # the next page's crops are queued while this one's batch runs
+        return 2
+    return 1
+
+
+def ocr_pages(pages, source_stage="rasterize", store_images=True, use_cache=None, override_pages=()):
+    """OCR (number, image) pages through the staged pipeline; yields PipelinePage as they finish.
+
+    With store_images each page's PNG and image variants are put in the blob
+    store before it comes out, so the caller only has rows to write; call it
+    inside an app context then, the stage threads don't have one. All the pages
+    take one turn together in the inference scheduler, however many threads
+    recognize them. Pages numbered in override_pages skip the blank filter.
+    """
+    from flask import current_app
+    from app.main.utils import image_to_png_bytes, store_page_variants
+    from app.utils.ocr_engine import CACHE_ENABLED, recognize_page, slice_page
+    from app.utils.ocr_engine.blank import BLANK_FILTER
+    from app.blobstore import get_blob_store
+
+    use_cache = CACHE_ENABLED if use_cache is None else use_cache
+    owner = object()
+    if store_images:
+        blob_store = get_blob_store()
+        variant_widths = current_app.config["IMAGE_VARIANT_WIDTHS"]
+        variant_format = current_app.config["IMAGE_VARIANT_FORMAT"]
+
+    def slice_(page):
+        page.work = slice_page(page.image, use_cache, BLANK_FILTER and page.number not in override_pages)
+        page.skipped, page.skipped_lines = page.work.skipped, page.work.skipped_lines
+
+    # Pages leave without their image: the caller keeps a commit group of them around
+    def recognize(page):
+        page.transcription = recognize_page(page.work, owner=owner)
+        page.work = None
+        if not store_images:
+            page.image = None
+
+    def store(page):
+        with timing.timed("png_encode"):
+            png = image_to_png_bytes(page.image)
+        with timing.timed("blob_store"):
+            page.image_hash, page.image_size = blob_store.put(png)
+        with timing.timed("page_variants"):
+            page.variants = store_page_variants(page.image, variant_widths, variant_format, blob_store)
+        page.image = None
+
+    stages = [
+        Stage("slice", _in_stage(slice_), SLICE_WORKERS),
+        Stage("recognize", _in_stage(recognize), recognize_workers()),
+    ]
+    if store_images:
+        stages.append(Stage("store", _in_stage(store), STORE_WORKERS))
+    return run_stages(_timed_source(pages, source_stage), stages)
@@ -0,0 +1,68 @@
+"""Loading the OCR engine in the background, and whether it is ready.
+
+The web app starts without importing the OCR stack (see app.utils.ocr_engine),
+so it serves the landing page and file list straight away. With OCR_WARMUP
+a background thread then imports torch and transformers, loads the model and
+runs it once, so the first upload doesn't wait for any of that. /engine_ready
+reports how far it has got. With the shared model (OCR_SHARED_MODEL) this is
+the model the OCR jobs use.
+"""
+import sys
+import threading
+import time
+import traceback
+
+_lock = threading.Lock()
+_status = {"state": "idle", "error": None, "seconds": None}
+
+
+def start_preload():
+    """Load and warm the model in a background thread; False if that's already under way or done."""
+    with _lock:
+        if _status["state"] in ("loading", "ready"):
+            return False
+        _status.update(state="loading", error=None)
+    threading.Thread(target=_preload, name="ocr-preload", daemon=True).start()
+    return True
+
+
+def _preload():
+    from app.utils.ocr_engine import remote
+
+    start = time.perf_counter()
+    state, error = "ready", None
+    try:
+        # a remote engine (USE_GEMINI) has no local model to load
+        if not remote.enabled():
+            from app.utils.ocr_engine.ocr_model import registry
+            registry.warm_up()
+    except Exception as e:
+        print("[OCR] Preload failed:", traceback.format_exc())
+        state, error = "failed", str(e)
+    seconds = time.perf_counter() - start
+    with _lock:
+        _status.update(state=state, error=error, seconds=round(seconds, 2))
+    if state == "ready":
+        print(f"[OCR] Engine ready in {seconds:.1f}s")
+
+
+def loaded_models():
+    # Never imports the engine: if ocr_model hasn't been imported (or is still being
+    # imported by the preload thread), no model is loaded
+    registry = getattr(sys.modules.get("app.utils.ocr_engine.ocr_model"), "registry", None)
+    if registry is None:
+        return []
+    return [entry["model_path"] for entry in registry.report()["loaded"]]
+
+
+def readiness():
+    from app.utils.ocr_engine import remote
+
+    with _lock:
+        status = {"preload": dict(_status)}
+    status["backend"] = "remote" if remote.enabled() else "local"
+    status["models"] = loaded_models()
+    # a model loaded by the first job counts too; one still being warmed doesn't yet
+    status["ready"] = status["backend"] == "remote" or (
+        bool(status["models"]) and status["preload"]["state"] != "loading")
+    return status
@@ -0,0 +1,174 @@
+"""PDF page rasterization: resolution per page, rendering across worker processes.
+
+Each page is rendered at a zoom chosen from its physical size, so that a line
+of handwriting comes out about PDF_LINE_HEIGHT_PX tall whether the page is a
+pocket notebook or a ledger folio. A page is assumed to hold roughly
+PDF_LINES_PER_PAGE lines over its height; with the defaults an A4 page renders
+at about the old fixed zoom of 2. Scanned pages are never rendered above the
+resolution of the scan itself, and no page goes over PDF_MAX_PAGE_PIXELS.
+
+MuPDF is not thread safe, so pages are rendered in a small pool of spawned
+processes (PDF_RASTER_WORKERS), each holding its own open fitz document. This
+module only needs fitz and PIL, which keeps those workers cheap to start.
+"""
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from multiprocessing import get_context
+
+import fitz
+from PIL import Image
+
+# Rendered height of one line of handwriting the slicer and recognizer are sized for
+PDF_LINE_HEIGHT_PX = int(os.getenv("PDF_LINE_HEIGHT_PX", "64"))
+# Roughly how many lines of writing a page holds over its height, whatever its size
+PDF_LINES_PER_PAGE = float(os.getenv("PDF_LINES_PER_PAGE", "24"))
+PDF_MIN_ZOOM = float(os.getenv("PDF_MIN_ZOOM", "0.5"))
+PDF_MAX_ZOOM = float(os.getenv("PDF_MAX_ZOOM", "4"))
+PDF_MAX_PAGE_PIXELS = int(os.getenv("PDF_MAX_PAGE_PIXELS", str(16_000_000)))
+# Set to render every page at one fixed zoom, as before (e.g. PDF_ZOOM=2)
+PDF_ZOOM = float(os.getenv("PDF_ZOOM")) if os.getenv("PDF_ZOOM") else None
+# Processes rendering pages in parallel; 0 or 1 renders in the calling process
+PDF_RASTER_WORKERS = int(os.getenv("PDF_RASTER_WORKERS", str(min(4, max(1, (os.cpu_count() or 1) // 2)))))
+
+
+def open_pdf(pdf):
+    # pdf is the document's bytes or a path to it (e.g. in the blob store)
+    if isinstance(pdf, (str, os.PathLike)):
+        return fitz.open(pdf, filetype="pdf")
+    return fitz.open(stream=pdf, filetype="pdf")
+
+
+def _scan_zoom(page):
+    # A page that is one scanned image holds no more detail than the scan: the zoom
+    # at which one rendered pixel is one scan pixel. None for other pages.
+    images = page.get_images(full=True)
+    if len(images) != 1:
+        return None
+    xref, width = images[0][0], images[0][2]
+    rects = page.get_image_rects(xref)
+    if not rects or rects[0].width < page.rect.width * 0.5:
+        return None
+    return width / rects[0].width
+
+
+def page_zoom(page):
+    """Zoom factor to render page at, from its size and the line-height budget."""
+    if PDF_ZOOM:
+        return PDF_ZOOM
+    rect = page.rect
+    if rect.height <= 0 or rect.width <= 0:
+        return 1.0
+    zoom = PDF_LINE_HEIGHT_PX * PDF_LINES_PER_PAGE / rect.height
+    scan_zoom = _scan_zoom(page)
+    if scan_zoom:
+        zoom = min(zoom, scan_zoom)
+    zoom = min(zoom, math.sqrt(PDF_MAX_PAGE_PIXELS / (rect.width * rect.height)))
+    return max(PDF_MIN_ZOOM, min(PDF_MAX_ZOOM, zoom))
+
+
+def _render(doc, index, zoom):
+    page = doc.load_page(index)
+    zoom = zoom or page_zoom(page)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return pix.width, pix.height, pix.samples
+
+
+def render_page(doc, index, zoom=None):
+    """Render page index (0-based) of an open document to an RGB PIL image."""
+    width, height, samples = _render(doc, index, zoom)
+    # raw RGB samples straight into PIL, no PNG encode/decode
+    return Image.frombytes("RGB", (width, height), samples)
+
+
+# --- worker process side ---
+
+_docs = OrderedDict()
+_OPEN_DOCS = 2
+
+
+def _worker_render(path, index, zoom, keep_open=True):
+    # Each worker keeps its own documents open across pages. A temporary file is
+    # opened per page instead, so no worker holds it once the caller removes it.
+    if not keep_open:
+        with fitz.open(path, filetype="pdf") as doc:
+            return _render(doc, index, zoom)
+    # a file replaced at the same path is a different document
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    doc = _docs.get(key)
+    if doc is None:
+        doc = _docs[key] = fitz.open(path, filetype="pdf")
+        while len(_docs) > _OPEN_DOCS:
+            _docs.popitem(last=False)[1].close()
+    _docs.move_to_end(key)
+    return _render(doc, index, zoom)
+
+
+# --- caller side ---
+
+_pool = None
+_pool_lock = threading.Lock()
+_render_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = get_context("spawn").Pool(workers)
+        return _pool
+
+
+def iter_rendered(pdf, page_numbers, zoom=None, workers=PDF_RASTER_WORKERS, ahead=1):
+    """Yield (page_number, PIL image) for page_numbers (1-based), in that order.
+
+    With workers > 1 the pages are rendered in the worker pool, at most
+    workers + ahead pages ahead of the caller. Bytes are written to a temporary
+    file, which the workers open for each page and close again.
+    """
+    page_numbers = list(page_numbers)
+    if workers <= 1 or len(page_numbers) < 2:
+        with open_pdf(pdf) as doc:
+            for number in page_numbers:
+                # jobs running as threads (OCR_SHARED_MODEL) take turns with MuPDF
+                with _render_lock:
+                    image = render_page(doc, number - 1, zoom)
+                yield number, image
+        return
+
+    tmp_path = None
+    if not isinstance(pdf, (str, os.PathLike)):
+        fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(pdf)
+        pdf = tmp_path
+    path = os.fspath(pdf)
+    pool = _get_pool(workers)
+    pending = deque()
+    numbers = iter(page_numbers)
+    try:
+        while True:
+            # keep the pool busy, but bound how many rendered pages wait in memory
+            while len(pending) < workers + ahead:
+                number = next(numbers, None)
+                if number is None:
+                    break
+                pending.append((number, pool.apply_async(_worker_render,
+                                                         (path, number - 1, zoom, tmp_path is None))))
+            if not pending:
+                return
+            number, result = pending.popleft()
+            width, height, samples = result.get()
+            yield number, Image.frombytes("RGB", (width, height), samples)
+    finally:
+        if tmp_path is not None:
+            # pages still in flight may have the file open; on Windows that can fail
+            for _, result in pending:
+                result.wait()
+            try:
+                os.remove(tmp_path)
+            except OSError as e:
+                print(f"[WARN] Could not remove temporary PDF {tmp_path}: {e}")
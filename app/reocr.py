@@ -0,0 +1,111 @@
+"""Choosing pages to OCR again.
+
+Every FilePage records the engine version and parameters that produced its
+transcription. After slicing or the model changes, pages recorded with
+anything else are stale; reviewers can also flag single pages, or have pages
+the blank filter skipped OCR'd in full (skip_override). A reocr job
+(see jobs.enqueue_reocr) redoes only the chosen pages, from the page images
+already in the blob store, so the PDF is never rendered again.
+"""
+import json
+
+from app.models import FilePage
+
+
+def page_spans(text):
+    """(first, last) pairs from "3", "1-5" or "1-5,8,10-12"; raises ValueError on anything else."""
+    spans = []
+    for part in str(text).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        try:
+            first = int(first)
+            last = int(last) if dash else first
+        except ValueError:
+            raise ValueError(f"Bad page range {part!r}: use page numbers such as 3, 1-5 or 1-5,8") from None
+        if first < 1:
+            raise ValueError(f"Bad page range {part!r}: pages are numbered from 1")
+        if first > last:
+            raise ValueError(f"Bad page range {part!r}: {first} comes after {last}")
+        spans.append((first, last))
+    return spans
+
+
+def parse_page_range(text, page_count):
+    """Page numbers of a file with page_count pages from a range such as "1-5,8".
+
+    Ranges running past the last page stop there; one starting after it raises
+    ValueError, as does anything page_spans rejects.
+    """
+    numbers = set()
+    for first, last in page_spans(text):
+        if first > page_count:
+            raise ValueError(f"Bad page range: page {first} is past the last page ({page_count})")
+        numbers.update(range(first, min(last, page_count) + 1))
+    return sorted(numbers)
+
+
+def last_page(uploaded_file):
+    # page_count is unset while an upload is still being counted; the pages stored so far bound it then
+    if uploaded_file.page_count is not None:
+        return uploaded_file.page_count
+    return max((page.page_number for page in FilePage.query.filter_by(file_id=uploaded_file.id)), default=0)
+
+
+def is_stale(page, signature):
+    return (page.engine_version, page.engine_params) != signature
+
+
+def was_skipped(page):
+    # the blank filter kept the page, or some of its lines, from inference
+    return bool(page.skip_reason or page.skipped_lines)
+
+
+def select_pages(file_id, pages=None, stale=False, flagged=False, skipped=False):
+    """Page numbers of file_id to OCR again.
+
+    pages limits the choice to those page numbers. With any of stale, flagged
+    and skipped, only the pages that are stale, flagged or were (partly)
+    skipped by the blank filter are kept; with none, every page (in the
+    range) is.
+    """
+    from app.utils.ocr_engine import engine_signature
+
+    signature = engine_signature()
+    query = FilePage.query.filter_by(file_id=file_id)
+    if pages is not None:
+        query = query.filter(FilePage.page_number.in_(pages))
+    chosen = []
+    for page in query.order_by(FilePage.page_number):
+        if (stale or flagged or skipped) and not ((stale and is_stale(page, signature)) or
+                                                  (flagged and page.flagged) or (skipped and was_skipped(page))):
+            continue
+        chosen.append(page.page_number)
+    return chosen
+
+
+def page_status(file_id):
+    # What produced each page, for the API and the CLI
+    from app.utils.ocr_engine import engine_signature
+
+    signature = engine_signature()
+    return [
+        {
+            "page_number": page.page_number,
+            "engine_version": page.engine_version,
+            "ocr_at": page.ocr_at.isoformat() if page.ocr_at else None,
+            "stale": is_stale(page, signature),
+            "flagged": bool(page.flagged),
+            "flag_note": page.flag_note,
+            "skip_reason": page.skip_reason,
+            "skipped_lines": page.skipped_lines or 0,
+            "skip_override": bool(page.skip_override),
+        }
+        for page in FilePage.query.filter_by(file_id=file_id).order_by(FilePage.page_number)
+    ]
+
+
+def job_pages(job):
+    return json.loads(job.page_numbers or "[]")
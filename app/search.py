@@ -0,0 +1,111 @@
+"""Full-text search over page transcriptions using an SQLite FTS5 index.
+
+file_page_fts is an external-content FTS5 table over file_page.transcription,
+kept in sync by triggers on insert, update and delete, so the ORM code that
+writes FilePage rows doesn't need to know about it.
+"""
+import re
+from markupsafe import Markup, escape
+
+from app import db
+
+# Snippet markers that can't appear in OCR text; swapped for <mark> after escaping
+_HIT_START = "\x02"
+_HIT_END = "\x03"
+
+_FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS file_page_fts USING fts5(
+        transcription, content='file_page', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS file_page_fts_insert AFTER INSERT ON file_page BEGIN
+        INSERT INTO file_page_fts(rowid, transcription) VALUES (new.id, new.transcription);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS file_page_fts_delete AFTER DELETE ON file_page BEGIN
+        INSERT INTO file_page_fts(file_page_fts, rowid, transcription) VALUES ('delete', old.id, old.transcription);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS file_page_fts_update AFTER UPDATE OF transcription ON file_page BEGIN
+        INSERT INTO file_page_fts(file_page_fts, rowid, transcription) VALUES ('delete', old.id, old.transcription);
+        INSERT INTO file_page_fts(rowid, transcription) VALUES (new.id, new.transcription);
+    END""",
+]
+
+
+def ensure_fts_index():
+    # Create the index and triggers; index any pages stored before it existed
+    with db.engine.begin() as conn:
+        exists = conn.execute(db.text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_page_fts'"
+        )).first()
+        for statement in _FTS_SCHEMA:
+            conn.execute(db.text(statement))
+        if not exists:
+            conn.execute(db.text("INSERT INTO file_page_fts(file_page_fts) VALUES ('rebuild')"))
+
+
+def build_fts_query(text):
+    """Turn what a user typed into a safe FTS5 MATCH expression.
+
+    "quoted words" stay a phrase, a trailing * makes a prefix search, and
+    everything else is quoted so FTS5 operators and punctuation can't break
+    the query. Terms are ANDed together.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase.strip():
+            terms.append('"' + phrase.replace('"', '') + '"')
+            continue
+        prefix = word.endswith("*")
+        word = re.sub(r"[^\w]", " ", word).strip()
+        for part in word.split():
+            terms.append(f'"{part}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _highlight(snippet):
+    return Markup(
+        str(escape(snippet or ""))
+        .replace(_HIT_START, "<mark>")
+        .replace(_HIT_END, "</mark>")
+    )
+
+
+def search_pages(text, page=1, per_page=20):
+    """BM25-ranked page hits for text: returns (hits, total)."""
+    match = build_fts_query(text)
+    if not match:
+        return [], 0
+    total = db.session.execute(
+        db.text("SELECT count(*) FROM file_page_fts WHERE file_page_fts MATCH :match"),
+        {"match": match},
+    ).scalar()
+    rows = db.session.execute(
+        db.text(
+            "SELECT p.file_id, p.page_number, f.name, "
+            "snippet(file_page_fts, 0, :start, :end, '…', 16) AS snippet, "
+            "bm25(file_page_fts) AS score "
+            "FROM file_page_fts "
+            "JOIN file_page p ON p.id = file_page_fts.rowid "
+            "JOIN uploaded_file f ON f.id = p.file_id "
+            "WHERE file_page_fts MATCH :match "
+            "ORDER BY score LIMIT :limit OFFSET :offset"
+        ),
+        {
+            "match": match,
+            "start": _HIT_START,
+            "end": _HIT_END,
+            "limit": per_page,
+            "offset": (page - 1) * per_page,
+        },
+    ).all()
+    hits = [
+        {
+            "file_id": row.file_id,
+            "page_number": row.page_number,
+            "name": row.name,
+            "snippet": _highlight(row.snippet),
+            "score": row.score,
+        }
+        for row in rows
+    ]
+    return hits, total
@@ -1,23 +1,40 @@
-from .ocr_model import load_model, recognize_single_image, recognize_batch_images
-from .slicer import auto_slice_lines
-from .preprocessing import preprocess_image
-from .aggregator import aggregate_text
-from PIL import Image
-import io
-import base64
+"""The OCR engine: page images in, transcriptions out.
 
-# def run_ocr_engine(image_path, processor, model):
-def run_ocr_engine(image_base64):
-    image = Image.open(io.BytesIO(base64.b64decode(image_base64)))
-    # image = Image.open(image_path)
-    processor, model = load_model()
-    
-    # preprocessing
-    preprocessed = preprocess_image(image)
-    line_imgs = auto_slice_lines(preprocessed)
-    
-    # lines = recognize_batch_images(line_imgs, processor, model)
-    lines = [recognize_single_image(line_img, processor, model) for line_img in line_imgs]
-    
-    final_text = aggregate_text(lines)
-    return final_text
+torch, transformers and OpenCV take seconds to import, so this package
+imports none of them up front. The names below (run_ocr_engine, load_model,
+...) are looked up in the module that defines them the first time they are
+used, and light modules such as timing, cache, remote and scheduler can be
+imported on their own without loading the model stack.
+"""
+import importlib
+
+# name -> module of this package that defines it
+_EXPORTS = {
+    **dict.fromkeys([
+        "ENGINE_VERSION", "SLICE_MIN_HEIGHT", "SLICE_PADDING", "SEGMENTER", "engine_params",
+        "engine_signature", "PageWork", "slice_page", "recognize_page", "run_ocr_engine",
+    ], "engine"),
+    **dict.fromkeys([
+        "load_model", "recognize_single_image", "recognize_batch_images", "recognize_lines_batched",
+        "processor_input_size", "BATCH_SIZE", "MODEL_PATH", "MODEL_DTYPE", "MODEL_BACKEND",
+    ], "ocr_model"),
+    **dict.fromkeys(["auto_slice_lines", "preprocess_and_slice", "crop_aspects"], "slicer"),
+    "preprocess_image": "preprocessing",
+    "aggregate_text": "aggregator",
+    **dict.fromkeys(["result_cache", "page_cache_key", "CACHE_ENABLED"], "cache"),
+    **dict.fromkeys(["DECODE_PROFILE", "TOKENS_PER_ASPECT", "MIN_NEW_TOKENS", "MAX_NEW_TOKENS", "REPEAT_STOP"],
+                    "decoding"),
+}
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
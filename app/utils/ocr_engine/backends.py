@@ -0,0 +1,312 @@
+"""Recognizer backends: how the TrOCR weights are actually run.
+
+Every loader takes (model_path, device, dtype) and returns (processor, model),
+where model has .generate(pixel_values) returning token ids plus .device and
+.dtype, so the recognize_* functions in ocr_model.py work with any of them.
+
+    pytorch       the stock VisionEncoderDecoderModel
+    pytorch-int8  the same model with nn.Linear layers dynamically quantized to int8 (CPU only)
+    onnx          encoder and one-step decoder exported to ONNX, run by ONNX Runtime with a KV cache
+
+onnxruntime is only needed for the onnx backend and is imported when it is used.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+import torch
+from torch import nn
+from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+# Where exported ONNX graphs are kept, one subdirectory per model
+ONNX_DIR = os.getenv(
+    "OCR_ONNX_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "instance", "onnx"),
+)
+ONNX_OPSET = 17
+
+
+def _load_pretrained(model_path):
+    processor = TrOCRProcessor.from_pretrained(model_path)
+    model = VisionEncoderDecoderModel.from_pretrained(model_path)
+    model.eval()
+    return processor, model
+
+
+def load_pytorch(model_path, device="cpu", dtype="float32"):
+    processor, model = _load_pretrained(model_path)
+    model.to(device=device, dtype=getattr(torch, dtype))
+    return processor, model
+
+
+def load_pytorch_int8(model_path, device="cpu", dtype="float32"):
+    # Dynamic quantization: int8 weights, activations quantized on the fly. Linear
+    # layers are nearly all of TrOCR's compute, and the kernels only exist for CPU.
+    if device != "cpu":
+        raise ValueError("The pytorch-int8 backend only runs on cpu")
+    processor, model = _load_pretrained(model_path)
+    model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    return processor, model
+
+
+def load_onnx(model_path, device="cpu", dtype="float32"):
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError("The onnx OCR backend needs onnxruntime: pip install onnxruntime") from e
+    if device != "cpu":
+        raise ValueError("The onnx backend only runs on cpu")
+
+    processor, model = _load_pretrained(model_path)
+    export_dir = _onnx_export_dir(model_path, model)
+    encoder_path = os.path.join(export_dir, "encoder.onnx")
+    decoder_path = os.path.join(export_dir, "decoder_step.onnx")
+    if not (os.path.exists(encoder_path) and os.path.exists(decoder_path)):
+        export_onnx(model, export_dir)
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    providers = ["CPUExecutionProvider"]
+    encoder = ort.InferenceSession(encoder_path, options, providers=providers)
+    decoder = ort.InferenceSession(decoder_path, options, providers=providers)
+    return processor, OnnxTrOCR(encoder, decoder, model)
+
+
+BACKENDS = {
+    "pytorch": load_pytorch,
+    "pytorch-int8": load_pytorch_int8,
+    "onnx": load_onnx,
+}
+
+
+def load_backend(backend, model_path, device="cpu", dtype="float32"):
+    try:
+        loader = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown OCR backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    return loader(model_path, device, dtype)
+
+
+# --- ONNX export ---
+
+def _onnx_export_dir(model_path, model):
+    # A changed config (or a different checkpoint at the same path) gets a fresh export
+    config = json.dumps(model.config.to_dict(), sort_keys=True, default=str)
+    digest = hashlib.sha1((model_path + config).encode("utf-8")).hexdigest()[:12]
+    name = os.path.basename(os.path.normpath(model_path)) or "model"
+    return os.path.abspath(os.path.join(ONNX_DIR, f"{name}-{digest}"))
+
+
+def _split_heads(x, num_heads):
+    # (batch, seq, embed) -> (batch, heads, seq, head_dim)
+    batch, seq, embed = x.shape
+    return x.view(batch, seq, num_heads, embed // num_heads).transpose(1, 2)
+
+
+def _merge_heads(x):
+    batch, heads, seq, head_dim = x.shape
+    return x.transpose(1, 2).reshape(batch, seq, heads * head_dim)
+
+
+def _attend(q, k, v):
+    weights = torch.softmax(q @ k.transpose(-1, -2), dim=-1)
+    return weights @ v
+
+
+class _EncoderGraph(nn.Module):
+    """pixel_values -> cross-attention keys and values for every decoder layer.
+
+    They only depend on the image, so they are computed once per crop instead of
+    once per generated token.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.encoder
+        self.enc_to_dec_proj = getattr(model, "enc_to_dec_proj", None)
+        self.layers = model.decoder.model.decoder.layers
+        self.num_heads = model.decoder.config.decoder_attention_heads
+
+    def forward(self, pixel_values):
+        hidden = self.encoder(pixel_values=pixel_values)[0]
+        if self.enc_to_dec_proj is not None:
+            hidden = self.enc_to_dec_proj(hidden)
+        keys = [_split_heads(layer.encoder_attn.k_proj(hidden), self.num_heads) for layer in self.layers]
+        values = [_split_heads(layer.encoder_attn.v_proj(hidden), self.num_heads) for layer in self.layers]
+        return torch.stack(keys), torch.stack(values)
+
+
+class _DecoderStepGraph(nn.Module):
+    """One decoding step of the TrOCR decoder with an explicit KV cache.
+
+    Written out against the Hugging Face module weights rather than exporting
+    their forward(), whose cache handling changes between transformers releases.
+    Takes the newest token, the self-attention cache (layers, batch, heads, past,
+    head_dim) and the cross-attention keys/values; returns next-token logits and
+    the cache grown by one position.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        decoder = model.decoder.model.decoder
+        self.decoder = decoder
+        self.output_projection = model.decoder.output_projection
+        self.num_heads = model.decoder.config.decoder_attention_heads
+        self.learned_positions = not hasattr(decoder.embed_positions, "weights")
+
+    def _positions(self, past_length):
+        if self.learned_positions:
+            # TrOCRLearnedPositionalEmbedding keeps the 2-row offset from BART
+            return self.decoder.embed_positions.weight[past_length + 2]
+        sinusoidal = self.decoder.embed_positions
+        return sinusoidal.weights[sinusoidal.padding_idx + 1 + past_length].to(self.output_projection.weight.dtype)
+
+    def forward(self, input_ids, self_keys, self_values, cross_keys, cross_values):
+        past_length = self_keys.shape[3]
+        hidden = self.decoder.embed_tokens(input_ids)
+        if not hasattr(self.decoder.embed_tokens, "embed_scale"):
+            # older transformers scale in the decoder, newer ones inside the embedding
+            hidden = hidden * self.decoder.embed_scale
+        hidden = hidden + self._positions(past_length)
+        if self.decoder.layernorm_embedding is not None:
+            hidden = self.decoder.layernorm_embedding(hidden)
+
+        new_keys, new_values = [], []
+        for i, layer in enumerate(self.decoder.layers):
+            attn = layer.self_attn
+            q = _split_heads(attn.q_proj(hidden) * attn.scaling, self.num_heads)
+            k = torch.cat([self_keys[i], _split_heads(attn.k_proj(hidden), self.num_heads)], dim=2)
+            v = torch.cat([self_values[i], _split_heads(attn.v_proj(hidden), self.num_heads)], dim=2)
+            new_keys.append(k)
+            new_values.append(v)
+            hidden = layer.self_attn_layer_norm(hidden + attn.out_proj(_merge_heads(_attend(q, k, v))))
+
+            cross = layer.encoder_attn
+            q = _split_heads(cross.q_proj(hidden) * cross.scaling, self.num_heads)
+            out = _attend(q, cross_keys[i], cross_values[i])
+            hidden = layer.encoder_attn_layer_norm(hidden + cross.out_proj(_merge_heads(out)))
+
+            ffn = layer.fc2(layer.activation_fn(layer.fc1(hidden)))
+            hidden = layer.final_layer_norm(hidden + ffn)
+
+        logits = self.output_projection(hidden[:, -1])
+        return logits, torch.stack(new_keys), torch.stack(new_values)
+
+
+def export_onnx(model, export_dir):
+    """Export model (a float32 VisionEncoderDecoderModel) as encoder.onnx and decoder_step.onnx."""
+    os.makedirs(export_dir, exist_ok=True)
+    model = model.float().eval()
+    config = model.decoder.config
+    num_layers = config.decoder_layers
+    num_heads = config.decoder_attention_heads
+    head_dim = config.d_model // num_heads
+    image_size = model.encoder.config.image_size
+    num_channels = getattr(model.encoder.config, "num_channels", 3)
+
+    pixel_values = torch.zeros(1, num_channels, image_size, image_size)
+    encoder = _EncoderGraph(model)
+    with torch.no_grad():
+        cross_keys, cross_values = encoder(pixel_values)
+    cache_axes = {1: "batch", 3: "source"}
+    torch.onnx.export(
+        encoder, (pixel_values,), os.path.join(export_dir, "encoder.onnx"),
+        input_names=["pixel_values"], output_names=["cross_keys", "cross_values"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "cross_keys": cache_axes, "cross_values": cache_axes},
+        opset_version=ONNX_OPSET, dynamo=False,
+    )
+
+    input_ids = torch.full((1, 1), model.config.decoder_start_token_id or 0, dtype=torch.long)
+    past = torch.zeros(num_layers, 1, num_heads, 1, head_dim)
+    past_axes = {1: "batch", 3: "past"}
+    torch.onnx.export(
+        _DecoderStepGraph(model), (input_ids, past, past, cross_keys, cross_values),
+        os.path.join(export_dir, "decoder_step.onnx"),
+        input_names=["input_ids", "self_keys", "self_values", "cross_keys", "cross_values"],
+        output_names=["logits", "new_self_keys", "new_self_values"],
+        dynamic_axes={
+            "input_ids": {0: "batch"},
+            "self_keys": past_axes, "self_values": past_axes,
+            "cross_keys": cache_axes, "cross_values": cache_axes,
+            "logits": {0: "batch"},
+            "new_self_keys": {1: "batch", 3: "present"}, "new_self_values": {1: "batch", 3: "present"},
+        },
+        opset_version=ONNX_OPSET, dynamo=False,
+    )
+    print(f"[OCR] Exported ONNX encoder/decoder to {export_dir}")
+
+
+class OnnxTrOCR:
+    """Greedy decoding over the exported graphs, shaped like model.generate().
+
+    Returns the same ids generate() would for greedy search: the start token,
+    then one token per step until every sequence has produced eos or hit a
+    stopping criterion (finished ones are padded), or the budget runs out.
+    Beam search isn't implemented; profiles asking for it decode greedily.
+    """
+
+    device = torch.device("cpu")
+    dtype = torch.float32
+    _warned_beams = False
+
+    def __init__(self, encoder_session, decoder_session, model):
+        self.encoder = encoder_session
+        self.decoder = decoder_session
+        self.generation_config = model.generation_config
+        self.config = model.config
+        config = model.decoder.config
+        self.num_layers = config.decoder_layers
+        self.num_heads = config.decoder_attention_heads
+        self.head_dim = config.d_model // self.num_heads
+
+    def _token_id(self, name):
+        value = getattr(self.generation_config, name, None)
+        if value is None:
+            value = getattr(self.config, name, None)
+        if value is None:
+            value = getattr(self.config.decoder, name, None)
+        return value
+
+    def generate(self, pixel_values, max_length=None, max_new_tokens=None, stopping_criteria=None,
+                 num_beams=1, **kwargs):
+        if num_beams > 1 and not self._warned_beams:
+            print("[OCR] The onnx backend only decodes greedily; ignoring num_beams")
+            self._warned_beams = True
+        pixel_values = pixel_values.detach().cpu().numpy().astype(np.float32)
+        batch = pixel_values.shape[0]
+        start_id = self._token_id("decoder_start_token_id")
+        eos_id = self._token_id("eos_token_id")
+        pad_id = self._token_id("pad_token_id")
+        if isinstance(eos_id, (list, tuple)):
+            eos_id = eos_id[0]
+        if max_new_tokens is None:
+            max_new_tokens = (max_length or self.generation_config.max_length or 20) - 1
+
+        cross_keys, cross_values = self.encoder.run(None, {"pixel_values": pixel_values})
+        self_keys = np.zeros((self.num_layers, batch, self.num_heads, 0, self.head_dim), dtype=np.float32)
+        self_values = self_keys
+
+        tokens = np.full((batch, 1), start_id, dtype=np.int64)
+        finished = np.zeros(batch, dtype=bool)
+        sequences = [tokens]
+        for _ in range(max_new_tokens):
+            logits, self_keys, self_values = self.decoder.run(None, {
+                "input_ids": tokens,
+                "self_keys": self_keys,
+                "self_values": self_values,
+                "cross_keys": cross_keys,
+                "cross_values": cross_values,
+            })
+            next_tokens = logits.argmax(axis=-1)
+            if pad_id is not None:
+                next_tokens = np.where(finished, pad_id, next_tokens)
+            tokens = next_tokens[:, None].astype(np.int64)
+            sequences.append(tokens)
+            if eos_id is not None:
+                finished |= next_tokens == eos_id
+            if stopping_criteria:
+                ids = torch.from_numpy(np.concatenate(sequences, axis=1))
+                finished |= stopping_criteria(ids, None).numpy()
+            if finished.all():
+                break
+        return torch.from_numpy(np.concatenate(sequences, axis=1))
@@ -0,0 +1,156 @@
+"""Cheap checks for pages and line crops with nothing written on them.
+
+Blank pages (versos, endpapers, separator sheets) and slicer strips holding
+only a speck of dust or a ruled line still cost a full generate call. Before
+inference each page is scored on its grayscale image: how much of it is ink,
+and how many connected blobs of ink are the size of writing rather than
+specks or long thin rules. Pages and line crops below the thresholds skip
+recognition; the skip is recorded on the page so reviewers can OCR it anyway.
+
+Ink is measured against the paper (the page's median grey), not with the
+OTSU threshold the slicer uses: OTSU always splits a page in two, so on a
+blank page the paper's own noise comes out as ink.
+"""
+import os
+import threading
+
+import cv2 as cv
+import numpy as np
+
+# Skip inference for blank pages and empty line crops
+BLANK_FILTER = os.getenv("OCR_BLANK_FILTER", "true").lower() == "true"
+# How much darker than the paper a pixel has to be to count as ink
+INK_CONTRAST = int(os.getenv("OCR_BLANK_INK_CONTRAST", "60"))
+# The checks look at the page shrunk by this factor; the sizes below are in full-size pixels
+CHECK_SCALE = max(1, int(os.getenv("OCR_BLANK_CHECK_SCALE", "2")))
+# Smallest blob of ink, in pixels, that may be writing rather than a speck
+MIN_BLOB_AREA = int(os.getenv("OCR_BLANK_MIN_BLOB_AREA", "12"))
+# Straight runs of ink at least this long are ruled lines or page edges, not writing
+RULE_LENGTH = int(os.getenv("OCR_BLANK_RULE_LENGTH", "60"))
+# Blobs this many times longer than they are thick are what is left of rules, not writing
+RULE_ELONGATION = float(os.getenv("OCR_BLANK_RULE_ELONGATION", "15"))
+# A page with less ink than this fraction of its pixels, or fewer writing blobs, is blank
+PAGE_MIN_INK = float(os.getenv("OCR_BLANK_PAGE_MIN_INK", "0.0005"))
+PAGE_MIN_BLOBS = int(os.getenv("OCR_BLANK_PAGE_MIN_BLOBS", "3"))
+# The same for one line crop, measured on its strip of the page
+LINE_MIN_INK = float(os.getenv("OCR_BLANK_LINE_MIN_INK", "0.0005"))
+LINE_MIN_BLOBS = int(os.getenv("OCR_BLANK_LINE_MIN_BLOBS", "1"))
+
+
+def params():
+    # the thresholds decide which text a page gets, so they are part of engine_params
+    if not BLANK_FILTER:
+        return None
+    return {
+        "check_scale": CHECK_SCALE, "ink_contrast": INK_CONTRAST, "min_blob_area": MIN_BLOB_AREA,
+        "rule_length": RULE_LENGTH, "rule_elongation": RULE_ELONGATION,
+        "page_min_ink": PAGE_MIN_INK, "page_min_blobs": PAGE_MIN_BLOBS,
+        "line_min_ink": LINE_MIN_INK, "line_min_blobs": LINE_MIN_BLOBS,
+    }
+
+
+def ink_mask(gray):
+    """1 where a grayscale page is ink, 0 where it is paper; None if the page is too dark to tell.
+
+    The mask is CHECK_SCALE times smaller than the page. Ruled lines are taken
+    out, so writing that touches them stays in blobs of its own.
+    """
+    if CHECK_SCALE > 1:
+        # a min filter first, so thin strokes keep their full darkness when shrunk
+        gray = cv.erode(gray, np.ones((CHECK_SCALE, CHECK_SCALE), np.uint8))
+        gray = cv.resize(gray, (gray.shape[1] // CHECK_SCALE, gray.shape[0] // CHECK_SCALE),
+                         interpolation=cv.INTER_NEAREST)
+    histogram = cv.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    paper = int(np.searchsorted(np.cumsum(histogram), gray.size / 2))
+    if paper <= INK_CONTRAST:
+        return None
+    mask = (gray < paper - INK_CONTRAST).view(np.uint8)
+    rule_length = max(2, RULE_LENGTH // CHECK_SCALE)
+    # both kinds of rule are found before either is removed, or crossings would cut them short
+    rules = [cv.morphologyEx(mask, cv.MORPH_OPEN, cv.getStructuringElement(cv.MORPH_RECT, kernel))
+             for kernel in ((rule_length, 1), (1, rule_length))]
+    return mask & (1 - (rules[0] | rules[1]))
+
+
+def ink_score(mask):
+    """(fraction of pixels that are ink, number of writing-sized blobs) of an ink mask."""
+    inked = cv.countNonZero(mask)
+    if not inked:
+        return 0.0, 0
+    _, _, stats, _ = cv.connectedComponentsWithStats(mask, connectivity=8)
+    # label 0 is the paper
+    widths, heights = stats[1:, cv.CC_STAT_WIDTH], stats[1:, cv.CC_STAT_HEIGHT]
+    writing = (stats[1:, cv.CC_STAT_AREA] >= MIN_BLOB_AREA / CHECK_SCALE ** 2) & (
+        np.maximum(widths, heights) < RULE_ELONGATION * np.minimum(widths, heights))
+    return inked / mask.size, int(writing.sum())
+
+
+def is_blank_page(mask):
+    if mask is None:
+        return False
+    ink, blobs = ink_score(mask)
+    return ink < PAGE_MIN_INK or blobs < PAGE_MIN_BLOBS
+
+
+def empty_lines(mask, boxes):
+    """Indexes of the (top, bottom) strips of the page with nothing written in them."""
+    if mask is None:
+        return []
+    empty = []
+    for i, (top, bottom) in enumerate(boxes):
+        ink, blobs = ink_score(mask[top // CHECK_SCALE:-(-bottom // CHECK_SCALE)])
+        if ink < LINE_MIN_INK or blobs < LINE_MIN_BLOBS:
+            empty.append(i)
+    return empty
+
+
+class SkipCounter:
+    """What the filter skipped in this process, and roughly how much inference that saved.
+
+    The saving is an estimate: skipped pages and lines are costed at the mean
+    inference time of the pages and lines that were recognized.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"pages_checked": 0, "blank_pages": 0, "lines_checked": 0, "empty_lines": 0,
+                       "check_seconds": 0.0, "recognized_pages": 0, "recognized_lines": 0,
+                       "inference_seconds": 0.0, "saved_seconds": 0.0}
+
+    def checked(self, seconds, lines=0):
+        with self._lock:
+            self._stats["pages_checked"] += 1
+            self._stats["lines_checked"] += lines
+            self._stats["check_seconds"] += seconds
+
+    def recognized(self, seconds, lines):
+        # inference of one page that went through, the basis of the estimate
+        with self._lock:
+            self._stats["recognized_pages"] += 1
+            self._stats["recognized_lines"] += lines
+            self._stats["inference_seconds"] += seconds
+
+    def skipped(self, pages=0, lines=0):
+        """Count a blank page or empty lines; returns the inference seconds that likely saved."""
+        with self._lock:
+            stats = self._stats
+            saved = 0.0
+            if pages and stats["recognized_pages"]:
+                saved += pages * stats["inference_seconds"] / stats["recognized_pages"]
+            if lines and stats["recognized_lines"]:
+                saved += lines * stats["inference_seconds"] / stats["recognized_lines"]
+            stats["blank_pages"] += pages
+            stats["empty_lines"] += lines
+            stats["saved_seconds"] += saved
+        return saved
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["enabled"] = BLANK_FILTER
+        for key in ("check_seconds", "inference_seconds", "saved_seconds"):
+            stats[key] = round(stats[key], 3)
+        return stats
+
+
+skip_counter = SkipCounter()
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image
+
+CACHE_ENABLED = os.getenv("OCR_CACHE", "true").lower() == "true"
+CACHE_PATH = os.getenv(
+    "OCR_CACHE_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "instance", "ocr_cache.db"),
+)
+CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "50000"))
+
+
+# Files holding model weights, whose size and mtime identify them
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth", ".onnx")
+
+_fingerprints = {}
+
+
+def _model_dir(model_path):
+    # a local directory, or the hub model's snapshot in the local cache once it's downloaded
+    if os.path.isdir(model_path):
+        return model_path
+    try:
+        from huggingface_hub import try_to_load_from_cache
+        config = try_to_load_from_cache(model_path, "config.json")
+    except Exception:
+        return None
+    return os.path.dirname(config) if isinstance(config, str) else None
+
+
+def weights_fingerprint(model_path):
+    """Hash of the model's config.json and the size and mtime of its weight files; None if not found."""
+    if model_path in _fingerprints:
+        return _fingerprints[model_path]
+    directory = _model_dir(model_path)
+    if directory is None:
+        return None
+    digest = hashlib.sha256()
+    try:
+        with open(os.path.join(directory, "config.json"), "rb") as f:
+            digest.update(f.read())
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(WEIGHT_SUFFIXES):
+                stat = os.stat(os.path.join(directory, name))
+                digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    except OSError:
+        return None
+    # kept for the process: the weights it has loaded don't change under it
+    _fingerprints[model_path] = digest.hexdigest()[:16]
+    return _fingerprints[model_path]
+
+
+def page_cache_key(image: Image.Image, engine_params: dict) -> str:
+    # Same pixels + same model weights and pipeline settings -> same transcription. Weights
+    # swapped at the same MODEL_PATH give a different fingerprint
+    digest = hashlib.sha256()
+    digest.update(json.dumps(engine_params, sort_keys=True).encode("utf-8"))
+    if engine_params.get("model"):
+        digest.update(f"weights:{weights_fingerprint(engine_params['model'])}".encode("utf-8"))
+    digest.update(f"{image.mode}:{image.size}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class OcrResultCache:
+    """Persistent page transcription cache in its own SQLite file.
+
+    Entries are keyed by page_cache_key, so a different model, other weights
+    or different preprocessing/slicing parameters never hit old results; those simply age
+    out. Beyond max_entries the least recently used rows are evicted.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # one connection per process; worker processes open their own
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_result ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_ocr_result_last_used ON ocr_result (last_used)")
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT text FROM ocr_result WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE ocr_result SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, text):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO ocr_result (key, text, last_used) VALUES (?, ?, ?)",
+                (key, text, time.time()),
+            )
+            count = conn.execute("SELECT count(*) FROM ocr_result").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                conn.execute(
+                    "DELETE FROM ocr_result WHERE key IN ("
+                    "SELECT key FROM ocr_result ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self.evictions += excess
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM ocr_result")
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._connection().execute("SELECT count(*) FROM ocr_result").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "max_entries": self.max_entries,
+            }
+
+
+result_cache = OcrResultCache()
@@ -0,0 +1,186 @@
+"""How each line crop is decoded: profile, token budget and repetition stop.
+
+A profile is a set of generate() arguments on top of the model's own
+generation_config: "model" (the default) adds none, so the checkpoint decodes
+as it was released to (beam search for trocr-base-handwritten); "fast" is
+greedy and "accurate" 4-beam search. The token budget grows with the line's aspect ratio (inked width over
+height), so a short marginal note isn't given the budget of a full-width line.
+Decoding stops early once a sequence starts repeating itself, and the repeats
+are cut off again before the ids are turned into text.
+
+Per-line token counts and decode times go to decode_stats; set OCR_DECODE_LOG
+to also append them to a JSONL file, and summarize that file with
+decode_report.py.
+"""
+import json
+import math
+import os
+import threading
+from collections import deque
+
+import numpy as np
+import torch
+from transformers import StoppingCriteria
+
+# generate() arguments per profile, over the model's generation_config. The default keeps the
+# model's own decoding; "fast" (greedy) is quicker but less accurate than a beam-search model
+DECODE_PROFILES = {
+    "model": {},
+    "fast": {"num_beams": 1, "do_sample": False},
+    "accurate": {"num_beams": 4, "do_sample": False, "early_stopping": True},
+}
+DECODE_PROFILE = os.getenv("OCR_DECODE_PROFILE", "model")
+# max_new_tokens = tokens per unit of line aspect ratio, clamped to [min, max]
+TOKENS_PER_ASPECT = float(os.getenv("OCR_TOKENS_PER_ASPECT", "2.0"))
+MIN_NEW_TOKENS = int(os.getenv("OCR_MIN_NEW_TOKENS", "8"))
+MAX_NEW_TOKENS = int(os.getenv("OCR_MAX_NEW_TOKENS", "64"))
+# Stop a line once its tail is the same 1..REPEAT_MAX_NGRAM tokens this many times over; 0 disables
+REPEAT_STOP = int(os.getenv("OCR_REPEAT_STOP", "4"))
+REPEAT_MAX_NGRAM = 4
+DECODE_LOG = os.getenv("OCR_DECODE_LOG", "")
+
+
+def decode_profile(name=DECODE_PROFILE):
+    try:
+        return DECODE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown decode profile {name!r}, expected one of {', '.join(DECODE_PROFILES)}")
+
+
+def shares_budget(profile=DECODE_PROFILE, model=None):
+    """Whether lines decoded together must have the same token budget to read as they would alone.
+
+    Greedy rows don't affect each other, so a row cut back to its own budget is
+    what it would have been alone. Beam search ranks its beams against the
+    call's max_length, so a row run to a batch mate's larger budget can end up
+    with different text. A profile that leaves num_beams to the model is
+    taken to beam search unless the model is given and says otherwise.
+    """
+    num_beams = decode_profile(profile).get("num_beams")
+    if num_beams is None:
+        num_beams = (model.generation_config.num_beams or 1) if model is not None else 2
+    return num_beams > 1
+
+
+def token_budget(aspect):
+    # aspect is inked width / height of the line; None means unknown, so the full budget
+    if aspect is None:
+        return MAX_NEW_TOKENS
+    return int(min(MAX_NEW_TOKENS, max(MIN_NEW_TOKENS, math.ceil(TOKENS_PER_ASPECT * aspect))))
+
+
+def _repeated_tail(ids, repeats=REPEAT_STOP, max_ngram=REPEAT_MAX_NGRAM):
+    # length n of an n-gram the sequence ends with `repeats` times in a row, or 0
+    if repeats < 2:
+        return 0
+    for n in range(1, max_ngram + 1):
+        if len(ids) < n * repeats:
+            break
+        tail = ids[-n:]
+        if all(ids[-n * (k + 1):len(ids) - n * k] == tail for k in range(1, repeats)):
+            return n
+    return 0
+
+
+class RepetitionStop(StoppingCriteria):
+    """Marks a sequence finished once it ends in the same n-gram REPEAT_STOP times."""
+
+    def __init__(self, repeats=REPEAT_STOP, max_ngram=REPEAT_MAX_NGRAM):
+        self.repeats = repeats
+        self.max_ngram = max_ngram
+
+    def __call__(self, input_ids, scores=None, **kwargs):
+        return torch.tensor(
+            [_repeated_tail(row, self.repeats, self.max_ngram) > 0 for row in input_ids.tolist()],
+            dtype=torch.bool, device=input_ids.device,
+        )
+
+
+def trim_repetition(ids, repeats=REPEAT_STOP, max_ngram=REPEAT_MAX_NGRAM):
+    """Cut a degenerate repeated tail of ids down to one copy. Returns (ids, trimmed)."""
+    n = _repeated_tail(ids, repeats, max_ngram)
+    if not n:
+        return ids, False
+    # keep one copy of the n-gram, however many times it actually repeated
+    end = len(ids) - n
+    while end - n >= 0 and ids[end - n:end] == ids[-n:]:
+        end -= n
+    return ids[:end + n], True
+
+
+def postprocess_ids(generated_ids, pad_id, eos_id, budgets):
+    """Strip padding and repeated tails from generate() output.
+
+    A batch decodes up to its largest budget; each row is cut back to its own
+    here. Under greedy decoding that makes a line read the same whichever batch
+    it was in; beam search needs every row of the call to share its budget
+    (see shares_budget). Returns one
+    (ids, tokens, finished, repeated) tuple per row: the cleaned ids, the
+    number of generated tokens (start token and padding excluded), whether the
+    row reached eos, and whether it was cut at a repetition.
+    """
+    results = []
+    for row, budget in zip(generated_ids.tolist(), budgets):
+        generated = row[1:budget + 1]
+        finished = eos_id in generated
+        if finished:
+            generated = generated[:generated.index(eos_id)]
+        if pad_id is not None:
+            generated = [t for t in generated if t != pad_id]
+        tokens = len(generated) + finished
+        body, repeated = trim_repetition(generated)
+        results.append((row[:1] + body + ([eos_id] if finished else []), tokens, finished, repeated))
+    return results
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def summarize(records):
+    """Token and time statistics for decode records, plus a suggested TOKENS_PER_ASPECT.
+
+    The suggestion is the 95th percentile of tokens per unit aspect over lines
+    that finished inside their budget, so most lines fit without cutting any off.
+    """
+    records = list(records)
+    tokens = [r["tokens"] for r in records]
+    seconds = [r["seconds"] for r in records]
+    finished = [r["tokens"] / r["aspect"] for r in records
+                if r.get("aspect") and not r["hit_budget"] and not r["repetition_stop"]]
+    return {
+        "lines": len(records),
+        "tokens_mean": float(np.mean(tokens)) if tokens else None,
+        "tokens_p50": _percentile(tokens, 50),
+        "tokens_p95": _percentile(tokens, 95),
+        "tokens_max": max(tokens) if tokens else None,
+        "seconds_per_line_mean": float(np.mean(seconds)) if seconds else None,
+        "seconds_per_line_p95": _percentile(seconds, 95),
+        "budget_hits": sum(r["hit_budget"] for r in records),
+        "repetition_stops": sum(r["repetition_stop"] for r in records),
+        "suggested_tokens_per_aspect": _percentile(finished, 95),
+    }
+
+
+class DecodeStats:
+    """Per-line decode records: a bounded in-memory window and an optional JSONL log."""
+
+    def __init__(self, log_path=DECODE_LOG, window=10000):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=window)
+
+    def record(self, records):
+        with self._lock:
+            self._records.extend(records)
+            if self.log_path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(r) + "\n" for r in records))
+
+    def report(self):
+        with self._lock:
+            return summarize(self._records)
+
+
+decode_stats = DecodeStats()
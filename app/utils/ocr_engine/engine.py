@@ -0,0 +1,177 @@
+"""Per-page OCR: cache lookup, slicing, recognition, and the settings that decide the output."""
+from .ocr_model import load_model, recognize_single_image, recognize_lines_batched, processor_input_size, BATCH_SIZE, MODEL_PATH, MODEL_DTYPE, MODEL_BACKEND
+from .slicer import preprocess_and_slice, crop_aspects
+from .preprocessing import to_grayscale
+from .aggregator import aggregate_text
+from .cache import result_cache, page_cache_key, CACHE_ENABLED
+from . import timing
+from . import remote
+from . import scheduler
+from . import blank
+from .decoding import DECODE_PROFILE, TOKENS_PER_ASPECT, MIN_NEW_TOKENS, MAX_NEW_TOKENS, REPEAT_STOP
+from PIL import Image
+import numpy as np
+import io
+import os
+import json
+import base64
+import time
+
+# Bump when preprocessing/slicing/recognition changes in a way that alters output
+ENGINE_VERSION = "3"
+SLICE_MIN_HEIGHT = 10
+SLICE_PADDING = 10
+# "contour" (morphology + contours) or "projection" (faster horizontal ink profile)
+SEGMENTER = os.getenv("OCR_SEGMENTER", "contour")
+
+def engine_params():
+    # Everything that decides what text a page produces; part of the OCR cache key
+    if remote.enabled():
+        return {"engine_version": ENGINE_VERSION, "backend": "remote", **remote.get_engine().params(),
+                "blank_filter": blank.params()}
+    return {
+        "engine_version": ENGINE_VERSION,
+        "model": MODEL_PATH,
+        "dtype": MODEL_DTYPE,
+        "backend": MODEL_BACKEND,
+        "slice_min_height": SLICE_MIN_HEIGHT,
+        "slice_padding": SLICE_PADDING,
+        "segmenter": SEGMENTER,
+        "decode_profile": DECODE_PROFILE,
+        "tokens_per_aspect": TOKENS_PER_ASPECT,
+        "min_new_tokens": MIN_NEW_TOKENS,
+        "max_new_tokens": MAX_NEW_TOKENS,
+        "repeat_stop": REPEAT_STOP,
+        "blank_filter": blank.params(),
+    }
+
+def engine_signature():
+    # Recorded on every FilePage; pages whose signature differs from this one are stale
+    return ENGINE_VERSION, json.dumps(engine_params(), sort_keys=True)
+
+def _to_pil_image(page):
+    # pages arrive as PIL images or numpy arrays; base64 PNG strings are still accepted
+    if isinstance(page, Image.Image):
+        return page.convert("RGB")
+    if isinstance(page, np.ndarray):
+        return Image.fromarray(page).convert("RGB")
+    return Image.open(io.BytesIO(base64.b64decode(page))).convert("RGB")
+
+class PageWork:
+    """A page between slicing and recognition: its line crops, or its text already."""
+
+    def __init__(self, image):
+        self.image = image
+        self.cache_key = None
+        self.text = None
+        self.crops = None
+        self.aspects = None
+        # why inference was skipped ("blank_page"), and how many empty line crops were dropped
+        self.skipped = None
+        self.skipped_lines = 0
+
+def slice_page(page, use_cache=CACHE_ENABLED, skip_blank=blank.BLANK_FILTER):
+    # First half of run_ocr_engine: cache lookup, blank check, then preprocessing and slicing.
+    # skip_blank=False OCRs blank pages and empty lines anyway, for reviewers overriding a skip
+    image = _to_pil_image(page)
+    work = PageWork(image)
+
+    # A page seen before with the same engine settings skips inference entirely
+    if use_cache:
+        with timing.timed("cache_lookup"):
+            params = engine_params()
+            if not skip_blank:
+                # an override gets the text the engine gives with the filter off
+                params["blank_filter"] = None
+            work.cache_key = page_cache_key(image, params)
+            work.text = result_cache.get(work.cache_key)
+        if work.text is not None:
+            return work
+
+    gray = to_grayscale(image)
+    mask = None
+    if skip_blank:
+        # a page with no writing on it never reaches the model, local or remote
+        start = time.perf_counter()
+        mask = blank.ink_mask(gray)
+        page_blank = blank.is_blank_page(mask)
+        check_seconds = time.perf_counter() - start
+        timing.record("blank_check", check_seconds)
+        if page_blank:
+            blank.skip_counter.checked(check_seconds)
+            work.text, work.skipped = "", "blank_page"
+            timing.count("skipped_pages", 1)
+            timing.count("saved_ms", round(1000 * blank.skip_counter.skipped(pages=1)))
+            return work
+
+    if remote.enabled():
+        # the whole page goes to the remote model, no local slicing or inference
+        if skip_blank:
+            blank.skip_counter.checked(check_seconds)
+        return work
+
+    processor, _ = load_model()
+
+    # preprocessing and slicing in one grayscale pass; crops come out at the model's input size
+    with timing.timed("preprocess_slice"):
+        work.crops, boxes = preprocess_and_slice(
+            gray, processor_input_size(processor), SEGMENTER,
+            min_height=SLICE_MIN_HEIGHT, padding=SLICE_PADDING
+        )
+        # how much is written on each line; sets its decoding budget and groups batches
+        work.aspects = crop_aspects(work.crops, boxes, image.width)
+    if skip_blank:
+        # strips the slicer found around specks or ruled lines
+        start = time.perf_counter()
+        empty = set(blank.empty_lines(mask, boxes))
+        lines_seconds = time.perf_counter() - start
+        timing.record("blank_check", lines_seconds)
+        blank.skip_counter.checked(check_seconds + lines_seconds, len(boxes))
+        if empty:
+            work.crops = [crop for i, crop in enumerate(work.crops) if i not in empty]
+            work.aspects = [aspect for i, aspect in enumerate(work.aspects) if i not in empty]
+            work.skipped_lines = len(empty)
+            timing.count("skipped_lines", len(empty))
+            timing.count("saved_ms", round(1000 * blank.skip_counter.skipped(lines=len(empty))))
+    timing.count("lines", len(work.crops))
+    return work
+
+def recognize_page(work, batch_size=BATCH_SIZE, owner=None):
+    # Second half of run_ocr_engine: the page's text from its crops (or the remote model).
+    # owner is whose turn these crops take in the shared scheduler, the calling thread by default
+    if work.text is not None:
+        return work.text
+
+    start = time.perf_counter()
+    if remote.enabled():
+        with timing.timed("remote"):
+            final_text = remote.get_engine().transcribe(work.image)
+        line_count = len(final_text.splitlines())
+        timing.count("lines", line_count)
+    else:
+        processor, model = load_model()
+        line_count = len(work.crops)
+        with timing.timed("recognition"):
+            shared = scheduler.get_scheduler()
+            if shared is not None:
+                # other pages OCR'd in this process share these generate calls
+                lines = shared.recognize(work.crops, work.aspects, owner)
+            elif batch_size > 1:
+                lines = recognize_lines_batched(work.crops, processor, model, batch_size, widths=work.aspects,
+                                                do_resize=False, aspects=work.aspects)
+            else:
+                lines = [recognize_single_image(line_img, processor, model, do_resize=False, aspect=aspect)
+                         for line_img, aspect in zip(work.crops, work.aspects)]
+        final_text = aggregate_text(lines)
+    # what a page or line costs, to estimate what the skipped ones saved
+    blank.skip_counter.recognized(time.perf_counter() - start, line_count)
+
+    if work.cache_key is not None:
+        with timing.timed("cache_store"):
+            result_cache.put(work.cache_key, final_text)
+    return final_text
+
+# def run_ocr_engine(image_path, processor, model):
+def run_ocr_engine(page, batch_size=BATCH_SIZE, use_cache=CACHE_ENABLED, skip_blank=blank.BLANK_FILTER):
+    # app.pipeline runs the two halves in separate threads, so pages overlap
+    return recognize_page(slice_page(page, use_cache, skip_blank), batch_size)
@@ -1,38 +1,218 @@
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 from PIL import Image
+from collections import OrderedDict
+import os
+import threading
+import time
 import torch
 from .preprocessing import preprocess_image
+from . import timing
+from .backends import load_backend
+from .decoding import DECODE_PROFILE, REPEAT_STOP, RepetitionStop, decode_profile, decode_stats, postprocess_ids, shares_budget, token_budget
+from transformers import StoppingCriteriaList
 
 
-MODEL_PATH = "microsoft/trocr-base-handwritten"
+MODEL_PATH = os.getenv("OCR_MODEL_PATH", "microsoft/trocr-base-handwritten")
+MODEL_DEVICE = os.getenv("OCR_DEVICE", "cpu")
+MODEL_DTYPE = os.getenv("OCR_DTYPE", "float32")
+# "pytorch", "pytorch-int8" or "onnx", see backends.py
+MODEL_BACKEND = os.getenv("OCR_BACKEND", "pytorch")
+# How many (model path, device, dtype, backend) variants may stay loaded at once
+MODEL_CACHE_SIZE = int(os.getenv("OCR_MODEL_CACHE_SIZE", "2"))
+# Line crops per generate call; 1 keeps the one-line-at-a-time path
+BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "1"))
 
-def load_model():
-    
-    # global processor, model
-    # if processor is None or model is None:
-    #     processor = TrOCRProcessor.from_pretrained(MODEL_PATH)
-    #     model = VisionEncoderDecoderModel.from_pretrained(MODEL_PATH)
-    #     model.eval()
 
-    processor = TrOCRProcessor.from_pretrained(MODEL_PATH)
-    model = VisionEncoderDecoderModel.from_pretrained(MODEL_PATH)
-    model.eval()
-    return processor, model
+def _param_bytes(model):
+    # weights held by torch; quantized Linear weights aren't parameters and ONNX sessions have none
+    if not isinstance(model, torch.nn.Module):
+        return None
+    return sum(t.numel() * t.element_size() for t in model.state_dict().values() if isinstance(t, torch.Tensor))
+
+
+def _process_rss_bytes():
+    # resident memory of this process, or None if we can't tell
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class ModelRegistry:
+    """Loads each (model path, device, dtype, backend) once per process and keeps the
+    most recently used ones in memory, evicting the oldest beyond max_models."""
+
+    def __init__(self, max_models=MODEL_CACHE_SIZE):
+        self.max_models = max(1, max_models)
+        self._lock = threading.Lock()
+        self._models = OrderedDict()
+        self._stats = {}
+
+    def get(self, model_path=MODEL_PATH, device=MODEL_DEVICE, dtype=MODEL_DTYPE, backend=MODEL_BACKEND):
+        key = (model_path, device, dtype, backend)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self._stats[key]["hits"] += 1
+                return self._models[key]
+
+            rss_before = _process_rss_bytes()
+            start = time.perf_counter()
+            processor, model = load_backend(backend, model_path, device, dtype)
+            load_seconds = time.perf_counter() - start
+            rss_after = _process_rss_bytes()
+
+            self._models[key] = (processor, model)
+            self._stats[key] = {
+                "load_seconds": load_seconds,
+                "param_bytes": _param_bytes(model),
+                "rss_delta_bytes": (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+                "hits": 0,
+            }
+            timing.record("model_load", load_seconds)
+            print(f"[OCR] Loaded {model_path} ({backend}) on {device}/{dtype} in {load_seconds:.2f}s")
+
+            while len(self._models) > self.max_models:
+                evicted, _ = self._models.popitem(last=False)
+                print(f"[OCR] Evicted model {evicted[0]} ({evicted[3]}) on {evicted[1]}/{evicted[2]}")
+            return processor, model
+
+    def warm_up(self, model_path=MODEL_PATH, device=MODEL_DEVICE, dtype=MODEL_DTYPE, backend=MODEL_BACKEND):
+        # load the weights and run one tiny generate so the first real page isn't slow
+        processor, model = self.get(model_path, device, dtype, backend)
+        recognize_single_image(Image.new("RGB", (64, 64), "white"), processor, model)
+        return processor, model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def report(self):
+        with self._lock:
+            return {
+                "loaded": [
+                    {"model_path": k[0], "device": k[1], "dtype": k[2], "backend": k[3], **self._stats[k]}
+                    for k in self._models
+                ],
+                "rss_bytes": _process_rss_bytes(),
+            }
+
+
+registry = ModelRegistry()
+
+
+def load_model(model_path=MODEL_PATH, device=MODEL_DEVICE, dtype=MODEL_DTYPE, backend=MODEL_BACKEND):
+    return registry.get(model_path, device, dtype, backend)
+
+def processor_input_size(processor) -> tuple:
+    # (width, height) the image processor resizes every crop to
+    size = processor.image_processor.size
+    if "height" in size:
+        return size["width"], size["height"]
+    return size["shortest_edge"], size["shortest_edge"]
+
+def _special_ids(model):
+    config = model.generation_config
+    pad_id = config.pad_token_id if config.pad_token_id is not None else model.config.pad_token_id
+    eos_id = config.eos_token_id if config.eos_token_id is not None else model.config.eos_token_id
+    if isinstance(eos_id, (list, tuple)):
+        eos_id = eos_id[0]
+    return pad_id, eos_id
+
+def _line_aspect(img):
+    # width / height of a crop that hasn't been resized yet; unknown for arrays
+    if isinstance(img, Image.Image):
+        return img.width / max(1, img.height)
+    return None
+
+def _generate_text(pixel_values, processor, model, aspects, profile=DECODE_PROFILE) -> list[str]:
+    # One generate call under the decode profile, run to the largest token budget in
+    # the call; records tokens and time per line in decode_stats
+    budgets = [token_budget(a) for a in aspects]
+    if len(set(budgets)) > 1 and shares_budget(profile, model):
+        # beam search: one call per budget, so each line reads as it would alone
+        texts = [None] * len(budgets)
+        for budget in sorted(set(budgets)):
+            rows = [i for i, b in enumerate(budgets) if b == budget]
+            for i, text in zip(rows, _generate_text(pixel_values[rows], processor, model,
+                                                    [aspects[i] for i in rows], profile)):
+                texts[i] = text
+        return texts
+    # max_length counts the decoder start token
+    kwargs = dict(decode_profile(profile), max_length=max(budgets) + 1)
+    if REPEAT_STOP:
+        kwargs["stopping_criteria"] = StoppingCriteriaList([RepetitionStop()])
+    start = time.perf_counter()
+    generated_ids = model.generate(pixel_values, **kwargs)
+    seconds = time.perf_counter() - start
+
+    rows = postprocess_ids(generated_ids, *_special_ids(model), budgets)
+    decode_stats.record([
+        {
+            "profile": profile,
+            "aspect": round(aspect, 3) if aspect is not None else None,
+            "budget": budget,
+            "tokens": tokens,
+            "seconds": round(seconds / len(rows), 5),
+            "hit_budget": not finished and not repeated and tokens >= budget,
+            "repetition_stop": repeated,
+        }
+        for aspect, budget, (_, tokens, finished, repeated) in zip(aspects, budgets, rows)
+    ])
+    return processor.batch_decode([ids for ids, _, _, _ in rows], skip_special_tokens=True)
 
 # def recognize_single_image(img : Image.Image)-> str:
-def recognize_single_image(img: Image.Image, processor, model) -> str:
-    # load_model()  
+def recognize_single_image(img: Image.Image, processor, model, do_resize: bool = True,
+                           aspect: float = None, profile: str = DECODE_PROFILE) -> str:
+    # load_model()
     # apply preprocessing
     # img = preprocess_image(img)
-    
+
+    # do_resize=False for crops already at processor_input_size; pass their aspect then
     with torch.no_grad():
-        pixel_values = processor(images=img, return_tensors="pt").pixel_values
-        generated_ids = model.generate(pixel_values)
-        text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+        pixel_values = processor(images=img, return_tensors="pt", do_resize=do_resize).pixel_values
+        pixel_values = pixel_values.to(device=model.device, dtype=model.dtype)
+        if aspect is None:
+            aspect = _line_aspect(img)
+        text = _generate_text(pixel_values, processor, model, [aspect], profile)[0]
         return text.strip()
 
-def recognize_batch_images(images: list[Image.Image], processor, model) -> list[str]:
+def recognize_batch_images(images: list[Image.Image], processor, model, do_resize: bool = True,
+                           aspects: list = None, profile: str = DECODE_PROFILE) -> list[str]:
     with torch.no_grad():
-        pixel_values = processor(images=images, return_tensors="pt", padding=True).pixel_values
-        generated_ids = model.generate(pixel_values)
-        return processor.batch_decode(generated_ids, skip_special_tokens=True)
+        pixel_values = processor(images=images, return_tensors="pt", padding=True, do_resize=do_resize).pixel_values
+        pixel_values = pixel_values.to(device=model.device, dtype=model.dtype)
+        if aspects is None:
+            aspects = [_line_aspect(img) for img in images]
+        return _generate_text(pixel_values, processor, model, aspects, profile)
+
+def recognize_lines_batched(images: list[Image.Image], processor, model, batch_size: int = BATCH_SIZE,
+                            widths: list = None, do_resize: bool = True, aspects: list = None,
+                            profile: str = DECODE_PROFILE) -> list[str]:
+    # Batches of similar width, so short lines don't wait on a long one's budget; under beam
+    # search only lines of one budget share a batch. Results come back in the original order.
+    # Pass widths and aspects for crops already resized to the input size
+    if aspects is None:
+        aspects = [_line_aspect(img) for img in images]
+    if widths is None:
+        widths = [img.width for img in images]
+    batch_size = max(1, batch_size)
+    order = sorted(range(len(images)), key=lambda i: widths[i])
+    if shares_budget(profile, model):
+        budgets = [token_budget(a) for a in aspects]
+        runs = [[i for i in order if budgets[i] == budget] for budget in sorted(set(budgets))]
+    else:
+        runs = [order]
+    groups = [run[start:start + batch_size] for run in runs for start in range(0, len(run), batch_size)]
+    results = [None] * len(images)
+    for group in groups:
+        texts = recognize_batch_images([images[i] for i in group], processor, model, do_resize,
+                                       [aspects[i] for i in group], profile)
+        for i, text in zip(group, texts):
+            results[i] = text.strip()
+    return results
@@ -2,24 +2,28 @@ import cv2 as cv
 from PIL import Image
 import numpy as np
 
+def to_grayscale(img) -> np.ndarray:
+    # PIL image or numpy array -> 2D uint8 array, converting only when needed
+    if isinstance(img, Image.Image):
+        if img.mode == "L":
+            return np.asarray(img)
+        img = np.asarray(img.convert("RGB"))
+    if img.ndim == 2:
+        return img
+    return cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+
+def binarize(gray: np.ndarray) -> np.ndarray:
+    # median filter + OTSU threshold on a grayscale array; ink is 0, paper 255
+    denoised = cv.medianBlur(gray, 3)
+    denoised = cv.normalize(denoised, None, 0, 255, cv.NORM_MINMAX)
+    _, binary = cv.threshold(denoised, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+    return binary
+
 # define a function to preprocessing
 # include grayscale, median filter, OTSU threshold
 def preprocess_image(pil_img: Image.Image) ->Image.Image:
-    # PIL to np.array
-    img = np.array(pil_img)
-    
-    # grayscale
-    gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY)
-    
-    # apply median filter
-    denoised = cv.medianBlur(gray, 3)
-    denoised = cv.normalize(denoised, None, 0, 255, cv.NORM_MINMAX)
-    
-    # Threshold
-    _, binary = cv.threshold(denoised,0, 255, cv.THRESH_BINARY+cv.THRESH_OTSU)
+    binary = binarize(to_grayscale(np.array(pil_img)))
     
     # np.array to PIL and transfer back to RGB
     preprocessed_img = Image.fromarray(cv.cvtColor(binary,cv.COLOR_GRAY2RGB))
     return preprocessed_img
-    
-    
\ No newline at end of file
@@ -0,0 +1,322 @@
+"""Remote vision-LLM transcription (Gemini generateContent), used when USE_GEMINI=true.
+
+Whole page images are sent instead of line crops, so nothing is sliced or
+run locally. Requests are made from one asyncio event loop in a background
+thread:
+
+- submit() hands a page to the loop and returns a concurrent.futures.Future,
+  so callers can have many pages in flight at once (app.pipeline runs
+  several recognizing threads for this);
+- pages queued together are batched, up to OCR_REMOTE_BATCH_PAGES images per
+  request, waiting at most OCR_REMOTE_BATCH_WAIT seconds to fill a batch;
+- at most OCR_REMOTE_CONCURRENCY requests are open at once, and a token
+  bucket keeps them under OCR_REMOTE_RPS requests per second;
+- 429, 5xx, timeouts and connection errors are retried with exponential
+  backoff and jitter, honouring Retry-After.
+
+The HTTP calls themselves are plain urllib run in a thread pool sized to the
+concurrency cap, which keeps this free of extra dependencies. Point
+OCR_REMOTE_URL at benchmarks/mock_remote.py to run everything offline.
+
+Settings are read when the engine is first used rather than at import, since
+create_app loads .env (where the installer writes USE_GEMINI and the key)
+after the engine modules are imported.
+"""
+import asyncio
+import atexit
+import base64
+import io
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from . import timing
+
+DEFAULT_URL = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-2.0-flash"
+PROMPT = (
+    "This is a scanned page from a handwritten archival record. Transcribe all of the "
+    "handwritten text exactly as written, one output line per written line, keeping the "
+    "original spelling. Output only the transcription."
+)
+BATCH_PROMPT = (
+    "These are {n} scanned pages from handwritten archival records, in order. Transcribe all "
+    "of the handwritten text on each page exactly as written, one output line per written "
+    "line, keeping the original spelling. Answer with a JSON array of exactly {n} strings, "
+    "one transcription per page, in the same order."
+)
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def enabled():
+    return os.getenv("USE_GEMINI", "false").lower() == "true"
+
+
+class RemoteEngineError(RuntimeError):
+    pass
+
+
+class _RetryableError(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _RateLimiter:
+    """Token bucket: rate requests per second on average, bursts of up to burst."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def encode_image(image, fmt="JPEG", max_side=3072, quality=90):
+    # Done in the caller's thread so the event loop only waits on the network
+    image = image.convert("RGB")
+    if max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side))
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, quality=quality)
+    mime_type = "image/png" if fmt.upper() == "PNG" else "image/jpeg"
+    return mime_type, base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def _post_json(url, body, headers, timeout):
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode("utf-8"),
+        headers={"Content-Type": "application/json", **headers}, method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        detail = e.read()[:300].decode("utf-8", "replace")
+        if e.code in RETRY_STATUS:
+            retry_after = e.headers.get("Retry-After")
+            raise _RetryableError(f"HTTP {e.code}: {detail}",
+                                  float(retry_after) if retry_after and retry_after.isdigit() else None)
+        raise RemoteEngineError(f"HTTP {e.code}: {detail}") from None
+    except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+        raise _RetryableError(f"{type(e).__name__}: {e}")
+
+
+def _response_text(data):
+    candidates = data.get("candidates") or []
+    if not candidates:
+        raise RemoteEngineError(f"No transcription returned: {data.get('promptFeedback')}")
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts).strip()
+
+
+def _batch_texts(text, n):
+    # the list a batched request asked for, or None if the model answered something else
+    try:
+        texts = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(texts, list) and len(texts) == n and all(isinstance(t, str) for t in texts):
+        return [t.strip() for t in texts]
+    return None
+
+
+class RemoteEngine:
+    def __init__(self, url=None, model=None, api_key=None, concurrency=None, rate=None, retries=None,
+                 batch_pages=None, batch_wait=None, timeout=None, backoff=None, backoff_max=None,
+                 image_format=None):
+        env = os.getenv
+        self.url = (url or env("OCR_REMOTE_URL", DEFAULT_URL)).rstrip("/")
+        self.model = model or env("OCR_REMOTE_MODEL", DEFAULT_MODEL)
+        self.api_key = api_key if api_key is not None else env("GOOGLE_AI_API_KEY", "")
+        self.concurrency = max(1, concurrency or int(env("OCR_REMOTE_CONCURRENCY", "8")))
+        self.rate = rate if rate is not None else float(env("OCR_REMOTE_RPS", "5"))
+        self.retries = retries if retries is not None else int(env("OCR_REMOTE_RETRIES", "4"))
+        self.batch_pages = max(1, batch_pages or int(env("OCR_REMOTE_BATCH_PAGES", "1")))
+        self.batch_wait = batch_wait if batch_wait is not None else float(env("OCR_REMOTE_BATCH_WAIT", "0.05"))
+        self.timeout = timeout or float(env("OCR_REMOTE_TIMEOUT", "120"))
+        self.backoff = backoff if backoff is not None else float(env("OCR_REMOTE_BACKOFF", "1"))
+        self.backoff_max = backoff_max or float(env("OCR_REMOTE_BACKOFF_MAX", "30"))
+        self.image_format = image_format or env("OCR_REMOTE_IMAGE_FORMAT", "JPEG")
+        self.counters = {"pages": 0, "requests": 0, "batches": 0, "retries": 0, "failures": 0,
+                         "batch_fallbacks": 0}
+        self._loop = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def window(self):
+        # how many pages it's worth having submitted at once
+        return self.concurrency * self.batch_pages * 2
+
+    def params(self):
+        # what decides the text; part of engine_params()
+        return {"remote_url": self.url, "remote_model": self.model, "remote_batch_pages": self.batch_pages,
+                "remote_image_format": self.image_format}
+
+    def stats(self):
+        return {"model": self.model, "url": self.url, "concurrency": self.concurrency, "rate": self.rate,
+                "batch_pages": self.batch_pages, **self.counters}
+
+    # --- caller side, any thread ---
+
+    def submit(self, image):
+        """Queue a PIL page image; returns a Future of its transcription."""
+        payload = encode_image(image, self.image_format)
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._enqueue(payload), loop)
+
+    def transcribe(self, image):
+        return self.submit(image).result()
+
+    def close(self):
+        # stop the loop thread; pages still queued fail with CancelledError
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="ocr-remote", daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    # --- event loop side ---
+
+    async def _setup(self):
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._limiter = _RateLimiter(self.rate)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ocr-remote-http")
+        self._tasks = set()
+        self._spawn(self._batcher())
+
+    async def _shutdown(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+    def _spawn(self, coro):
+        # keep a reference, asyncio only holds weak ones to running tasks
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _enqueue(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((payload, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_pages:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # the concurrency cap: wait here for a free slot, which also stops batching ahead
+            await self._slots.acquire()
+            self._spawn(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        try:
+            payloads = [payload for payload, _ in batch]
+            texts = None
+            if len(batch) > 1:
+                self.counters["batches"] += 1
+                texts = _batch_texts(await self._request(payloads), len(batch))
+                if texts is None:
+                    # the model didn't keep to the batch format; ask page by page
+                    self.counters["batch_fallbacks"] += 1
+            if texts is None:
+                texts = [await self._request([payload]) for payload in payloads]
+            for (_, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+            self.counters["pages"] += len(batch)
+        except Exception as e:
+            self.counters["failures"] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def _body(self, payloads):
+        prompt = PROMPT if len(payloads) == 1 else BATCH_PROMPT.format(n=len(payloads))
+        parts = [{"text": prompt}]
+        parts.extend({"inline_data": {"mime_type": mime_type, "data": data}} for mime_type, data in payloads)
+        body = {"contents": [{"role": "user", "parts": parts}], "generationConfig": {"temperature": 0}}
+        if len(payloads) > 1:
+            body["generationConfig"]["responseMimeType"] = "application/json"
+        return body
+
+    async def _request(self, payloads):
+        loop = asyncio.get_running_loop()
+        url = f"{self.url}/models/{self.model}:generateContent"
+        headers = {"x-goog-api-key": self.api_key} if self.api_key else {}
+        body = self._body(payloads)
+        for attempt in range(self.retries + 1):
+            await self._limiter.acquire()
+            self.counters["requests"] += 1
+            start = time.perf_counter()
+            try:
+                data = await loop.run_in_executor(self._executor, _post_json, url, body, headers, self.timeout)
+            except _RetryableError as e:
+                if attempt >= self.retries:
+                    raise RemoteEngineError(f"Gave up after {attempt + 1} attempts: {e}") from None
+                delay = e.retry_after or min(self.backoff_max, self.backoff * 2 ** attempt) * random.uniform(0.5, 1)
+                self.counters["retries"] += 1
+                timing.record("remote_retry_wait", delay)
+                await asyncio.sleep(delay)
+                continue
+            timing.record("remote_request", time.perf_counter() - start)
+            return _response_text(data)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RemoteEngine()
+            atexit.register(_engine.close)
+            print(f"[OCR] Remote engine {_engine.model} at {_engine.url}, "
+                  f"{_engine.concurrency} concurrent, {_engine.rate or 'unlimited'} req/s")
+        return _engine
@@ -0,0 +1,188 @@
+"""Shared inference scheduler: one thread owns the model, every caller queues line crops.
+
+When several documents are OCR'd at once in one process, each caller running
+its own generate calls makes them fight over the same cores. Instead callers
+submit a page's line crops here and get a Future per crop back. The scheduler
+thread gathers crops into batches of up to max_batch, waiting at most max_wait
+seconds for a batch to fill, and runs one generate call per batch.
+
+Crops are queued per owner (one document in app.pipeline, otherwise the
+calling thread) and batches take one crop from each owner in turn, so a long
+PDF gets the same share of every batch as a one-page letter and can't hold
+it up.
+
+Every crop is decoded with the scheduler's one profile. When that profile
+uses beam search, a batch only takes crops of the same token budget, because
+beam search output depends on the call's max_length (see
+decoding.shares_budget). That way a line's text never depends on which other
+uploads were in flight.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from . import timing
+
+# Most line crops in one generate call
+MAX_BATCH = int(os.getenv("OCR_SCHEDULER_MAX_BATCH", "8"))
+# How long a queued crop may wait for others to fill its batch
+MAX_WAIT = float(os.getenv("OCR_SCHEDULER_MAX_WAIT_MS", "10")) / 1000
+
+
+class _Item:
+    __slots__ = ("crop", "aspect", "future", "queued_at")
+
+    def __init__(self, crop, aspect):
+        self.crop = crop
+        self.aspect = aspect
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+def _pop_matching(queue, key, batch_key):
+    # the owner's first crop with the batch's key, or its next crop if the batch has no key yet
+    if key is None or batch_key is None:
+        return queue.popleft()
+    for i, item in enumerate(queue):
+        if key(item) == batch_key:
+            del queue[i]
+            return item
+    return None
+
+
+class InferenceScheduler:
+    def __init__(self, max_batch=MAX_BATCH, max_wait=MAX_WAIT, profile=None):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        # the decoding profile; None is DECODE_PROFILE, looked up when the model is first used
+        self.profile = profile
+        self._cond = threading.Condition()
+        # owner -> deque of _Item; the first owner is served first in the next batch
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._thread = None
+        self._stats = {"batches": 0, "crops": 0, "full_batches": 0, "busy_seconds": 0.0, "owners_max": 0}
+
+    def submit(self, crops, aspects, owner=None):
+        """Queue crops (already at the model's input size) and return a Future per crop."""
+        if owner is None:
+            owner = threading.get_ident()
+        items = [_Item(crop, aspect) for crop, aspect in zip(crops, aspects)]
+        with self._cond:
+            self._start()
+            # widest last, so consecutive crops of one owner have similar token budgets
+            self._queues.setdefault(owner, deque()).extend(sorted(items, key=lambda item: item.aspect or 0))
+            self._queued += len(items)
+            self._stats["owners_max"] = max(self._stats["owners_max"], len(self._queues))
+            self._cond.notify()
+        return [item.future for item in items]
+
+    def recognize(self, crops, aspects, owner=None):
+        # blocks until every crop of the page has its text, in the order given
+        return [future.result() for future in self.submit(crops, aspects, owner)]
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats, queued=self._queued, owners=len(self._queues),
+                         max_batch=self.max_batch, max_wait_ms=self.max_wait * 1000)
+        stats["mean_batch"] = round(stats["crops"] / stats["batches"], 2) if stats["batches"] else None
+        stats["busy_seconds"] = round(stats["busy_seconds"], 3)
+        return stats
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="ocr-scheduler", daemon=True)
+            self._thread.start()
+
+    def _take_batch(self, key=None):
+        # key(item), when given, must be equal for every crop of the batch
+        with self._cond:
+            while not self._queued:
+                self._cond.wait()
+            # a full batch goes at once; otherwise wait for more until the oldest crop's time is up
+            while self._queued < self.max_batch:
+                oldest = min(queue[0].queued_at for queue in self._queues.values())
+                remaining = oldest + self.max_wait - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, batch_key, passed = [], None, []
+            while len(batch) < self.max_batch and self._queues:
+                # one crop from each owner in turn
+                owner, queue = next(iter(self._queues.items()))
+                item = _pop_matching(queue, key, batch_key)
+                if item is None:
+                    # nothing of this owner's fits the batch; it keeps its turn for the next one
+                    passed.append((owner, self._queues.pop(owner)))
+                    continue
+                if key is not None and batch_key is None:
+                    batch_key = key(item)
+                batch.append(item)
+                self._queued -= 1
+                if queue:
+                    self._queues.move_to_end(owner)
+                else:
+                    del self._queues[owner]
+            for owner, queue in reversed(passed):
+                self._queues[owner] = queue
+                self._queues.move_to_end(owner, last=False)
+            return batch
+
+    def _loop(self):
+        from .decoding import DECODE_PROFILE, shares_budget, token_budget
+        from .ocr_model import load_model, recognize_batch_images
+
+        profile = self.profile or DECODE_PROFILE
+
+        def budget_key(item):
+            return token_budget(item.aspect)
+
+        # until the model is loaded, a profile that leaves beams to it is taken to beam search
+        key = budget_key if shares_budget(profile) else None
+        while True:
+            batch = self._take_batch(key)
+            # futures the caller already gave up on don't need inference
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                processor, model = load_model()
+                key = budget_key if shares_budget(profile, model) else None
+                texts = recognize_batch_images([item.crop for item in batch], processor, model, do_resize=False,
+                                               aspects=[item.aspect for item in batch], profile=profile)
+            except Exception as e:
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            finally:
+                seconds = time.perf_counter() - start
+                timing.record("scheduler_batch", seconds)
+                with self._cond:
+                    self._stats["batches"] += 1
+                    self._stats["crops"] += len(batch)
+                    self._stats["full_batches"] += len(batch) >= self.max_batch
+                    self._stats["busy_seconds"] += seconds
+            for item, text in zip(batch, texts):
+                item.future.set_result(text.strip())
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler(max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+    """Route this process's local recognition through one shared scheduler from now on."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler(max_batch, max_wait)
+        return _scheduler
+
+
+def get_scheduler():
+    # None unless start_scheduler was called: callers then run inference themselves
+    return _scheduler
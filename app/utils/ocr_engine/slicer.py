@@ -1,18 +1,11 @@
 import cv2 as cv
-import numpy as np 
+import numpy as np
 from typing import List
 from PIL import Image
+from .preprocessing import to_grayscale, binarize
 
 
-def auto_slice_lines(pil_imgae: Image.Image, min_height: int = 10, padding: int =10)->List[Image.Image]:
-    # convert OpenCv format
-    image = np.array(pil_imgae.convert("RGB"))
-    gray = cv.cvtColor(image, cv.COLOR_RGB2GRAY)
-    
-    # Preprocessing
-    blurred = cv.medianBlur(gray, 3)
-    _, thresh = cv.threshold(blurred, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
-    
+def segment_lines_contour(thresh: np.ndarray, min_height: int = 10, padding: int = 10) -> List[tuple]:
     # Canny
     edges = cv.Canny(thresh, 30, 100)
     edges = cv.bitwise_not(edges)
@@ -20,41 +13,111 @@ def auto_slice_lines(pil_imgae: Image.Image, min_height: int = 10, padding: int
     dilated = cv.morphologyEx(edges, cv.MORPH_OPEN ,kernel, iterations=2)
     dilated = cv.dilate(dilated, kernel,iterations=2)
     dilated = cv.bitwise_not(dilated)
-    
+
     # find contours
     contours, _ = cv.findContours(dilated, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
-    
+
     valid_contours = []
     for cnt in contours:
         x, y, w, h = cv.boundingRect(cnt)
         area = cv.contourArea(cnt)
-        if 50< area < 0.9 * thresh.shape[0] * thresh.shape[1]:  
+        if 50< area < 0.9 * thresh.shape[0] * thresh.shape[1]:
             valid_contours.append(cnt)
-        
+
     lines = []
     for cnt in valid_contours:
         x, y, w, h = cv.boundingRect(cnt)
         if h > min_height:
             top = max(0, y-padding)
-            bottom = min(image.shape[0], y+h+padding)
+            bottom = min(thresh.shape[0], y+h+padding)
             lines.append((top,bottom))
-    
 
     lines.sort(key=lambda b: b[0])
-    target_height = 64 
+    return lines
+
+
+def segment_lines_projection(binary: np.ndarray, min_height: int = 10, padding: int = 10,
+                             min_ink_ratio: float = 0.002, max_gap: int = 3) -> List[tuple]:
+    # Rows with more than min_ink_ratio of their width inked are text; runs of them closer
+    # than max_gap rows are one line. Whole-array numpy, no contour tracing
+    height, width = binary.shape
+    profile = np.count_nonzero(binary < 128, axis=1)
+    text_rows = profile > max(1, min_ink_ratio * width)
+
+    # start/end rows of each run of text rows
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], text_rows.view(np.int8), [0]))))
+    starts, ends = edges[0::2], edges[1::2]
+    if len(starts) == 0:
+        return []
+
+    # merge runs separated by small gaps (descenders, broken strokes)
+    new_line = np.concatenate(([True], starts[1:] - ends[:-1] > max_gap))
+    first = np.flatnonzero(new_line)
+    starts = starts[first]
+    ends = np.maximum.reduceat(ends, first)
+
+    keep = (ends - starts) > min_height
+    tops = np.maximum(0, starts[keep] - padding)
+    bottoms = np.minimum(height, ends[keep] + padding)
+    return list(zip(tops.tolist(), bottoms.tolist()))
+
+
+def _crop_to_input(binary: np.ndarray, top: int, bottom: int, input_size: tuple) -> np.ndarray:
+    # full-width strip resized straight to the recognizer's input size, as RGB
+    width, height = input_size
+    strip = binary[top:bottom]
+    interpolation = cv.INTER_AREA if strip.shape[1] > width else cv.INTER_LINEAR
+    resized = cv.resize(strip, (width, height), interpolation=interpolation)
+    return cv.cvtColor(resized, cv.COLOR_GRAY2RGB)
+
+
+def preprocess_and_slice(image, input_size: tuple, method: str = "contour",
+                         min_height: int = 10, padding: int = 10):
+    # One grayscale threshold for the page; crops come out at input_size (width, height),
+    # with boxes the (top, bottom) rows of each crop in reading order
+    binary = binarize(to_grayscale(image))
+    if method == "projection":
+        boxes = segment_lines_projection(binary, min_height, padding)
+    else:
+        # A median of a binary image stays binary, so it needs no second threshold
+        boxes = segment_lines_contour(cv.medianBlur(binary, 3), min_height, padding)
+    crops = [_crop_to_input(binary, top, bottom, input_size) for top, bottom in boxes]
+    return crops, boxes
+
+
+def crop_aspects(crops: list, boxes: List[tuple], page_width: int) -> List[float]:
+    # Inked width over height of each line in page pixels, which sizes its decoding budget;
+    # the strips are page-wide, so their own aspect ratio says nothing
+    aspects = []
+    for crop, (top, bottom) in zip(crops, boxes):
+        inked = np.flatnonzero((crop[:, :, 0] < 128).any(axis=0))
+        span = (inked[-1] - inked[0] + 1) / crop.shape[1] if len(inked) else 0.0
+        aspects.append(span * page_width / max(1, bottom - top))
+    return aspects
+
+
+def auto_slice_lines(pil_imgae: Image.Image, min_height: int = 10, padding: int =10)->List[Image.Image]:
+    # convert OpenCv format
+    image = np.array(pil_imgae.convert("RGB"))
+    gray = cv.cvtColor(image, cv.COLOR_RGB2GRAY)
+
+    # Preprocessing
+    blurred = cv.medianBlur(gray, 3)
+    _, thresh = cv.threshold(blurred, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+
+    lines = segment_lines_contour(thresh, min_height, padding)
+    target_height = 64
 
     cropped_lines = []
     for idx, (top, bottom) in enumerate(lines):
         cropped = pil_imgae.crop((0, top, pil_imgae.width, bottom))
-        
+
         # Resize
         w, h = cropped.size
         scale_ratio = target_height / h
         new_width = int(w * scale_ratio)
         resized = cropped.resize((new_width, target_height), Image.LANCZOS)
-        
+
         cropped_lines.append(resized)
 
-    return cropped_lines    
-                
-    
\ No newline at end of file
+    return cropped_lines
@@ -0,0 +1,72 @@
+"""Stage timing hooks for the OCR engine.
+
+Code wraps its stages in timed("name"). Every measurement goes to the
+registered hooks (the app's metrics use one), and to the collect() block
+currently open on the same thread, which is how a caller gets the breakdown
+of one page. Nothing is recorded anywhere unless someone listens.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_hooks = []
+_local = threading.local()
+
+
+class StageTimings:
+    """Seconds per stage and counts (such as lines) gathered inside one collect() block."""
+
+    def __init__(self):
+        self.stages = {}
+        self.counts = {}
+
+    def total(self):
+        return sum(self.stages.values())
+
+    def add(self, other):
+        # fold in what another block measured, e.g. a later stage run on another thread
+        for stage, seconds in other.stages.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        for name, value in other.counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+
+
+def add_hook(hook):
+    # hook(stage, seconds) is called for every measurement, from the thread that made it
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def record(stage, seconds):
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings.stages[stage] = timings.stages.get(stage, 0.0) + seconds
+    for hook in _hooks:
+        hook(stage, seconds)
+
+
+def count(name, value):
+    # facts about the current unit of work, e.g. how many lines a page had
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings.counts[name] = timings.counts.get(name, 0) + value
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect():
+    """Gather what this thread records inside the block into a StageTimings."""
+    previous = getattr(_local, "timings", None)
+    timings = _local.timings = StageTimings()
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
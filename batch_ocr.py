@@ -1,43 +1,201 @@
-# Gets the OCR text from the images
+# Batch OCR for backfilling whole series offline: PDFs and/or directories of page images in,
+# one .txt per page out. Progress is kept in a manifest so an interrupted run can be resumed.
+# Outputs keep the inputs' folders below the one they all share (a/scan.pdf -> a/scan/page_0001.txt).
+#
+#   python batch_ocr.py series287.pdf scans/ -o test_data/ocr_output --workers 4
 import os
-import gc
-import torch
+import json
+import time
+import argparse
 from glob import glob
+from collections import Counter
 from multiprocessing import Pool, cpu_count, set_start_method
-from app.utils.ocr_engine import run_ocr_engine
-from app.utils.ocr_engine.ocr_model import load_model
 
-INPUT_DIR = "test_data/pages"
-OUTPUT_DIR = "test_data/ocr_output_2"
-image_paths = sorted(glob(os.path.join(INPUT_DIR, "*.png")))
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+MANIFEST_NAME = "manifest.jsonl"
 
-def process_single_image(image_path):
-    print(f"[INFO] Processing: {image_path}")
 
-    processor, model = load_model()
-    text = run_ocr_engine(image_path, processor, model)
+def collect_tasks(inputs):
+    # One task per page: (key, kind, source path, page number)
+    tasks = []
+    for path in inputs:
+        if os.path.isdir(path):
+            files = sorted(glob(os.path.join(path, "*")))
+        else:
+            files = [path]
+        for file_path in files:
+            lower = file_path.lower()
+            if lower.endswith(".pdf"):
+                import fitz
+                with fitz.open(file_path) as doc:
+                    page_count = doc.page_count
+                for page_number in range(1, page_count + 1):
+                    tasks.append((f"{os.path.abspath(file_path)}#{page_number}", "pdf", file_path, page_number))
+            elif lower.endswith(IMAGE_EXTENSIONS):
+                tasks.append((os.path.abspath(file_path), "image", file_path, None))
+    # a file given both directly and through its directory is done once
+    return list({task[0]: task for task in tasks}.values())
 
-    output_file = os.path.join(OUTPUT_DIR, os.path.basename(image_path).replace(".png", ".txt"))
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write(text)
 
-    # Clean up
-    del processor, model, text
-    gc.collect()
-    torch.cuda.empty_cache()
+def output_path(kind, name, page_number):
+    if kind == "pdf":
+        return os.path.join(name, f"page_{page_number:04d}.txt")
+    return f"{name}.txt"
 
-    return output_file
 
-if __name__ == "__main__":
-    # Important for Windows to avoid hanging
-    set_start_method("spawn", force=True)
+def add_outputs(tasks):
+    """Tasks with their output file, relative to the output directory, appended.
+
+    Outputs keep each input's path below the deepest folder all inputs share,
+    so a/scan.pdf and b/scan.pdf don't write to the same place. Files whose
+    stems still clash (scan.png and scan.tif) keep their extension in the name.
+    """
+    folders = {os.path.dirname(os.path.abspath(task[2])) for task in tasks}
+    try:
+        base = os.path.commonpath(folders) if folders else None
+    except ValueError:
+        base = None  # inputs on different drives; clashes are caught by the caller
+
+    def name(source, keep_extension=False):
+        relative = os.path.relpath(os.path.abspath(source), base) if base else os.path.basename(source)
+        stem, extension = os.path.splitext(relative)
+        return stem + extension.replace(".", "_") if keep_extension else stem
+
+    outputs = [output_path(kind, name(source), page_number) for _, kind, source, page_number in tasks]
+    clashes = Counter(outputs)
+    outputs = [output_path(kind, name(source, keep_extension=True), page_number) if clashes[output] > 1 else output
+               for (_, kind, source, page_number), output in zip(tasks, outputs)]
+    return [task + (output,) for task, output in zip(tasks, outputs)]
+
+
+def output_clashes(tasks):
+    # Source files that would still write to the same output file
+    sources = {}
+    for _, _, source, _, output in tasks:
+        sources.setdefault(output, set()).add(source)
+    return {output: sorted(names) for output, names in sources.items() if len(names) > 1}
+
+
+def read_manifest(manifest_path):
+    # key -> True if the page was done, False if it failed; a later record of a page wins
+    done = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    done[record["key"]] = "error" not in record
+                except (ValueError, KeyError):
+                    continue  # a line cut short by an interrupted run
+    return done
+
+
+# --- worker process side ---
+
+_output_dir = None
+_open_pdfs = {}
+
+
+def init_worker(output_dir, threads_per_worker):
+    global _output_dir
+    import torch
+    from app.utils.ocr_engine.ocr_model import load_model
+
+    _output_dir = output_dir
+    # Split the cores between workers so they don't oversubscribe the CPU
+    torch.set_num_threads(threads_per_worker)
+    load_model()  # once per worker, reused for every page it handles
 
-    # Dont use all avaliable cores, leave 2 for system(OS)
-    usable_cores = cpu_count() - 2
-    print(f"[INFO] Starting batch OCR using {usable_cores} cores...")
 
-    with Pool(usable_cores) as pool:
-        results = pool.map(process_single_image, image_paths)
+def load_page_image(kind, source, page_number):
+    from PIL import Image
 
-    print(f"[INFO] Finished OCR on {len(results)} pages.")
+    if kind == "image":
+        return Image.open(source).convert("RGB")
+    # same per-page resolution as the upload path
+    from app.rasterize import open_pdf, render_page
+    doc = _open_pdfs.get(source)
+    if doc is None:
+        doc = _open_pdfs[source] = open_pdf(source)
+    return render_page(doc, page_number - 1)
+
+
+def process_task(task):
+    from app.utils.ocr_engine import run_ocr_engine
+
+    key, kind, source, page_number, output = task
+    start = time.perf_counter()
+    out_file = os.path.join(_output_dir, output)
+    try:
+        text = run_ocr_engine(load_page_image(kind, source, page_number))
+        os.makedirs(os.path.dirname(out_file), exist_ok=True)
+        with open(out_file, "w", encoding="utf-8") as f:
+            f.write(text)
+    except Exception as e:
+        # one unreadable page is recorded as failed, the run goes on
+        return {"key": key, "output": out_file, "seconds": round(time.perf_counter() - start, 3),
+                "error": f"{type(e).__name__}: {e}"}
+    return {"key": key, "output": out_file, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR PDFs and image directories into text files.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, image files or directories of them")
+    parser.add_argument("-o", "--output-dir", default="test_data/ocr_output")
+    # Dont use all avaliable cores by default, leave 2 for system(OS)
+    parser.add_argument("--workers", type=int, default=max(1, cpu_count() - 2))
+    parser.add_argument("--restart", action="store_true", help="ignore the manifest and redo every page")
+    parser.add_argument("--retry-failed", action="store_true", help="also redo pages that failed in earlier runs")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    if args.restart and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    tasks = add_outputs(collect_tasks(args.inputs))
+    clashes = output_clashes(tasks)
+    if clashes:
+        for output, sources in clashes.items():
+            print(f"[ERROR] {', '.join(sources)} would all be written to {output}")
+        parser.error("rename the inputs or OCR them in separate runs")
+    done = read_manifest(manifest_path)
+    pending = [t for t in tasks if t[0] not in done or (args.retry_failed and not done[t[0]])]
+    print(f"[INFO] {len(tasks)} pages found, {len(tasks) - len(pending)} already done, {len(pending)} to process")
+    failed_before = sum(1 for t in tasks if done.get(t[0]) is False)
+    if failed_before and not args.retry_failed:
+        print(f"[WARN] {failed_before} of those failed in an earlier run; --retry-failed tries them again")
+    if not pending:
+        return
+
+    workers = max(1, min(args.workers, len(pending)))
+    threads_per_worker = max(1, cpu_count() // workers)
+    print(f"[INFO] Starting batch OCR using {workers} workers x {threads_per_worker} threads...")
+
+    start = time.perf_counter()
+    failed = []
+    with Pool(workers, initializer=init_worker, initargs=(args.output_dir, threads_per_worker)) as pool, \
+            open(manifest_path, "a", encoding="utf-8") as manifest:
+        for count, result in enumerate(pool.imap_unordered(process_task, pending), start=1):
+            manifest.write(json.dumps(result) + "\n")
+            manifest.flush()
+            elapsed = time.perf_counter() - start
+            if "error" in result:
+                failed.append(result)
+                print(f"[WARN] {count}/{len(pending)} {result['key']} failed: {result['error']}")
+            else:
+                print(f"[INFO] {count}/{len(pending)} {result['output']} ({count / elapsed:.2f} pages/s)")
+
+    elapsed = time.perf_counter() - start
+    print(f"[INFO] Finished OCR on {len(pending)} pages in {elapsed:.1f}s "
+          f"({len(pending) / elapsed:.2f} pages/s).")
+    if failed:
+        print(f"[WARN] {len(failed)} page(s) failed and were skipped; rerun with --retry-failed to try them again:")
+        for result in sorted(failed, key=lambda r: r["key"]):
+            print(f"  {result['key']}: {result['error']}")
+
+
+if __name__ == "__main__":
+    # Important for Windows to avoid hanging
+    set_start_method("spawn", force=True)
+    main()
@@ -0,0 +1 @@
+# Offline performance benchmarks; see bench_pipeline.py
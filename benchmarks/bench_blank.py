@@ -0,0 +1,72 @@
+"""What the blank filter saves on documents with empty pages, and what it costs.
+
+    python -m benchmarks.bench_blank --pages 12 --blank-pages 3 --show-through-pages 2
+
+A document of synthetic handwritten pages, bare blank pages and pages showing
+only the faint writing of their other side is OCR'd twice, with the blank
+filter off and on (see app.utils.ocr_engine.blank). The report gives the
+time of each run, what the filter skipped, the time its checks took and the
+saving it estimated. Written pages must keep their transcriptions: any that
+was skipped or changed is listed as a miss.
+"""
+import argparse
+import os
+import random
+import time
+
+from benchmarks.synthetic import blank_page, build_tiny_model, handwritten_page
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the blank page and empty line filter.")
+    parser.add_argument("--pages", type=int, default=12, help="pages in the document, written and blank")
+    parser.add_argument("--blank-pages", type=int, default=3, help="pages of bare paper")
+    parser.add_argument("--show-through-pages", type=int, default=2, help="blank pages with the reverse showing")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--model", help="benchmark this checkpoint instead of the tiny random one")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model_path = args.model or build_tiny_model(
+        os.path.join(REPO_ROOT, "instance", "benchmarks", f"tiny-trocr-{args.seed}"), seed=args.seed
+    )
+    # The OCR engine reads its settings at import time
+    os.environ["OCR_MODEL_PATH"] = model_path
+    from app.utils.ocr_engine import run_ocr_engine
+    from app.utils.ocr_engine.blank import skip_counter
+    from app.utils.ocr_engine.ocr_model import registry
+
+    rng = random.Random(args.seed)
+    kinds = (["blank"] * args.blank_pages + ["show_through"] * args.show_through_pages)[:args.pages]
+    kinds += ["written"] * (args.pages - len(kinds))
+    rng.shuffle(kinds)
+    pages = [handwritten_page(rng) if kind == "written" else blank_page(rng, show_through=kind == "show_through")
+             for kind in kinds]
+    registry.warm_up()
+
+    texts, seconds = {}, {}
+    print(f"{'filter':<8}{'seconds':>9}{'pages/s':>9}")
+    for skip_blank in (False, True):
+        start = time.perf_counter()
+        texts[skip_blank] = [run_ocr_engine(page, batch_size=args.batch_size, use_cache=False,
+                                            skip_blank=skip_blank) for page in pages]
+        seconds[skip_blank] = time.perf_counter() - start
+        print(f"{'on' if skip_blank else 'off':<8}{seconds[skip_blank]:>9.2f}{len(pages) / seconds[skip_blank]:>9.2f}")
+
+    stats = skip_counter.stats()
+    misses = [i + 1 for i, kind in enumerate(kinds)
+              if kind == "written" and texts[True][i] != texts[False][i]]
+    measured = seconds[False] - seconds[True]
+    print(f"[INFO] Pages: {kinds.count('written')} written, {len(kinds) - kinds.count('written')} blank; "
+          f"skipped {stats['blank_pages']} pages and {stats['empty_lines']} of {stats['lines_checked']} lines")
+    print(f"[INFO] Checks took {stats['check_seconds']:.3f}s "
+          f"({1000 * stats['check_seconds'] / max(1, stats['pages_checked']):.1f} ms per page)")
+    print(f"[INFO] Saved {measured:.2f}s measured, {stats['saved_seconds']:.2f}s estimated by the filter")
+    if misses:
+        print(f"[WARN] Written pages skipped or changed by the filter: {misses}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""Time every stage of the ingest pipeline on synthetic input, fully offline.
+
+    python -m benchmarks.bench_pipeline --docs 2 --pages 5 -o benchmarks/results/baseline.json
+
+Synthetic handwritten PDFs and a tiny random TrOCR are generated first (see
+synthetic.py), then each stage is timed on its own:
+
+    pdf_to_images_base64    whole document to base64 PNGs (legacy entry point)
+    rasterize               iter_pdf_pages, pages in order from the rasterizer pool
+    preprocess_image        legacy preprocessing
+    auto_slice_lines        legacy line slicing, on the preprocessed page
+    preprocess_and_slice    the fused path run_ocr_engine uses
+    recognition             recognize_lines_batched on those crops (items are lines)
+    run_ocr_engine          the whole per-page OCR call, result cache off
+    sequential_ocr          whole documents rendered and OCR'd one page after another
+    pipelined_ocr           the same through app.pipeline, stages overlapping
+    png_encode, blob_store, filepage_write, page_variants, commit
+                            storing each page as the job worker does, in a scratch SQLite DB
+
+The JSON report holds per-stage totals, per-item means and percentiles, with
+the commit, machine and parameters it was measured with. Compare two reports
+with benchmarks/compare.py. Pass --model to time a real checkpoint instead,
+and --mixed-sizes for documents mixing notebook, A4, folio and ledger pages.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+from benchmarks.synthetic import MIXED_PDF_PAGE_SIZES, build_tiny_model, make_pdf
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCHEMA_VERSION = 1
+
+
+class StageTimer:
+    """Collects wall-clock samples per stage, each covering some number of items."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.items = defaultdict(int)
+
+    @contextmanager
+    def time(self, stage, items=1):
+        start = time.perf_counter()
+        yield
+        self.samples[stage].append(time.perf_counter() - start)
+        self.items[stage] += items
+
+    def add(self, stage, seconds, items=1):
+        self.samples[stage].append(seconds)
+        self.items[stage] += items
+
+    def report(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            total = float(np.sum(samples))
+            items = self.items[stage]
+            stages[stage] = {
+                "calls": len(samples),
+                "items": items,
+                "total_seconds": round(total, 6),
+                "seconds_per_item": round(total / items, 6) if items else None,
+                "items_per_second": round(items / total, 3) if total else None,
+                "call_p50_seconds": round(float(np.percentile(samples, 50)), 6),
+                "call_p95_seconds": round(float(np.percentile(samples, 95)), 6),
+            }
+        return stages
+
+
+def _git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def _machine():
+    import torch
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def _configure_environment(args, model_path, scratch_dir):
+    # The OCR engine reads its settings at import time, so these go in before any app import
+    os.environ["OCR_MODEL_PATH"] = model_path
+    os.environ["OCR_CACHE"] = "false"
+    os.environ["OCR_JOB_QUEUE"] = "false"
+    os.environ["OCR_WARMUP"] = "false"
+    os.environ["OCR_BATCH_SIZE"] = str(args.batch_size)
+    os.environ["OCR_DECODE_LOG"] = ""
+    os.environ["OCR_ONNX_DIR"] = os.path.join(scratch_dir, "onnx")
+    if args.backend:
+        os.environ["OCR_BACKEND"] = args.backend
+    if args.raster_workers is not None:
+        os.environ["PDF_RASTER_WORKERS"] = str(args.raster_workers)
+    if args.zoom:
+        os.environ["PDF_ZOOM"] = str(args.zoom)
+
+
+def bench_ocr(timer, documents, batch_size):
+    from app.main.utils import count_pdf_pages, iter_pdf_pages, pdf_to_images_base64
+    from app.pipeline import ocr_pages
+    from app.utils.ocr_engine import (SEGMENTER, SLICE_MIN_HEIGHT, SLICE_PADDING, auto_slice_lines,
+                                      crop_aspects, preprocess_and_slice, preprocess_image, run_ocr_engine)
+    from app.utils.ocr_engine.ocr_model import load_model, processor_input_size, recognize_lines_batched
+
+    with timer.time("model_load", items=1):
+        processor, model = load_model()
+    input_size = processor_input_size(processor)
+    # one untimed page so lazy initialisation isn't billed to the first sample
+    _, first = next(iter_pdf_pages(documents[0], window=1))
+    run_ocr_engine(first, use_cache=False)
+
+    pages = []
+    for pdf_bytes in documents:
+        start = time.perf_counter()
+        rendered = pdf_to_images_base64(pdf_bytes)
+        timer.add("pdf_to_images_base64", time.perf_counter() - start, items=len(rendered))
+
+        iterator = iter_pdf_pages(pdf_bytes)
+        while True:
+            start = time.perf_counter()
+            item = next(iterator, None)
+            if item is None:
+                break
+            timer.add("rasterize", time.perf_counter() - start)
+            pages.append(item[1])
+
+    line_counts = []
+    for image in pages:
+        with timer.time("preprocess_image"):
+            preprocessed = preprocess_image(image)
+        with timer.time("auto_slice_lines"):
+            auto_slice_lines(preprocessed)
+
+        with timer.time("preprocess_and_slice"):
+            crops, boxes = preprocess_and_slice(image, input_size, SEGMENTER,
+                                                min_height=SLICE_MIN_HEIGHT, padding=SLICE_PADDING)
+        aspects = crop_aspects(crops, boxes, image.width)
+        line_counts.append(len(crops))
+        if crops:
+            with timer.time("recognition", items=len(crops)):
+                recognize_lines_batched(crops, processor, model, batch_size, widths=aspects,
+                                        do_resize=False, aspects=aspects)
+
+        with timer.time("run_ocr_engine"):
+            run_ocr_engine(image, batch_size=batch_size, use_cache=False)
+
+    # whole documents: page after page as before, then with the stages overlapping
+    for pdf_bytes in documents:
+        page_count = count_pdf_pages(pdf_bytes)
+        with timer.time("sequential_ocr", items=page_count):
+            for _, image in iter_pdf_pages(pdf_bytes, window=1):
+                run_ocr_engine(image, batch_size=batch_size, use_cache=False)
+        with timer.time("pipelined_ocr", items=page_count):
+            for _ in ocr_pages(iter_pdf_pages(pdf_bytes, window=1), store_images=False, use_cache=False):
+                pass
+    return pages, line_counts
+
+
+def bench_db(timer, documents, pages, scratch_dir):
+    from config import Config
+    from app import create_app, db
+    from app.blobstore import get_blob_store
+    from app.main.utils import image_to_png_bytes, save_page_variants
+    from app.models import FilePage, UploadedFile
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(scratch_dir, "bench.db")
+        BLOB_STORE_PATH = os.path.join(scratch_dir, "blobs")
+        OCR_JOB_QUEUE = False
+        OCR_WARMUP = False
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        store = get_blob_store()
+        content_hash, size = store.put(documents[0])
+        uploaded = UploadedFile(name="benchmark.pdf", description="synthetic", content_hash=content_hash,
+                                page_count=len(pages), size_bytes=size)
+        db.session.add(uploaded)
+        db.session.commit()
+
+        for number, image in enumerate(pages, start=1):
+            with timer.time("png_encode"):
+                png = image_to_png_bytes(image)
+            with timer.time("blob_store"):
+                image_hash, image_size = store.put(png)
+            with timer.time("filepage_write"):
+                page = FilePage(file_id=uploaded.id, page_number=number, image_hash=image_hash, image_size=image_size,
+                                transcription="synthetic transcription " * 40)
+                db.session.add(page)
+                db.session.flush()
+            with timer.time("page_variants"):
+                save_page_variants(page, image)
+            with timer.time("commit"):
+                db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OCR ingest pipeline on synthetic input.")
+    parser.add_argument("--docs", type=int, default=2, help="synthetic PDFs to generate")
+    parser.add_argument("--pages", type=int, default=4, help="pages per PDF")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=8, help="line crops per generate call")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--model", help="benchmark this checkpoint instead of the tiny random one")
+    parser.add_argument("--backend", help="OCR backend (pytorch, pytorch-int8, onnx)")
+    parser.add_argument("--mixed-sizes", action="store_true", help="cycle page sizes from notebook to ledger")
+    parser.add_argument("--raster-workers", type=int, help="rasterizer processes (default PDF_RASTER_WORKERS)")
+    parser.add_argument("--zoom", type=float, help="render every page at this fixed zoom instead of per page")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("-o", "--output", help="report path (default benchmarks/results/<commit>-<time>.json)")
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.mkdtemp(prefix="ocr-bench-")
+    try:
+        model_path = args.model or build_tiny_model(
+            os.path.join(REPO_ROOT, "instance", "benchmarks", f"tiny-trocr-{args.seed}"), seed=args.seed
+        )
+        _configure_environment(args, model_path, scratch_dir)
+        import torch
+        if args.threads:
+            torch.set_num_threads(args.threads)
+
+        print(f"[INFO] Generating {args.docs} synthetic PDFs x {args.pages} pages...")
+        page_sizes = MIXED_PDF_PAGE_SIZES if args.mixed_sizes else None
+        documents = [make_pdf(args.pages, seed=args.seed + i, page_sizes=page_sizes) for i in range(args.docs)]
+
+        timer = StageTimer()
+        start = time.perf_counter()
+        pages, line_counts = bench_ocr(timer, documents, args.batch_size)
+        bench_db(timer, documents, pages, scratch_dir)
+        wall_seconds = time.perf_counter() - start
+    finally:
+        if not args.keep:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    from app.rasterize import PDF_RASTER_WORKERS
+    stages = timer.report()
+    # what one page costs through the path the job worker takes
+    worker_stages = ["rasterize", "run_ocr_engine", "png_encode", "blob_store", "filepage_write",
+                     "page_variants", "commit"]
+    page_seconds = sum(stages[s]["total_seconds"] for s in worker_stages) / max(1, len(pages))
+    git = _git_revision()
+    report = {
+        "schema_version": SCHEMA_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git,
+        "machine": _machine(),
+        "params": {
+            "docs": args.docs,
+            "pages_per_doc": args.pages,
+            "seed": args.seed,
+            "batch_size": args.batch_size,
+            "model": args.model or "tiny-random",
+            "backend": os.environ.get("OCR_BACKEND", "pytorch"),
+            "mixed_sizes": args.mixed_sizes,
+            "raster_workers": PDF_RASTER_WORKERS,
+            "zoom": args.zoom,
+        },
+        "summary": {
+            "pages": len(pages),
+            "lines": int(sum(line_counts)),
+            "lines_per_page_mean": round(float(np.mean(line_counts)), 2) if line_counts else 0,
+            "page_megapixels_mean": round(float(np.mean([p.width * p.height for p in pages])) / 1e6, 3)
+            if pages else 0,
+            "worker_seconds_per_page": round(page_seconds, 6),
+            "worker_pages_per_second": round(1 / page_seconds, 3) if page_seconds else None,
+            "wall_seconds": round(wall_seconds, 3),
+        },
+        "stages": stages,
+    }
+
+    output = args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results",
+        f"{(git['commit'] or 'nogit')[:10]}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'stage':<22}{'items':>7}{'total s':>10}{'s/item':>10}{'items/s':>10}")
+    for name, stage in stages.items():
+        print(f"{name:<22}{stage['items']:>7}{stage['total_seconds']:>10.3f}"
+              f"{stage['seconds_per_item']:>10.4f}{stage['items_per_second'] or 0:>10.2f}")
+    print(f"[INFO] {len(pages)} pages, {report['summary']['worker_pages_per_second']} pages/s "
+          f"through the worker path. Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Throughput of the remote transcription backend against the local mock API.
+
+    python -m benchmarks.bench_remote --pages 40 --latency 0.5 --concurrency 8 --batch-pages 2
+
+The same synthetic pages go through the remote engine three ways: one page
+per request, one after another (what a plain run_ocr_engine loop gives);
+concurrently; and concurrently with batching. Failures and throttling on the
+mock server show that retries still get every page through.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.mock_remote import start_mock_server
+from benchmarks.synthetic import handwritten_page
+
+
+def run(engine, pages, concurrent):
+    start = time.perf_counter()
+    if concurrent:
+        texts = [f.result() for f in [engine.submit(page) for page in pages]]
+    else:
+        texts = [engine.transcribe(page) for page in pages]
+    return time.perf_counter() - start, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the remote OCR backend on a mock API.")
+    parser.add_argument("--pages", type=int, default=24)
+    parser.add_argument("--latency", type=float, default=0.5, help="mock seconds per request")
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="mock 503 rate")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="mock 429 beyond this many requests")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rps", type=float, default=0, help="client rate limit (0: none)")
+    parser.add_argument("--batch-pages", type=int, default=2)
+    args = parser.parse_args()
+
+    from app.utils.ocr_engine.remote import RemoteEngine
+
+    rng = random.Random(0)
+    pages = [handwritten_page(rng, size=(620, 877)) for _ in range(args.pages)]
+    server = start_mock_server(latency=args.latency, fail_rate=args.fail_rate, max_concurrent=args.max_concurrent)
+    common = dict(url=server.url, api_key="mock", rate=args.rps, backoff=0.2, backoff_max=2)
+    runs = [
+        ("sequential", RemoteEngine(concurrency=1, batch_pages=1, **common), False),
+        ("concurrent", RemoteEngine(concurrency=args.concurrency, batch_pages=1, **common), True),
+        ("concurrent+batched", RemoteEngine(concurrency=args.concurrency, batch_pages=args.batch_pages, **common), True),
+    ]
+    reference = None
+    print(f"{'mode':<20}{'seconds':>9}{'pages/s':>9}{'requests':>10}{'retries':>9}")
+    for name, engine, concurrent in runs:
+        seconds, texts = run(engine, pages, concurrent)
+        reference = reference or texts
+        assert texts == reference, f"{name} returned different transcriptions"
+        stats = engine.stats()
+        print(f"{name:<20}{seconds:>9.2f}{len(pages) / seconds:>9.2f}{stats['requests']:>10}{stats['retries']:>9}")
+        engine.close()
+    print(f"[INFO] Mock server saw {server.counts}, at most {server.peak_concurrent} requests at once")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
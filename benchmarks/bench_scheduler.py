@@ -0,0 +1,91 @@
+"""Several uploads OCR'd at once: one at a time, independent threads, or the shared scheduler.
+
+    python -m benchmarks.bench_scheduler --uploads 4 --large-pages 12 --small-pages 2
+
+One large document and several small ones are OCR'd three ways, as the job
+queue could run them:
+
+    fifo        one document after another (OCR_MAX_CONCURRENT_JOBS=1), large first
+    threads     a thread per document, each running its own generate calls
+    scheduler   a thread per document, line crops batched by the inference scheduler
+
+For each mode the report gives the total time, pages per second, and when the
+last small document finished, which is how long a short upload waits behind a
+long one. Transcriptions must be identical in every mode.
+"""
+import argparse
+import os
+import random
+import threading
+import time
+
+from benchmarks.synthetic import build_tiny_model, handwritten_page
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def ocr_documents(documents, concurrent):
+    from app.utils.ocr_engine import run_ocr_engine
+
+    texts = [None] * len(documents)
+    finished = [None] * len(documents)
+    start = time.perf_counter()
+
+    def work(i):
+        texts[i] = [run_ocr_engine(page, use_cache=False) for page in documents[i]]
+        finished[i] = time.perf_counter() - start
+
+    if concurrent:
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(len(documents))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        for i in range(len(documents)):
+            work(i)
+    return time.perf_counter() - start, finished, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent uploads with and without the inference scheduler.")
+    parser.add_argument("--uploads", type=int, default=4, help="documents in flight, the first one large")
+    parser.add_argument("--large-pages", type=int, default=12)
+    parser.add_argument("--small-pages", type=int, default=2)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--model", help="benchmark this checkpoint instead of the tiny random one")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model_path = args.model or build_tiny_model(
+        os.path.join(REPO_ROOT, "instance", "benchmarks", f"tiny-trocr-{args.seed}"), seed=args.seed
+    )
+    # The OCR engine reads its settings at import time
+    os.environ["OCR_MODEL_PATH"] = model_path
+    os.environ["OCR_BATCH_SIZE"] = "1"
+    from app.utils.ocr_engine import scheduler
+    from app.utils.ocr_engine.ocr_model import registry
+
+    rng = random.Random(args.seed)
+    sizes = [args.large_pages] + [args.small_pages] * (args.uploads - 1)
+    documents = [[handwritten_page(rng, size=(620, 877)) for _ in range(n)] for n in sizes]
+    pages = sum(sizes)
+    registry.warm_up()
+
+    reference = None
+    print(f"{'mode':<12}{'seconds':>9}{'pages/s':>9}{'small done':>12}{'large done':>12}")
+    for mode in ("fifo", "threads", "scheduler"):
+        if mode == "scheduler":
+            # from here on run_ocr_engine goes through the scheduler
+            scheduler.start_scheduler(args.max_batch, args.max_wait_ms / 1000)
+        seconds, finished, texts = ocr_documents(documents, concurrent=mode != "fifo")
+        reference = reference or texts
+        assert texts == reference, f"{mode} returned different transcriptions"
+        small_done = max(finished[1:]) if len(finished) > 1 else 0.0
+        print(f"{mode:<12}{seconds:>9.2f}{pages / seconds:>9.2f}{small_done:>12.2f}{finished[0]:>12.2f}")
+    print(f"[INFO] Scheduler: {scheduler.get_scheduler().stats()}")
+
+
+if __name__ == "__main__":
+    main()
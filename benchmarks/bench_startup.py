@@ -0,0 +1,120 @@
+"""How long the web app takes to come up, and which imports that time goes to.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --eager --top 30
+    python -m benchmarks.bench_startup --warmup
+
+A fresh interpreter imports the app, calls create_app and serves the file list
+once, under python -X importtime. The report gives the wall time to each of
+those points, the import time per top-level package (its modules' own time,
+so nothing is counted twice) and the slowest modules with everything they
+imported. --eager also imports the OCR stack at startup, which is what every
+start cost before it was made lazy; --warmup waits for /engine_ready as well,
+with the background preload on.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+marks = {}
+if EAGER:
+    import app.utils.ocr_engine.engine, app.rasterize
+from config import Config
+from app import create_app
+marks["import_app"] = time.perf_counter() - start
+
+class StartupConfig(Config):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    OCR_JOB_QUEUE = False
+    OCR_WARMUP = PRELOAD
+
+app = create_app(StartupConfig)
+marks["create_app"] = time.perf_counter() - start
+with app.app_context():
+    from app import db
+    db.create_all()
+client = app.test_client()
+client.get("/")
+marks["first_response"] = time.perf_counter() - start
+if PRELOAD:
+    while True:
+        ready = client.get("/engine_ready").json
+        if ready["ready"] or ready["preload"]["state"] == "failed":
+            break
+        time.sleep(0.2)
+    marks["engine_ready"] = time.perf_counter() - start
+marks["heavy_modules"] = [m for m in ("torch", "transformers", "cv2", "fitz", "numpy") if m in sys.modules]
+print("STARTUP " + json.dumps(marks))
+"""
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(stderr):
+    # (module, self microseconds, cumulative microseconds, depth) per imported module
+    modules = []
+    for line in stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            modules.append((name, int(own), int(cumulative), len(indent) // 2))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app startup time and import cost per module.")
+    parser.add_argument("--eager", action="store_true", help="import the OCR stack up front, as before")
+    parser.add_argument("--warmup", action="store_true", help="also wait for the background model preload")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    code = f"EAGER, PRELOAD = {args.eager}, {args.warmup}\n" + _CHILD
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=REPO_ROOT,
+                            capture_output=True, text=True)
+    marks = next((json.loads(line[len("STARTUP "):]) for line in result.stdout.splitlines()
+                  if line.startswith("STARTUP ")), None)
+    if marks is None:
+        sys.exit(f"[ERROR] The app didn't start:\n{result.stderr[-3000:]}")
+
+    modules = parse_importtime(result.stderr)
+    packages = defaultdict(int)
+    for name, own, _, _ in modules:
+        packages[name.split(".")[0]] += own
+    total = sum(packages.values())
+    slowest = sorted(modules, key=lambda m: m[2], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            "marks": marks,
+            "import_seconds": round(total / 1e6, 3),
+            "packages": {name: round(us / 1e6, 4) for name, us in sorted(packages.items(), key=lambda p: -p[1])},
+            "slowest": [{"module": name, "self": own / 1e6, "cumulative": cumulative / 1e6}
+                        for name, own, cumulative, _ in slowest],
+        }, indent=2))
+        return
+
+    for mark in ("import_app", "create_app", "first_response", "engine_ready"):
+        if mark in marks:
+            print(f"{mark:<16}{marks[mark]:>8.2f}s")
+    print(f"[INFO] Heavy modules imported: {', '.join(marks['heavy_modules']) or 'none'}")
+    print(f"\n{'package':<28}{'seconds':>9}{'share':>8}")
+    for name, us in sorted(packages.items(), key=lambda p: -p[1])[:args.top]:
+        print(f"{name:<28}{us / 1e6:>9.3f}{us / max(1, total):>8.1%}")
+    print(f"{'all imports':<28}{total / 1e6:>9.3f}")
+    print(f"\n{'module (with its imports)':<56}{'cumulative':>11}{'self':>9}")
+    for name, own, cumulative, depth in slowest:
+        print(f"{('  ' * depth + name)[:55]:<56}{cumulative / 1e6:>11.3f}{own / 1e6:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
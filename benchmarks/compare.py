@@ -0,0 +1,67 @@
+"""Compare two benchmark reports and flag stages that got slower.
+
+    python -m benchmarks.compare benchmarks/results/baseline.json benchmarks/results/new.json --threshold 0.15
+
+Stages are compared on seconds per item. The exit status is 1 when any stage
+regressed by more than the threshold, so this can gate CI. Reports measured
+with different parameters or on different machines are still compared, with
+a warning, since the numbers only mean much like for like.
+"""
+import argparse
+import json
+import sys
+
+
+def load_report(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline, candidate, threshold):
+    rows = []
+    for stage, base in baseline["stages"].items():
+        new = candidate["stages"].get(stage)
+        if new is None or not base["seconds_per_item"] or new["seconds_per_item"] is None:
+            continue
+        ratio = new["seconds_per_item"] / base["seconds_per_item"]
+        rows.append({
+            "stage": stage,
+            "baseline": base["seconds_per_item"],
+            "candidate": new["seconds_per_item"],
+            "ratio": ratio,
+            "regressed": ratio > 1 + threshold,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two OCR pipeline benchmark reports.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed slowdown per stage, as a fraction (default 0.10)")
+    args = parser.parse_args()
+
+    baseline, candidate = load_report(args.baseline), load_report(args.candidate)
+    if baseline["params"] != candidate["params"]:
+        print(f"[WARN] Parameters differ: {baseline['params']} vs {candidate['params']}")
+    if baseline["machine"]["platform"] != candidate["machine"]["platform"] \
+            or baseline["machine"]["cpu_count"] != candidate["machine"]["cpu_count"]:
+        print("[WARN] Reports come from different machines")
+
+    rows = compare(baseline, candidate, args.threshold)
+    print(f"{'stage':<22}{'baseline s':>12}{'candidate s':>13}{'change':>9}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else ""
+        print(f"{row['stage']:<22}{row['baseline']:>12.4f}{row['candidate']:>13.4f}"
+              f"{row['ratio'] - 1:>+9.1%}{flag}")
+
+    regressed = [row["stage"] for row in rows if row["regressed"]]
+    if regressed:
+        print(f"[INFO] {len(regressed)} stage(s) slower than {args.threshold:.0%}: {', '.join(regressed)}")
+        sys.exit(1)
+    print("[INFO] No stage regressed.")
+
+
+if __name__ == "__main__":
+    main()
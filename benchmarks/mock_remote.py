@@ -0,0 +1,131 @@
+"""A local stand-in for the Gemini generateContent API, for offline runs and benchmarks.
+
+    python -m benchmarks.mock_remote --port 8765 --latency 0.8 --fail-rate 0.1
+    USE_GEMINI=true OCR_REMOTE_URL=http://127.0.0.1:8765/v1beta python run.py
+
+Each request sleeps for --latency seconds (plus jitter) like a remote model
+would, then answers with a made-up transcription per image that depends only
+on the image bytes, so results are repeatable. A --fail-rate fraction of
+requests fail with 503, and requests beyond --max-concurrent at once get 429
+with Retry-After, which exercises the client's retries and backoff. Several
+images in one request get a JSON array back when the request asks for JSON.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PATH = re.compile(r"/models/([^/:]+):generateContent$")
+
+
+def mock_transcription(image_b64):
+    digest = hashlib.sha256(base64.b64decode(image_b64)).hexdigest()
+    return f"mock line one {digest[:8]}\nmock line two {digest[8:16]}"
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.5, jitter=0.1, fail_rate=0.0, max_concurrent=0, seed=0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.max_concurrent = max_concurrent
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak_concurrent = 0
+        self.counts = {"requests": 0, "images": 0, "failed": 0, "throttled": 0}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not _PATH.search(self.path):
+            self._reply(404, {"error": {"code": 404, "message": "Unknown method"}})
+            return
+        with server.lock:
+            server.counts["requests"] += 1
+            if server.max_concurrent and server.active >= server.max_concurrent:
+                server.counts["throttled"] += 1
+                throttled = True
+            else:
+                throttled = False
+                server.active += 1
+                server.peak_concurrent = max(server.peak_concurrent, server.active)
+            fail = server.rng.random() < server.fail_rate
+            delay = max(0.0, server.latency + server.rng.uniform(-server.jitter, server.jitter))
+        if throttled:
+            self._reply(429, {"error": {"code": 429, "message": "Resource exhausted"}}, {"Retry-After": "1"})
+            return
+        try:
+            time.sleep(delay)
+            if fail:
+                with server.lock:
+                    server.counts["failed"] += 1
+                self._reply(503, {"error": {"code": 503, "message": "The model is overloaded"}})
+                return
+            parts = body["contents"][0]["parts"]
+            images = [p["inline_data"]["data"] for p in parts if "inline_data" in p]
+            with server.lock:
+                server.counts["images"] += len(images)
+            texts = [mock_transcription(image) for image in images]
+            wants_json = body.get("generationConfig", {}).get("responseMimeType") == "application/json"
+            text = json.dumps(texts) if wants_json else "\n\n".join(texts)
+            self._reply(200, {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]})
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+def start_mock_server(port=0, **options):
+    """Serve in a background thread; returns the server (server.url, server.shutdown())."""
+    server = MockServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, name="mock-remote", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Gemini generateContent endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="answer 429 beyond this many (0: no limit)")
+    args = parser.parse_args()
+    server = MockServer(("127.0.0.1", args.port), latency=args.latency, jitter=args.jitter,
+                        fail_rate=args.fail_rate, max_concurrent=args.max_concurrent)
+    print(f"[INFO] Mock generateContent API at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
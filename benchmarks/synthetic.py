@@ -0,0 +1,154 @@
+"""Offline benchmark inputs: scanned-looking handwritten PDFs and a tiny TrOCR.
+
+Nothing here touches the network. Pages are drawn as cursive-like pen
+strokes on slightly uneven paper and embedded in the PDF as JPEG images, the
+way archive scans arrive. The model has the real TrOCR architecture and input
+size but a single small layer and random weights, so it exercises every code
+path at a fraction of the cost; its transcriptions are noise.
+"""
+import io
+import math
+import os
+import random
+
+import fitz
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# A4 at 150 dpi
+PAGE_SIZE = (1240, 1754)
+PDF_PAGE_SIZE = (595, 842)
+SCAN_DPI = 150
+# pocket notebook, A4, foolscap folio and a large ledger, in points, for --mixed-sizes
+MIXED_PDF_PAGE_SIZES = [(298, 420), (595, 842), (612, 936), (1190, 1684)]
+
+
+def _draw_word(draw, rng, x, baseline, x_height, slant, pen):
+    # One word: a connected run of loops and strokes, with the odd ascender or descender
+    points = []
+    for _ in range(rng.randint(2, 9)):
+        width = x_height * rng.uniform(0.5, 0.9)
+        height = x_height * rng.choice([1.0, 1.0, 1.0, 1.8, -0.8])
+        for step in range(8):
+            t = step / 8
+            y = baseline - height * math.sin(math.pi * t) ** 2
+            points.append((x + width * t + slant * (baseline - y), y))
+        x += width
+    draw.line(points, fill=pen, width=max(2, int(x_height / 8)), joint="curve")
+    return x
+
+
+def handwritten_page(rng, lines=None, size=PAGE_SIZE):
+    """A grayscale-looking RGB page of handwriting-like lines."""
+    width, height = size
+    paper = np.full((height, width), rng.randint(225, 245), dtype=np.int16)
+    paper += np.random.default_rng(rng.randint(0, 2**32 - 1)).integers(-12, 12, size=paper.shape, dtype=np.int16)
+    img = Image.fromarray(paper.clip(0, 255).astype(np.uint8)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+
+    lines = lines if lines is not None else rng.randint(14, 24)
+    margin = int(width * 0.08)
+    spacing = (height - 2 * margin) / max(1, lines)
+    for i in range(lines):
+        baseline = margin + spacing * (i + 0.7) + rng.uniform(-spacing * 0.1, spacing * 0.1)
+        x_height = spacing * rng.uniform(0.22, 0.32)
+        slant = rng.uniform(0.1, 0.4)
+        pen = (rng.randint(10, 60),) * 3
+        x = margin + rng.uniform(0, width * 0.05)
+        # mostly full lines, some short ones like headings or marginal notes
+        end = width - margin if rng.random() > 0.2 else margin + width * rng.uniform(0.15, 0.4)
+        while x < end - x_height * 4:
+            x = _draw_word(draw, rng, x, baseline, x_height, slant, pen) + x_height * rng.uniform(0.8, 1.5)
+    return img.filter(ImageFilter.GaussianBlur(0.6))
+
+
+def blank_page(rng, size=PAGE_SIZE, show_through=False):
+    """An empty page: bare paper, or with show_through the faint mirrored writing of its other side."""
+    if not show_through:
+        return handwritten_page(rng, lines=0, size=size)
+    back = np.asarray(handwritten_page(rng, size=size), dtype=np.float32)[:, ::-1]
+    paper = float(np.median(back))
+    # the reverse's ink comes through at a fifth of its contrast
+    return Image.fromarray((paper - (paper - back) * 0.2).clip(0, 255).astype(np.uint8))
+
+
+def make_pdf(pages, seed=0, jpeg_quality=80, page_sizes=None):
+    """PDF bytes with one scanned-looking handwritten page image per page.
+
+    page_sizes, a list of (width, height) in points, is cycled through to make
+    a document of mixed page sizes; each is scanned at SCAN_DPI.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for i in range(pages):
+        pdf_size = page_sizes[i % len(page_sizes)] if page_sizes else PDF_PAGE_SIZE
+        size = tuple(round(points * SCAN_DPI / 72) for points in pdf_size)
+        buffer = io.BytesIO()
+        handwritten_page(rng, size=size).save(buffer, format="JPEG", quality=jpeg_quality)
+        page = doc.new_page(width=pdf_size[0], height=pdf_size[1])
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def _train_tokenizer(vocab_size):
+    # Byte-level BPE trained on random letters, so no tokenizer files need downloading
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import PreTrainedTokenizerFast
+
+    rng = random.Random(0)
+    corpus = [
+        " ".join("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9)))
+                 for _ in range(12))
+        for _ in range(500)
+    ]
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(corpus, vocab_size=vocab_size,
+                            special_tokens=["<s>", "<pad>", "</s>", "<unk>", "<mask>"])
+    return PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, bos_token="<s>", pad_token="<pad>",
+                                   eos_token="</s>", unk_token="<unk>", mask_token="<mask>")
+
+
+def build_tiny_model(out_dir, image_size=384, hidden_size=32, layers=1, vocab_size=300, seed=0):
+    """Save a randomly initialised TrOCR (ViT encoder, TrOCR decoder) with its processor to out_dir.
+
+    Reuses out_dir if a model was already saved there. Returns out_dir.
+    """
+    if os.path.exists(os.path.join(out_dir, "config.json")):
+        return out_dir
+    import torch
+    from transformers import (TrOCRConfig, TrOCRProcessor, ViTConfig, ViTImageProcessor,
+                              VisionEncoderDecoderConfig, VisionEncoderDecoderModel)
+
+    tokenizer = _train_tokenizer(vocab_size)
+    image_processor = ViTImageProcessor(size={"height": image_size, "width": image_size},
+                                        image_mean=[0.5] * 3, image_std=[0.5] * 3)
+    processor = TrOCRProcessor(image_processor=image_processor, tokenizer=tokenizer)
+
+    encoder = ViTConfig(image_size=image_size, patch_size=16, hidden_size=hidden_size,
+                        num_hidden_layers=layers, num_attention_heads=2, intermediate_size=hidden_size * 2)
+    decoder = TrOCRConfig(vocab_size=len(tokenizer), d_model=hidden_size, decoder_layers=layers,
+                          decoder_attention_heads=2, decoder_ffn_dim=hidden_size * 2,
+                          bos_token_id=tokenizer.bos_token_id, pad_token_id=tokenizer.pad_token_id,
+                          eos_token_id=tokenizer.eos_token_id, decoder_start_token_id=tokenizer.eos_token_id)
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(encoder, decoder)
+    config.decoder_start_token_id = tokenizer.eos_token_id
+    config.pad_token_id = tokenizer.pad_token_id
+    config.eos_token_id = tokenizer.eos_token_id
+
+    torch.manual_seed(seed)
+    model = VisionEncoderDecoderModel(config=config)
+    # wide random weights so decoding produces varied lines rather than stopping at once
+    with torch.no_grad():
+        for param in model.parameters():
+            if param.dim() > 1:
+                param.normal_(0.0, 0.3)
+    model.generation_config.decoder_start_token_id = config.decoder_start_token_id
+    model.generation_config.pad_token_id = config.pad_token_id
+    model.generation_config.eos_token_id = config.eos_token_id
+
+    os.makedirs(out_dir, exist_ok=True)
+    model.save_pretrained(out_dir)
+    processor.save_pretrained(out_dir)
+    return out_dir
@@ -0,0 +1,143 @@
+# Accuracy vs speed of the recognizer backends on the same line crops.
+# Pages are sliced once; every backend then transcribes exactly the same crops and is
+# scored against the reference backend (pytorch by default) with exact-match rate and CER.
+#
+#   python compare_backends.py scans/page1.png series287.pdf --backends pytorch pytorch-int8 onnx
+import os
+import json
+import time
+import argparse
+import torch
+from PIL import Image
+
+from app.utils.ocr_engine import SEGMENTER, SLICE_MIN_HEIGHT, SLICE_PADDING
+from app.utils.ocr_engine.backends import BACKENDS
+from app.utils.ocr_engine.decoding import DECODE_PROFILE, DECODE_PROFILES
+from app.utils.ocr_engine.ocr_model import (
+    MODEL_PATH, load_model, processor_input_size, recognize_lines_batched,
+)
+from app.utils.ocr_engine.slicer import crop_aspects, preprocess_and_slice
+
+
+
+def load_pages(inputs):
+    pages = []
+    for path in inputs:
+        if path.lower().endswith(".pdf"):
+            # same per-page resolution as the upload path
+            from app.rasterize import open_pdf, render_page
+            with open_pdf(path) as doc:
+                pages.extend(render_page(doc, i) for i in range(doc.page_count))
+        else:
+            pages.append(Image.open(path).convert("RGB"))
+    return pages
+
+
+def slice_pages(pages, input_size):
+    crops, aspects = [], []
+    for page in pages:
+        page_crops, boxes = preprocess_and_slice(
+            page, input_size, SEGMENTER, min_height=SLICE_MIN_HEIGHT, padding=SLICE_PADDING
+        )
+        crops.extend(page_crops)
+        aspects.extend(crop_aspects(page_crops, boxes, page.width))
+    return crops, aspects
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def score(texts, reference):
+    errors = sum(edit_distance(t, r) for t, r in zip(texts, reference))
+    chars = sum(len(r) for r in reference)
+    return {
+        "exact_match": sum(t == r for t, r in zip(texts, reference)) / max(1, len(reference)),
+        "cer": errors / max(1, chars),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OCR backends on the same line crops.")
+    parser.add_argument("inputs", nargs="+", help="page images or PDFs")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--reference", default="pytorch", choices=list(BACKENDS),
+                        help="backend whose output counts as correct")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--profile", default=DECODE_PROFILE, choices=list(DECODE_PROFILES), help="decoding profile")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per backend, best one is kept")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    backends = list(dict.fromkeys([args.reference] + args.backends))
+
+    pages = load_pages(args.inputs)
+    start = time.perf_counter()
+    processor, _ = load_model(args.model, backend=args.reference)
+    load_times = {args.reference: time.perf_counter() - start}
+    crops, aspects = slice_pages(pages, processor_input_size(processor))
+    print(f"[INFO] {len(pages)} pages, {len(crops)} line crops")
+    if not crops:
+        return
+
+    results, transcripts = [], {}
+    for backend in backends:
+        start = time.perf_counter()
+        processor, model = load_model(args.model, backend=backend)
+        load_times.setdefault(backend, time.perf_counter() - start)
+        # one untimed pass so lazy init and allocator warm-up don't count
+        recognize_lines_batched(crops[:1], processor, model, 1, widths=aspects[:1], do_resize=False,
+                                aspects=aspects[:1], profile=args.profile)
+
+        best = None
+        for _ in range(max(1, args.repeat)):
+            start = time.perf_counter()
+            texts = recognize_lines_batched(crops, processor, model, args.batch_size, widths=aspects,
+                                            do_resize=False, aspects=aspects, profile=args.profile)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        transcripts[backend] = texts
+        results.append({
+            "backend": backend,
+            "load_seconds": round(load_times[backend], 3),
+            "seconds": round(best, 3),
+            "lines_per_second": round(len(crops) / best, 2),
+        })
+
+    reference = transcripts[args.reference]
+    for result in results:
+        result.update(score(transcripts[result["backend"]], reference))
+        result["speedup"] = round(results[0]["seconds"] / result["seconds"], 2)
+
+    print(f"{'backend':<14}{'load s':>8}{'run s':>9}{'lines/s':>9}{'speedup':>9}{'exact':>8}{'CER':>8}")
+    for r in results:
+        print(f"{r['backend']:<14}{r['load_seconds']:>8.2f}{r['seconds']:>9.2f}{r['lines_per_second']:>9.2f}"
+              f"{r['speedup']:>8.2f}x{r['exact_match']:>8.1%}{r['cer']:>8.2%}")
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": args.model,
+                "reference": args.reference,
+                "pages": len(pages),
+                "lines": len(crops),
+                "batch_size": args.batch_size,
+                "profile": args.profile,
+                "results": results,
+                "transcripts": transcripts,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
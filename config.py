@@ -5,8 +5,54 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'app','static','uploads')
     # Allowed file extensions for PDF uploads
     ALLOWED_EXTENSIONS = {'pdf'}
+    # Document cards shown per page of the file list
+    FILES_PER_PAGE = int(os.environ.get('FILES_PER_PAGE', '24'))
+    # Page-level transcription hits shown per page of search results
+    SEARCH_RESULTS_PER_PAGE = int(os.environ.get('SEARCH_RESULTS_PER_PAGE', '20'))
 
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
     INSTANCE_DIR = os.path.join(BASE_DIR, 'instance')
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(INSTANCE_DIR, 'app.db')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False  # Disable event notifications
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False  # Disable event notifications
+    # PDFs and page images are files named by their SHA-256 here; the database keeps only hashes
+    BLOB_STORE_PATH = os.environ.get('BLOB_STORE_PATH') or os.path.join(INSTANCE_DIR, 'blobs')
+
+    # Load and warm the OCR model in the background when the app starts instead of on the
+    # first upload; /engine_ready reports when it's done
+    OCR_WARMUP = os.environ.get('OCR_WARMUP', 'false').lower() == 'true'
+
+    # Background OCR queue: uploads return straight away and the OCR happens in the background
+    OCR_JOB_QUEUE = os.environ.get('OCR_JOB_QUEUE', 'true').lower() == 'true'
+    # Concurrent jobs run as threads of this process that share one model, with line crops from
+    # every upload batched together by the inference scheduler; false gives each job its own
+    # worker process and model
+    OCR_SHARED_MODEL = os.environ.get('OCR_SHARED_MODEL', 'true').lower() == 'true'
+    OCR_MAX_CONCURRENT_JOBS = int(os.environ.get('OCR_MAX_CONCURRENT_JOBS', '4' if OCR_SHARED_MODEL else '1'))
+    OCR_JOB_MAX_ATTEMPTS = int(os.environ.get('OCR_JOB_MAX_ATTEMPTS', '3'))
+    # A failed job is tried again after this many seconds, doubled for each attempt it has had
+    OCR_JOB_RETRY_SECONDS = float(os.environ.get('OCR_JOB_RETRY_SECONDS', '30'))
+    OCR_JOB_POLL_SECONDS = float(os.environ.get('OCR_JOB_POLL_SECONDS', '5'))
+    # Pages written per database commit during a job, or at most this many seconds apart
+    OCR_COMMIT_PAGES = int(os.environ.get('OCR_COMMIT_PAGES', '8'))
+    OCR_COMMIT_SECONDS = float(os.environ.get('OCR_COMMIT_SECONDS', '2'))
+    # Progress events: how often the stream checks the job row, and how long one stream stays open
+    # before the browser reconnects. Each open stream holds a server thread
+    PROGRESS_EVENT_INTERVAL = float(os.environ.get('PROGRESS_EVENT_INTERVAL', '0.5'))
+    PROGRESS_STREAM_SECONDS = int(os.environ.get('PROGRESS_STREAM_SECONDS', '15'))
+    # Progress streams open at once; viewers past this poll /file_processing_status instead.
+    # Keep it well below WAITRESS_THREADS so streams can't take every thread
+    PROGRESS_MAX_STREAMS = int(os.environ.get('PROGRESS_MAX_STREAMS', '4'))
+    # Request threads of the waitress server (run_app.py); waitress itself defaults to 4
+    WAITRESS_THREADS = int(os.environ.get('WAITRESS_THREADS', '16'))
+
+    # Cached page images: variant name -> max width in pixels, encoded as WEBP or JPEG
+    IMAGE_VARIANT_WIDTHS = {'thumb': 300, 'screen': 1200}
+    IMAGE_VARIANT_FORMAT = os.environ.get('IMAGE_VARIANT_FORMAT', 'WEBP').upper()
+    IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', str(7 * 24 * 3600)))
+
+
+class CliConfig(Config):
+    # Command-line tools (reocr.py, export.py) queue jobs for the server and read the
+    # database; they don't start a dispatcher or preload a model in their own process
+    OCR_JOB_QUEUE = False
+    OCR_WARMUP = False
@@ -0,0 +1,26 @@
+# Summarize a decode log (OCR_DECODE_LOG=instance/decode_log.jsonl) to tune the token budget:
+# token count percentiles, decode time per line, how often lines hit their budget or were
+# stopped on repetition, and a suggested OCR_TOKENS_PER_ASPECT for this corpus.
+#
+#   python decode_report.py instance/decode_log.jsonl --profile fast
+import json
+import argparse
+
+from app.utils.ocr_engine.decoding import summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize per-line OCR decode records.")
+    parser.add_argument("log", help="JSONL file written via OCR_DECODE_LOG")
+    parser.add_argument("--profile", help="only count lines decoded with this profile")
+    args = parser.parse_args()
+
+    with open(args.log, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if args.profile:
+        records = [r for r in records if r["profile"] == args.profile]
+    print(json.dumps(summarize(records), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,9 @@ set -e
 
 echo "Entrypoint: Initializing database using 'flask shell' with a here-document..."
 
-flask shell <<HEREDOC_END
-from app import db  # Assumes 'db' is your SQLAlchemy instance accessible from the 'app' package
-db.create_all()
-print("Python (flask shell): db.create_all() executed via here-document.")
+OCR_JOB_QUEUE=false flask shell <<HEREDOC_END
+# create_app (run by flask shell) already brought the schema up to date
+print("Python (flask shell): upgrade_schema() executed by create_app.")
 exit()
 HEREDOC_END
 
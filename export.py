@@ -0,0 +1,52 @@
+# Export transcriptions (and page images) of files or of a search, for downstream catalogues.
+# Pages are streamed from the database to the output one at a time, so whole series export
+# in constant memory.
+#
+#   python export.py 12 13 --format txt -o series287.txt
+#   python export.py --all --format jsonl -o all_pages.jsonl
+#   python export.py --search '"land grant"' --format zip -o land_grants.zip
+import sys
+import time
+import argparse
+
+from config import CliConfig
+from app import create_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export transcriptions as text, JSONL or a ZIP with page images.")
+    parser.add_argument("file_ids", nargs="*", type=int, help="files to export")
+    parser.add_argument("--all", action="store_true", help="every file in the database")
+    parser.add_argument("--search", help="export the pages matching this search instead")
+    parser.add_argument("--format", choices=["txt", "jsonl", "zip"], default="txt")
+    parser.add_argument("-o", "--output", help="output file (default stdout)")
+    args = parser.parse_args()
+    if not args.file_ids and not args.all and not args.search:
+        parser.error("give file ids, --all or --search")
+
+    from app.export import export, file_pages, search_result_pages
+
+    app = create_app(CliConfig)
+    with app.app_context():
+        if args.search:
+            rows = search_result_pages(args.search)
+        else:
+            rows = file_pages(args.file_ids or None)
+
+        start = time.perf_counter()
+        written = 0
+        out = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for chunk in export(rows, args.format):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if args.output:
+                out.close()
+        if args.output:
+            print(f"[INFO] Wrote {written / 1e6:.1f} MB to {args.output} "
+                  f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Re-OCR pages of files already in the database, from their stored page images.
+# Pages are chosen by range, by being stale (OCRed by another engine version or other
+# parameters than the current ones), by being flagged by reviewers and/or by having been
+# skipped (wholly or in part) by the blank filter. Jobs go to the
+# app's background queue, so a running server picks them up; --inline runs them here.
+#
+#   python reocr.py --all --stale --list
+#   python reocr.py 12 --pages 1-20 --flagged
+#   python reocr.py --all --stale --inline
+import time
+import argparse
+
+from config import CliConfig
+from app import create_app, db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue OCR again for stale, flagged or chosen pages.")
+    parser.add_argument("file_ids", nargs="*", type=int, help="files to re-OCR")
+    parser.add_argument("--all", action="store_true", help="every file in the database")
+    parser.add_argument("--pages", help='page range such as "1-5,8" (default all pages)')
+    parser.add_argument("--stale", action="store_true", help="only pages made by another engine version/params")
+    parser.add_argument("--flagged", action="store_true", help="only pages flagged by reviewers")
+    parser.add_argument("--skipped", action="store_true", help="only pages the blank filter skipped, or some lines of")
+    parser.add_argument("--list", action="store_true", help="show the pages that would be redone and stop")
+    parser.add_argument("--inline", action="store_true", help="run the jobs in this process instead of the server")
+    parser.add_argument("--wait", action="store_true", help="wait until the queued jobs have finished")
+    args = parser.parse_args()
+    if not args.file_ids and not args.all:
+        parser.error("give file ids or --all")
+
+    from app.jobs import enqueue_reocr
+    from app.models import OcrJob, UploadedFile
+    from app.reocr import last_page, page_spans, parse_page_range, select_pages
+
+    if args.pages:
+        try:
+            page_spans(args.pages)
+        except ValueError as e:
+            parser.error(str(e))
+
+    app = create_app(CliConfig)
+    with app.app_context():
+        file_ids = args.file_ids or [f.id for f in UploadedFile.query.order_by(UploadedFile.id)]
+
+        job_ids = []
+        for file_id in file_ids:
+            uploaded_file = db.session.get(UploadedFile, file_id)
+            if uploaded_file is None:
+                print(f"[WARN] File {file_id} not found")
+                continue
+            try:
+                pages = parse_page_range(args.pages, last_page(uploaded_file)) if args.pages else None
+            except ValueError as e:
+                print(f"[WARN] File {file_id}: {e}")
+                continue
+            page_numbers = select_pages(file_id, pages, stale=args.stale, flagged=args.flagged,
+                                        skipped=args.skipped)
+            if not page_numbers:
+                continue
+            print(f"[INFO] File {file_id}: {len(page_numbers)} page(s) {page_numbers}")
+            if args.list:
+                continue
+            active = OcrJob.query.filter(OcrJob.file_id == file_id,
+                                         OcrJob.status.in_(("pending", "running"))).first()
+            if active is not None:
+                print(f"[WARN] File {file_id} already has job {active.id} in progress, skipped")
+                continue
+            job_ids.append(enqueue_reocr(file_id, page_numbers).id)
+
+        if args.list:
+            return
+        if not job_ids:
+            print("[INFO] Nothing to re-OCR.")
+            return
+        print(f"[INFO] Queued {len(job_ids)} re-OCR job(s): {job_ids}")
+
+        if args.inline:
+            from app.jobs import _worker_init, config_path, run_job
+            _worker_init(1, config=config_path(CliConfig))
+            for job_id in job_ids:
+                # claimed the way the dispatcher does, so a running server leaves it alone
+                claimed = OcrJob.query.filter_by(id=job_id, status="pending").update(
+                    {"status": "running", "attempts": OcrJob.attempts + 1}
+                )
+                db.session.commit()
+                if claimed:
+                    run_job(job_id)
+
+        while args.wait or args.inline:
+            db.session.expire_all()
+            jobs = OcrJob.query.filter(OcrJob.id.in_(job_ids)).all()
+            if all(job.status in ("done", "failed") for job in jobs):
+                for job in jobs:
+                    print(f"[INFO] Job {job.id} (file {job.file_id}): {job.status} "
+                          f"{job.processed_pages}/{job.total_pages}{' ' + job.error if job.error else ''}")
+                break
+            time.sleep(Config.PROGRESS_EVENT_INTERVAL * 4)
+
+
+if __name__ == "__main__":
+    main()
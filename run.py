@@ -3,4 +3,6 @@ from app import create_app
 app = create_app()
 
 if __name__ == '__main__':
+    # Development server, a thread per request. run_app.py serves with waitress,
+    # WAITRESS_THREADS threads wide
     app.run(debug=True)
@@ -1,12 +1,12 @@
 import os
 from waitress import serve
 
-# If you have an app factory, import it; else import the Flask instance directly
-# from yourpackage import create_app
-from yourpackage import create_app
+from app import create_app
+from config import Config
 
 app = create_app()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    serve(app, host="127.0.0.1", port=port)
+    # progress streams hold a thread each while open (see PROGRESS_MAX_STREAMS)
+    serve(app, host="127.0.0.1", port=port, threads=Config.WAITRESS_THREADS)